@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the LatencyTracker class, which keeps the recent latencies of every
+upstream and derives its timeout and hedging delay from them, and the HedgeBudget class,
+which caps how many hedged (duplicate) requests the bot sends.
+
+A fixed timeout is either too short for a slow upstream or too long for a fast one. Once
+an upstream has answered `min_samples` times, its timeout becomes `multiplier` times its
+p99 latency, kept between `min_timeout` and `max_timeout`. Only requests that got an
+answer are latency samples: a request that timed out is counted apart, since recording it
+at its timeout would raise the p99 to that timeout, and the next timeout to `multiplier`
+times it, until every upstream that stopped answering waits `max_timeout` on each request.
+A timeout can still grow, but only as far as the answers actually seen warrant.
+
+A hedged request sends a duplicate once the first request has taken longer than the
+upstream's p95, and uses whichever answers first. Only about 5% of requests take that long,
+and the budget caps the duplicates at `ratio` of the requests sent, so hedging cuts the
+tail latency without adding much load to the upstream.
+
+Attributes:
+---
+    latencies: The LatencyTracker shared by the whole bot, exported as metrics.
+    hedge_budget: The HedgeBudget shared by the whole bot, exported as metrics.
+
+Methods:
+---
+    LatencyTracker.record: Records the latency of a request.
+    LatencyTracker.record_timeout: Counts a request that timed out.
+    LatencyTracker.timeout: Returns the timeout of an upstream's next request.
+    LatencyTracker.hedge_delay: Returns how long to wait before hedging a request.
+    HedgeBudget.acquire: Takes a token for a hedged request, if there is one.
+"""
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from metrics import REGISTRY
+
+
+class _Window:
+    # the last `size` latencies of an upstream; the sorted copy used for the
+    # percentiles is rebuilt at most once per `size // 10` new samples
+    __slots__ = ("samples", "sorted", "stale")
+
+    def __init__(self, size: int) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.sorted: List[float] = []
+        self.stale = 0
+
+    def percentile(self, quantile: float) -> float:
+        if self.stale and (self.stale >= max(1, self.samples.maxlen // 10) or not self.sorted):
+            self.sorted = sorted(self.samples)
+            self.stale = 0
+        return self.sorted[min(len(self.sorted) - 1, int(len(self.sorted) * quantile))]
+
+
+class LatencyTracker:
+    """
+    The recent latencies of every upstream, and the timeouts and hedging delays derived
+    from them.
+
+    The settings are read from the environment: UPSTREAM_TIMEOUT_MULTIPLIER (default 3),
+    UPSTREAM_TIMEOUT_MIN (0.25 seconds) and UPSTREAM_TIMEOUT_MAX (10 seconds).
+
+    Attributes:
+    ---
+        - window (int): The number of recent latencies kept per upstream.
+        - min_samples (int): The number of latencies needed before they are used.
+        - multiplier (float): The timeout is this many times the p99 latency.
+        - min_timeout (float): The shortest timeout given, in seconds.
+        - max_timeout (float): The longest timeout given, in seconds.
+
+    Methods:
+    ---
+        - record(self, upstream, seconds) -> None: Records the latency of a request.
+        - record_timeout(self, upstream) -> None: Counts a request that timed out.
+        - percentile(self, upstream, quantile) -> Optional[float]: Returns a latency percentile.
+        - timeout(self, upstream, default) -> float: Returns the timeout of the next request.
+        - hedge_delay(self, upstream) -> Optional[float]: Returns the delay before hedging.
+        - stats(self) -> Dict[str, Dict[str, float]]: Returns the percentiles and timeouts.
+        - timeouts(self) -> Dict[str, int]: Returns the number of timed out requests.
+    """
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        window: int = 200,
+        min_samples: int = 20,
+        multiplier: Optional[float] = None,
+        min_timeout: Optional[float] = None,
+        max_timeout: Optional[float] = None,
+    ) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self.multiplier = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3")) if multiplier is None else multiplier
+        self.min_timeout = float(os.getenv("UPSTREAM_TIMEOUT_MIN", "0.25")) if min_timeout is None else min_timeout
+        self.max_timeout = float(os.getenv("UPSTREAM_TIMEOUT_MAX", "10")) if max_timeout is None else max_timeout
+        self._windows: Dict[str, _Window] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, upstream: str, seconds: float) -> None:
+        """
+        Records the latency of a request that got an answer. Requests that timed out go
+        to `record_timeout` instead, and requests failing for other reasons say nothing
+        about the latency and are not recorded.
+
+        Args:
+        ---
+            - upstream (str): The name of the upstream.
+            - seconds (float): The latency of the request.
+        """
+        with self._lock:
+            window = self._windows.get(upstream)
+            if window is None:
+                window = self._windows[upstream] = _Window(self.window)
+            window.samples.append(seconds)
+            window.stale += 1
+
+    def record_timeout(self, upstream: str) -> None:
+        """
+        Counts a request that timed out. It is not a latency sample, so it leaves the
+        upstream's timeout as it is.
+
+        Args:
+        ---
+            - upstream (str): The name of the upstream.
+        """
+        with self._lock:
+            self._timeouts[upstream] = self._timeouts.get(upstream, 0) + 1
+
+    def percentile(self, upstream: str, quantile: float) -> Optional[float]:
+        """
+        Returns a percentile of the upstream's recent latencies.
+
+        Args:
+        ---
+            - upstream (str): The name of the upstream.
+            - quantile (float): The percentile, from 0 to 1, e.g. 0.95.
+
+        Returns:
+        ---
+            Optional[float]: The latency in seconds, or None if fewer than `min_samples`
+            latencies were recorded.
+        """
+        with self._lock:
+            window = self._windows.get(upstream)
+            if window is None or len(window.samples) < self.min_samples:
+                return None
+            return window.percentile(quantile)
+
+    def timeout(self, upstream: str, default: float) -> float:
+        """
+        Returns the timeout of the upstream's next request, derived from the latencies of
+        its requests that got an answer.
+
+        Args:
+        ---
+            - upstream (str): The name of the upstream.
+            - default (float): The timeout used until enough latencies are recorded.
+
+        Returns:
+        ---
+            float: The timeout in seconds.
+        """
+        p99 = self.percentile(upstream, 0.99)
+        if p99 is None:
+            return default
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.multiplier))
+
+    def hedge_delay(self, upstream: str) -> Optional[float]:
+        """
+        Returns how long a request to the upstream may take before a hedged duplicate is
+        sent: its p95 latency.
+
+        Args:
+        ---
+            - upstream (str): The name of the upstream.
+
+        Returns:
+        ---
+            Optional[float]: The delay in seconds, or None if too few latencies are recorded
+            to tell a slow request from a normal one.
+        """
+        return self.percentile(upstream, 0.95)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the percentiles and current timeout of every upstream with enough latencies.
+
+        Returns:
+        ---
+            Dict[str, Dict[str, float]]: The "p50", "p95", "p99" and "timeout" of every
+            upstream, in seconds.
+        """
+        stats = {}
+        for upstream in list(self._windows):
+            p50, p95, p99 = (self.percentile(upstream, q) for q in (0.5, 0.95, 0.99))
+            if p99 is not None:
+                stats[upstream] = {
+                    "p50": p50,
+                    "p95": p95,
+                    "p99": p99,
+                    "timeout": self.timeout(upstream, self.max_timeout),
+                }
+        return stats
+
+    def timeouts(self) -> Dict[str, int]:
+        """
+        Returns the number of requests to every upstream that timed out.
+
+        Returns:
+        ---
+            Dict[str, int]: The timed out requests per upstream.
+        """
+        with self._lock:
+            return dict(self._timeouts)
+
+
+class HedgeBudget:
+    """
+    A token bucket capping the hedged requests at a share of the requests sent.
+
+    Every request sent adds `ratio` of a token, up to `burst` tokens, and every hedged
+    request takes a whole one. With the default ratio of 0.05, at most one request in 20
+    is duplicated over time, however slow the upstreams get. Hedging is disabled with
+    HEDGE_RATIO=0.
+
+    Attributes:
+    ---
+        - ratio (float): The share of requests that may be hedged.
+        - burst (float): The most tokens saved up.
+        - sent (int): The number of hedged requests sent.
+        - won (int): The number of hedged requests that answered first.
+        - denied (int): The number of hedges skipped because the budget was spent.
+
+    Methods:
+    ---
+        - deposit(self) -> None: Adds the share of a token earned by a request.
+        - acquire(self) -> bool: Takes a token for a hedged request, if there is one.
+        - record_win(self) -> None: Counts a hedged request that answered first.
+        - stats(self) -> Dict[str, float]: Returns the budget's counters.
+    """
+
+    def __init__(self, ratio: Optional[float] = None, burst: float = 10.0) -> None:
+        self.ratio = float(os.getenv("HEDGE_RATIO", "0.05")) if ratio is None else ratio
+        self.burst = burst
+        self.sent = 0
+        self.won = 0
+        self.denied = 0
+        self._tokens = burst if self.ratio > 0 else 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """
+        Adds the share of a token earned by sending a request.
+        """
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def acquire(self) -> bool:
+        """
+        Takes a token for a hedged request.
+
+        Returns:
+        ---
+            bool: True if the hedged request may be sent.
+        """
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.sent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def record_win(self) -> None:
+        """
+        Counts a hedged request that answered before the request it duplicated.
+        """
+        with self._lock:
+            self.won += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the budget's counters.
+
+        Returns:
+        ---
+            Dict[str, float]: The hedges "sent", "won" and "denied", and the "tokens" left.
+        """
+        with self._lock:
+            return {"sent": self.sent, "won": self.won, "denied": self.denied, "tokens": self._tokens}
+
+
+latencies = LatencyTracker()
+hedge_budget = HedgeBudget()
+
+REGISTRY.callback(
+    "tr4shbot_upstream_timeout_seconds",
+    "Timeout currently given to each upstream's requests, derived from its latency.",
+    ("upstream",),
+    lambda: {(name,): stats["timeout"] for name, stats in latencies.stats().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_upstream_latency_p95_seconds",
+    "p95 latency of each upstream's recent requests, after which a request is hedged.",
+    ("upstream",),
+    lambda: {(name,): stats["p95"] for name, stats in latencies.stats().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_upstream_timeouts_total",
+    "Requests to each upstream that timed out, which are not counted as latency samples.",
+    ("upstream",),
+    lambda: {(name,): count for name, count in latencies.timeouts().items()},
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_hedged_requests_total",
+    "Hedged requests by outcome: sent, won (answered first) and denied by the budget.",
+    ("outcome",),
+    lambda: {(key,): value for key, value in hedge_budget.stats().items() if key != "tokens"},
+    "counter",
+)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the AnalyticsQueue class, which sends analytics pings in the
+background so they never delay a reply to a command.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    AnalyticsQueue.put: Queues a ping without waiting for it to be sent.
+    AnalyticsQueue.start: Starts the background worker sending queued pings.
+    AnalyticsQueue.close: Sends what is left in the queue and stops the worker.
+    AnalyticsQueue.stats: Returns the queue depth and the sent, failed and dropped counters.
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from http_pool import HttpClient, shared_client
+
+
+class AnalyticsQueue:
+    """
+    A bounded queue of analytics pings, drained in batches by a background task.
+
+    When the queue is full the oldest ping is dropped to make room, since analytics
+    are best effort and must not grow memory without limit. A failed ping is retried
+    with exponential backoff before it is counted as failed.
+
+    Attributes:
+    ---
+        - client (HttpClient): The HTTP client used to send the pings.
+        - maxsize (int): The number of pings kept before the oldest is dropped.
+        - batch_size (int): The number of pings sent concurrently.
+        - max_retries (int): The number of times a failed ping is retried.
+        - backoff (float): The delay before the first retry, in seconds. Doubles every retry.
+        - sent (int): The number of pings sent.
+        - failed (int): The number of pings given up on after every retry failed.
+        - dropped (int): The number of pings dropped because the queue was full.
+
+    Methods:
+    ---
+        - put(self, url) -> None: Queues a ping.
+        - start(self) -> None: Starts the background worker.
+        - close(self, timeout) -> None: Sends what is left in the queue and stops the worker.
+        - stats(self) -> Dict[str, int]: Returns the queue's counters.
+    """
+
+    def __init__(
+        self,
+        client: HttpClient = shared_client,
+        maxsize: int = 1000,
+        batch_size: int = 20,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+    ) -> None:
+        self.client = client
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._events: Deque[str] = deque(maxlen=maxsize)
+        self._pending: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """
+        The number of pings waiting to be sent.
+        """
+        return len(self._events)
+
+    def put(self, url: str) -> None:
+        """
+        Queues a ping, dropping the oldest queued ping if the queue is full.
+
+        Args:
+        ---
+            - url (str): The URL to request.
+        """
+        if len(self._events) == self.maxsize:
+            self.dropped += 1
+        self._events.append(url)
+        if self._pending is not None:
+            self._pending.set()
+
+    def start(self) -> None:
+        """
+        Starts the background worker sending queued pings. Must be called from the event loop.
+        """
+        if self._task is None or self._task.done():
+            self._pending = asyncio.Event()
+            if self._events:
+                self._pending.set()
+            self._task = asyncio.create_task(self._worker())
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """
+        Stops the worker and sends what is left in the queue, without retries.
+
+        Args:
+        ---
+            - timeout (float): The number of seconds to spend flushing the queue.
+                    Pings still queued after that are dropped.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self._flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.dropped += len(self._events)
+        self._events.clear()
+
+    async def _flush(self) -> None:
+        while self._events:
+            await asyncio.gather(*(self._send(url, 0) for url in self._take_batch()))
+
+    def _take_batch(self) -> List[str]:
+        return [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+
+    async def _worker(self) -> None:
+        while True:
+            await self._pending.wait()
+            self._pending.clear()
+            while self._events:
+                in_flight = self._take_batch()
+                try:
+                    await asyncio.gather(
+                        *(self._send_tracked(url, in_flight) for url in list(in_flight))
+                    )
+                except asyncio.CancelledError:
+                    # close() cancelled the batch: what was not done yet goes back to the
+                    # front of the queue for close() to flush (a ping cut off mid-request
+                    # may be sent twice)
+                    self._requeue(in_flight)
+                    raise
+
+    async def _send_tracked(self, url: str, in_flight: List[str]) -> None:
+        await self._send(url, self.max_retries)
+        in_flight.remove(url)
+
+    def _requeue(self, urls: List[str]) -> None:
+        # extendleft on a full deque discards from the right, so those are counted as dropped
+        self.dropped += max(0, len(self._events) + len(urls) - self.maxsize)
+        self._events.extendleft(reversed(urls))
+
+    async def _send(self, url: str, retries: int) -> None:
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                # server errors are worth retrying, client errors are not
+                if await self.client.get(url, upstream="giphy_analytics") < 500:
+                    self.sent += 1
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint:disable=broad-except
+                pass
+            if attempt < retries:
+                await asyncio.sleep(delay)
+                delay *= 2
+        self.failed += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the queue's counters.
+
+        Returns:
+        ---
+            Dict[str, int]: The queue depth and the number of sent, failed and dropped pings.
+        """
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
@@ -5,98 +5,377 @@
 This module consists of two classes, DogFact and CatFact, that are used to retrieve
 random facts about dogs and cats, respectively, from online APIs.
 
+Both classes keep a pool of prefetched facts that a background task refills in batches,
+so a command only has to pop a fact from memory.
+
+The module is a plugin providing the dog and cat fact commands. The pools are kept in the
+plugin's state, so a reload keeps the facts already fetched.
+
 Attributes:
 ---
-    None
+    plugin: The plugin declaring the dog_facts and cat_facts commands.
+    dog_fact: The DogFact instance, built on first use.
+    cat_fact: The CatFact instance, built on first use.
 
 Methods:
 ---
-    random_fact: Retrieves a random fact from an online API and returns it as a string.
+    random_fact: Returns a random fact from the pool as a string.
 """
-import requests
+import abc
+import asyncio
+import os
+import random
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+from http_pool import HttpClient, shared_client
+from circuit_breaker import CircuitOpenError
+from command_aliases import Commands
+from plugin_loader import Plugin
 
 
-class DogFact:
+class FactPool(abc.ABC):
     """
-    This class is used to retrieve random dog facts from an online API.
+    A bounded pool of facts prefetched from an online API.
+
+    A background task refills the pool in batches whenever it drops below `low_water`.
+    Facts served recently are skipped when refilling, so the same fact is not repeated
+    back to back. If the API can't be reached (or its circuit breaker is open) and the pool
+    is empty, a fact is picked from the optional seed corpus instead: a text file with one
+    fact per line, or failing that from the facts served recently.
+
+    Subclasses override `params` with the query asking the API for `batch_size` facts,
+    implement `parse` to pull the facts out of the response and set `upstream`, the name
+    their requests are recorded under in the metrics.
 
     Attributes:
     ---
-        None
+        - url (str): The URL of the fact API.
+        - client (HttpClient): The HTTP client used to reach the API.
+        - pool_size (int): The number of facts the pool is refilled up to.
+        - low_water (int): The pool size below which a refill is started.
+        - batch_size (int): The number of facts asked for per request.
+        - seed_path (Optional[str]): The path of the seed corpus.
+        - hits (int): The number of facts served from the pool.
+        - misses (int): The number of facts asked for while the pool was empty.
 
     Methods:
     ---
-        random_fact: Returns a random dog fact as a string.
+        - random_fact(self) -> str: Returns a fact from the pool.
+        - start(self) -> None: Starts the background refill task.
+        - stop(self) -> None: Stops the background refill task.
+        - parse(self, resp) -> List[str]: Returns the facts in an API response.
+        - stats(self) -> Dict[str, int]: Returns the pool's counters.
     """
 
-    def __init__(self) -> None:
+    upstream: Optional[str] = None
+    # only until the API's latency is known, then HttpClient derives the timeout from it
+    fetch_timeout = 5.0
+    max_backoff = 60.0
+
+    def __init__(
+        self,
+        url: str,
+        client: HttpClient = shared_client,
+        pool_size: int = 20,
+        low_water: int = 5,
+        batch_size: int = 5,
+        recent_size: int = 50,
+        seed_path: Optional[str] = None,
+    ) -> None:
+        self.url = url
+        self.client = client
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.seed_path = seed_path
+        self.hits = 0
+        self.misses = 0
+        self._pool: Deque[str] = deque()
+        self._recent: Deque[str] = deque(maxlen=recent_size)
+        self._seed: Optional[List[str]] = None
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def params(self) -> Dict[str, Any]:
         """
-        The constructor for the DogFact class.
+        The query parameters asking the API for `batch_size` facts.
+        """
+        return {}
+
+    @abc.abstractmethod
+    def parse(self, resp: Any) -> List[str]:
+        """
+        Returns the facts in an API response.
 
         Args:
         ---
-            None
+            resp (Any): The decoded JSON response.
 
         Returns:
         ---
-            None
+            List[str]: The facts.
         """
 
-    def random_fact(self) -> str:
+    def start(self) -> None:
         """
-        Retrieves a random dog fact from an online API and returns it as a string.
+        Starts the background task refilling the pool. Must be called from the event loop.
+        """
+        if self._task is None or self._task.done():
+            self._refill_needed = asyncio.Event()
+            self._refill_needed.set()
+            self._task = asyncio.create_task(self._refill_loop())
 
-        Args:
+    async def stop(self) -> None:
+        """
+        Stops the background task refilling the pool.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def random_fact(self) -> str:
+        """
+        Returns a fact from the pool.
+
+        If the pool is empty the API is asked directly, and if that fails a fact from
+        the seed corpus is returned.
+
+        Returns:
         ---
-            None
+            str: A random fact.
+
+        Raises:
+        ---
+            Exception: The error from the API if the pool is empty, the API can't be
+                reached and there is no seed corpus nor recently served fact.
+            LookupError: If the API answered without any fact and there is no recently
+                served fact nor seed corpus to fall back on.
+        """
+        self.start()
+        if not self._pool:
+            self.misses += 1
+            try:
+                await self._fetch_batch()
+            except Exception:  # pylint:disable=broad-except
+                fallback = self._load_seed() or self._recent
+                if not fallback:
+                    raise
+                return random.choice(fallback)
+        else:
+            self.hits += 1
+        if not self._pool:
+            # the whole batch had been served recently, or the API sent no facts at all
+            fallback = self._recent or self._load_seed()
+            if not fallback:
+                raise LookupError(f"{self.upstream} returned no facts")
+            return random.choice(fallback)
+        fact = self._pool.popleft()
+        self._recent.append(fact)
+        if len(self._pool) < self.low_water:
+            self._refill_needed.set()
+        return fact
+
+    async def _fetch_batch(self) -> int:
+        resp = await self.client.get_json(
+            self.url, params=self.params, timeout=self.fetch_timeout, upstream=self.upstream
+        )
+        seen: Set[str] = set(self._pool)
+        seen.update(self._recent)
+        added = 0
+        for fact in self.parse(resp):
+            if fact not in seen and len(self._pool) < self.pool_size:
+                self._pool.append(fact)
+                seen.add(fact)
+                added += 1
+        return added
+
+    async def _refill_loop(self) -> None:
+        backoff = 1.0
+        while True:
+            await self._refill_needed.wait()
+            try:
+                while len(self._pool) < self.pool_size:
+                    if not await self._fetch_batch():
+                        # every fact in the batch was a duplicate, wait for the next refill
+                        break
+                backoff = 1.0
+                self._refill_needed.clear()
+            except asyncio.CancelledError:
+                raise
+            except CircuitOpenError as error:
+                # no point asking before the breaker lets a trial request through
+                await asyncio.sleep(max(error.retry_in, 1.0))
+            except Exception:  # pylint:disable=broad-except
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the pool's counters.
 
         Returns:
         ---
-            str: A random dog fact.
+            Dict[str, int]: The facts served from the pool ("hits"), the facts asked for
+            while it was empty ("misses") and the number of facts in the pool ("entries").
         """
-        return requests.get("https://dogapi.dog/api/facts", timeout=1).json()["facts"][
-            0
-        ]
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._pool)}
 
+    def _load_seed(self) -> List[str]:
+        if self._seed is None:
+            self._seed = []
+            if self.seed_path is not None and os.path.exists(self.seed_path):
+                with open(self.seed_path, encoding="utf-8") as seed_file:
+                    self._seed = [line.strip() for line in seed_file if line.strip()]
+        return self._seed
 
-class CatFact:
+
+class DogFact(FactPool):
     """
-    This class is used to retrieve random cat facts from an online API.
+    This class is used to retrieve random dog facts from an online API.
 
     Attributes:
     ---
-        None
+        url (str): The URL of the dog fact API.
+        client (HttpClient): The HTTP client used to reach the API.
 
     Methods:
     ---
-        random_fact: Returns a random cat fact as a string.
+        random_fact: Returns a random dog fact as a string.
     """
 
-    def __init__(self) -> None:
+    upstream = "dogapi"
+
+    def __init__(
+        self,
+        url: str = "https://dogapi.dog/api/facts",
+        client: HttpClient = shared_client,
+        seed_path: Optional[str] = "data/dog_facts.txt",
+        **kwargs,
+    ) -> None:
         """
-        The constructor for the CatFact class.
+        The constructor for the DogFact class.
 
         Args:
         ---
-            None
+            url (str): The URL of the dog fact API.
+            client (HttpClient): The HTTP client used to reach the API.
+                Defaults to the client shared by the bot.
+            seed_path (Optional[str]): The path of the seed corpus used when the API is down.
+            **kwargs: The pool settings passed on to FactPool.
 
         Returns:
         ---
             None
         """
+        super().__init__(url, client, seed_path=seed_path, **kwargs)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"number": self.batch_size}
 
-    def random_fact(self) -> str:
+    def parse(self, resp: Any) -> List[str]:
+        return resp["facts"]
+
+
+class CatFact(FactPool):
+    """
+    This class is used to retrieve random cat facts from an online API.
+
+    Attributes:
+    ---
+        url (str): The URL of the cat fact API.
+        client (HttpClient): The HTTP client used to reach the API.
+
+    Methods:
+    ---
+        random_fact: Returns a random cat fact as a string.
+    """
+
+    upstream = "meowfacts"
+
+    def __init__(
+        self,
+        url: str = "https://meowfacts.herokuapp.com/",
+        client: HttpClient = shared_client,
+        seed_path: Optional[str] = "data/cat_facts.txt",
+        **kwargs,
+    ) -> None:
         """
-        Retrieves a random cat fact from an online API and returns it as a string.
+        The constructor for the CatFact class.
 
         Args:
         ---
-            None
+            url (str): The URL of the cat fact API.
+            client (HttpClient): The HTTP client used to reach the API.
+                Defaults to the client shared by the bot.
+            seed_path (Optional[str]): The path of the seed corpus used when the API is down.
+            **kwargs: The pool settings passed on to FactPool.
 
         Returns:
         ---
-            str: A random cat fact.
+            None
         """
-        return requests.get("https://meowfacts.herokuapp.com/", timeout=1).json()[
-            "data"
-        ][0]
+        super().__init__(url, client, seed_path=seed_path, **kwargs)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"count": self.batch_size}
+
+    def parse(self, resp: Any) -> List[str]:
+        return resp["data"]
+
+
+###### PLUGIN ######
+
+plugin = Plugin("animal_fact", description="Random dog and cat facts.")
+
+
+def _load_dog_fact() -> DogFact:
+    pool = DogFact()
+    plugin.cache("dog_facts", pool.stats)
+    return pool
+
+
+def _load_cat_fact() -> CatFact:
+    pool = CatFact()
+    plugin.cache("cat_facts", pool.stats)
+    return pool
+
+
+dog_fact = plugin.state("dog_fact", _load_dog_fact)
+cat_fact = plugin.state("cat_fact", _load_cat_fact)
+
+
+@plugin.command(
+    Commands().dog_facts(), exact=True, concurrency=8, queue=16, help="Get a random dog fact"
+)
+async def dog_facts(message, tokens):  # pylint:disable=unused-argument
+    """
+    Replies with a random dog fact.
+    """
+    return await dog_fact.get().random_fact()
+
+
+@plugin.command(
+    Commands().cat_facts(), exact=True, concurrency=8, queue=16, help="Get a random cat fact"
+)
+async def cat_facts(message, tokens):  # pylint:disable=unused-argument
+    """
+    Replies with a random cat fact.
+    """
+    return await cat_fact.get().random_fact()
+
+
+@plugin.on_close
+async def stop_pools():
+    """
+    Stops the refill tasks of the pools that were built.
+    """
+    for pool in (dog_fact, cat_fact):
+        if pool.loaded:
+            await pool.get().stop()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the AsyncTTLCache class, an in-memory cache for the results of
+coroutines that also coalesces concurrent requests for the same key.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    AsyncTTLCache.get_or_fetch: Returns the cached value for a key, fetching it if needed.
+    AsyncTTLCache.get_or_stale: Like get_or_fetch, but falls back to an expired value if the
+        fetch fails or is too slow.
+    AsyncTTLCache.stats: Returns the hit, miss and coalescing counters.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class AsyncTTLCache:
+    """
+    A bounded cache of coroutine results with a time to live.
+
+    When a key is missing, only the first caller runs the fetch coroutine; every other
+    caller asking for the same key while the fetch is in flight waits for that same result.
+    Failed fetches are not cached, and their exception is raised to every waiter.
+
+    Expired values are kept for another `stale_ttl` seconds, so `get_or_stale` can serve the
+    last good value while the upstream is down (e.g. while its circuit breaker is open), or
+    while it is too slow to answer within a stale-serve deadline.
+
+    Attributes:
+    ---
+        - ttl (float): The number of seconds a value is kept.
+        - max_entries (int): The number of values kept before the least recently used is evicted.
+        - hits (int): The number of lookups answered by the cache.
+        - misses (int): The number of lookups that started a fetch.
+        - coalesced (int): The number of lookups that waited for another caller's fetch.
+        - stale_ttl (float): The number of seconds an expired value is kept as a fallback.
+        - stale (int): The number of lookups answered with an expired value.
+
+    Methods:
+    ---
+        - get_or_fetch(self, key, fetch) -> Any: Returns the cached value for a key,
+                fetching it if needed.
+        - get_or_stale(self, key, fetch, stale_after) -> Tuple[Any, Optional[float]]: Returns
+                the value for a key and, if an expired value was served, its age.
+        - invalidate(self, key) -> None: Removes a key from the cache.
+        - stats(self) -> Dict[str, int]: Returns the cache's counters.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024, stale_ttl: float = 0.0) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for a key, fetching it if it is missing or expired.
+
+        Args:
+        ---
+            - key (Hashable): The key of the value.
+            - fetch (Callable[[], Awaitable[Any]]): A function returning a coroutine
+                    that fetches the value.
+
+        Returns:
+        ---
+            Any: The value.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        # shielded, so a waiter being cancelled does not cancel the fetch for everyone else
+        return await asyncio.shield(self._fetch_task(key, fetch))
+
+    def _fetch_task(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            # a fetch nobody waits for any more (stale value served) must not log its error
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._in_flight[key] = task
+        return task
+
+    async def get_or_stale(
+        self,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[Any]],
+        stale_after: Optional[float] = None,
+    ) -> Tuple[Any, Optional[float]]:
+        """
+        Returns the cached value for a key, fetching it if it is missing or expired. If the
+        fetch fails and an expired value younger than `stale_ttl` is still kept, that value
+        is returned instead of raising.
+
+        With `stale_after`, the expired value is also returned if the fetch has not finished
+        after that many seconds (0 serves it at once, e.g. while the upstream's breaker is
+        open). The fetch carries on in the background and refreshes the cache.
+
+        Args:
+        ---
+            - key (Hashable): The key of the value.
+            - fetch (Callable[[], Awaitable[Any]]): A function returning a coroutine
+                    that fetches the value.
+            - stale_after (Optional[float]): How long to wait for the fetch before serving
+                    the expired value, in seconds. Defaults to waiting for the fetch.
+
+        Returns:
+        ---
+            Tuple[Any, Optional[float]]: The value, and None if it is fresh or the number
+            of seconds since it expired if it is stale.
+
+        Raises:
+        ---
+            Exception: The error of the fetch, if there is no stale value to fall back to.
+        """
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if (
+            stale_after is not None
+            and entry is not None
+            and entry[1] <= now
+            and now - entry[1] <= self.stale_ttl
+        ):
+            task = self._fetch_task(key, fetch)
+            await asyncio.wait({task}, timeout=stale_after)
+            if task.done() and not task.cancelled() and task.exception() is None:
+                return task.result(), None
+            self.stale += 1
+            return entry[0], time.monotonic() - entry[1]
+        try:
+            return await self.get_or_fetch(key, fetch), None
+        except Exception:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise
+            age = time.monotonic() - entry[1]
+            if age > self.stale_ttl:
+                raise
+            self.stale += 1
+            return entry[0], age
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+        finally:
+            del self._in_flight[key]
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        # expired values past their stale window are dropped as the cache turns over
+        oldest = next(iter(self._entries))
+        if time.monotonic() - self._entries[oldest][1] > self.stale_ttl:
+            del self._entries[oldest]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Removes a key from the cache. A fetch already in flight is not affected.
+
+        Args:
+        ---
+            - key (Hashable): The key to remove.
+        """
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+        ---
+            Dict[str, int]: The number of hits, misses, coalesced lookups, stale values
+            served, entries and fetches in flight.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale": self.stale,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures how many greetings per second helper.random_greeting can produce, comparing the
+old implementation (rebuilding the greeting list with set/map/lambda on every call) with
+the precomputed tables of GreetingEngine.
+
+Run from the repository root:
+    python benchmarks/bench_greeting.py [--calls N]
+
+Both implementations are also checked to produce the same set of greetings.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import helper  # pylint:disable=wrong-import-position
+from command_aliases import Commands  # pylint:disable=wrong-import-position
+from greetings import GreetingTable  # pylint:disable=wrong-import-position
+
+
+def legacy_random_greeting(name: str = "<NAME>") -> str:
+    """
+    helper.random_greeting before the greeting tables.
+    """
+    commands = Commands()
+    greetings = list(
+        set(
+            commands.greets()
+            + [
+                "How's it going?",
+                "How are ya?",
+                "How's it hangin'?",
+                "what's up?",
+                "good'ay",
+            ]
+        )
+    )
+    return random.choice(
+        list(
+            map(
+                lambda word: f"{word[1:].capitalize()}, {name.capitalize()}!"
+                if word.startswith("!")
+                else f"{word.capitalize()}, {name.capitalize()}!",
+                greetings,
+            )
+        )
+    ).capitalize()
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints greetings/sec for both implementations.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+
+    legacy = {legacy_random_greeting("Bob") for _ in range(5_000)}
+    current = {helper.random_greeting("Bob") for _ in range(5_000)}
+    print(f"same greetings: {legacy == current} ({len(current)} distinct)")
+
+    weighted = GreetingTable({"Hej": 5, "Goddag": 1, "Hejsa": 2})
+    variants = [
+        ("legacy set/map/lambda", lambda: legacy_random_greeting("Bob")),
+        ("greeting table", lambda: helper.random_greeting("Bob")),
+        ("weighted table", lambda: weighted.pick("Bob")),
+    ]
+    baseline = None
+    for name, call in variants:
+        elapsed = timeit.timeit(call, number=args.calls)
+        per_call = elapsed / args.calls * 1e6
+        baseline = baseline or per_call
+        print(
+            f"{name:<24} {args.calls / elapsed:>12,.0f} calls/s"
+            f"  {per_call:>7.2f} us/call  ({baseline / per_call:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
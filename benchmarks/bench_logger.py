@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures how many chat events per second Logger can take, comparing the old
+write-and-flush-per-event approach with the buffered writer in every durability mode.
+
+Run from the repository root:
+    python benchmarks/bench_logger.py [--events N]
+
+The number reported for the buffered writer is the rate at which the event loop can hand
+off events (what on_message pays), followed by the time needed to drain them to disk.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logger import Logger  # pylint:disable=wrong-import-position
+from log_writer import DURABILITY_MODES  # pylint:disable=wrong-import-position
+
+
+def fake_message(i: int) -> SimpleNamespace:
+    """
+    Builds an object with the attributes Logger reads from a discord.Message.
+    """
+    return SimpleNamespace(
+        content=f"message number {i} with a little bit of text in it",
+        created_at="2022-12-24 12:00:00.000000+00:00",
+        author=SimpleNamespace(name="user", discriminator="0001"),
+        channel=SimpleNamespace(name="general"),
+    )
+
+
+def bench_legacy(path: str, messages: list) -> float:
+    """
+    The logging loop before buffering: one write and one flush per event.
+    """
+    logger = Logger.__new__(Logger)
+    with open(path, "a+", encoding="utf-8") as log_file:
+        start = time.perf_counter()
+        for message in messages:
+            msg = f"{logger.log_boilerplate(message, 'CHAT')} {message.content}"
+            log_file.write(f"{msg}\n")
+            log_file.flush()
+        return time.perf_counter() - start
+
+
+def bench_buffered(directory: str, messages: list, durability: str) -> tuple:
+    """
+    The logging loop with Logger's buffered writers. Returns the hand-off and drain times.
+    """
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        logger = Logger(durability=durability)
+        start = time.perf_counter()
+        for message in messages:
+            logger.chat_log(message)
+        handed_off = time.perf_counter() - start
+        logger.close_files()
+        return handed_off, time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints events/sec for every variant.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--event-mode-events", type=int, default=2_000,
+                        help="events for the fsync-per-event mode, which is much slower")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        messages = [fake_message(i) for i in range(args.events)]
+        elapsed = bench_legacy(os.path.join(directory, "legacy.log"), messages)
+        print(f"{'legacy write+flush':<24} {args.events / elapsed:>12,.0f} events/s")
+        for durability in DURABILITY_MODES:
+            count = args.event_mode_events if durability == "event" else args.events
+            run_dir = os.path.join(directory, durability)
+            os.makedirs(run_dir)
+            handed_off, drained = bench_buffered(run_dir, messages[:count], durability)
+            print(
+                f"{'buffered/' + durability:<24} {count / handed_off:>12,.0f} events/s"
+                f"  (drained to disk at {count / drained:,.0f} events/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Drills the circuit breakers and stale fallbacks against a local, fault-injecting stub of the
+upstream APIs (dog facts, OpenWeatherMap and Giphy search).
+
+The stub server answers like the real APIs until a fault is injected: "error" answers
+503, "timeout" holds every request past the client's timeout, and "flaky" fails a share of
+the requests. The drill runs the real DogFact, Weather and Giphy classes against it through
+three phases (healthy, outage, recovery) and reports per phase how each call ended (fresh,
+stale, fast failure, slow failure), its latency, and the breakers' states.
+
+Run from the repository root:
+    python benchmarks/fault_drill.py [--fault timeout|error|flaky] [--phase SECONDS]
+    python benchmarks/fault_drill.py --serve [--port 8099]   # only run the stub server
+
+With --serve, faults are injected with e.g. `curl "localhost:8099/_fault?mode=timeout"`.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # pylint:disable=wrong-import-position
+
+FAULT_MODES = ("ok", "error", "timeout", "flaky")
+
+
+class FaultServer:
+    """
+    A stub of the upstream APIs with injectable faults.
+
+    Attributes:
+    ---
+        - mode (str): One of FAULT_MODES.
+        - flaky_rate (float): The share of requests failed in "flaky" mode.
+        - hang (float): How long requests are held in "timeout" mode, in seconds.
+        - requests (int): The number of API requests received.
+    """
+
+    def __init__(self, hang: float = 5.0, flaky_rate: float = 0.7) -> None:
+        self.mode = "ok"
+        self.flaky_rate = flaky_rate
+        self.hang = hang
+        self.requests = 0
+        self.base_url = ""
+        self._runner = None
+
+    def app(self) -> web.Application:
+        """
+        Builds the stub's routes.
+        """
+        app = web.Application()
+        app.router.add_get("/_fault", self.set_fault)
+        app.router.add_get("/api/facts", self.faulty(self.dog_facts))
+        app.router.add_get("/data/2.5/weather", self.faulty(self.weather))
+        app.router.add_get("/v1/randomid", self.faulty(self.random_id))
+        app.router.add_get("/v1/{kind}/search", self.faulty(self.search))
+        app.router.add_get("/onsent", lambda request: web.Response(text="ok"))
+        return app
+
+    async def set_fault(self, request: web.Request) -> web.Response:
+        """
+        Changes the fault mode: /_fault?mode=timeout
+        """
+        mode = request.query.get("mode", "ok")
+        if mode not in FAULT_MODES:
+            return web.Response(status=400, text=f"mode must be one of {FAULT_MODES}")
+        self.mode = mode
+        return web.Response(text=mode)
+
+    def faulty(self, handler):
+        """
+        Wraps a route so it fails according to the fault mode.
+        """
+
+        async def route(request: web.Request) -> web.Response:
+            self.requests += 1
+            if self.mode == "error" or (self.mode == "flaky" and random.random() < self.flaky_rate):
+                return web.Response(status=503, text="injected fault")
+            if self.mode == "timeout":
+                await asyncio.sleep(self.hang)
+            return await handler(request)
+
+        return route
+
+    async def dog_facts(self, request: web.Request) -> web.Response:
+        number = int(request.query.get("number", "1"))
+        return web.json_response({"facts": [f"dog fact {random.random()}" for _ in range(number)]})
+
+    async def weather(self, request: web.Request) -> web.Response:  # pylint:disable=unused-argument
+        return web.json_response({
+            "weather": [{"main": "Clouds"}],
+            "main": {"temp": 4.2, "feels_like": 1.3, "humidity": 87},
+            "wind": {"speed": 6.1},
+        })
+
+    async def random_id(self, request: web.Request) -> web.Response:  # pylint:disable=unused-argument
+        return web.json_response({"data": {"random_id": "drill"}})
+
+    async def search(self, request: web.Request) -> web.Response:
+        query = request.query.get("q", "")
+        return web.json_response({"data": [
+            {
+                "url": f"{self.base_url}/{query}/{n}",
+                "analytics": {"onsent": {"url": f"{self.base_url}/onsent"}},
+                "analytics_response_payload": "drill",
+            }
+            for n in range(3)
+        ]})
+
+    async def start(self, port: int = 0) -> str:
+        """
+        Starts serving on localhost and returns the base URL.
+        """
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint:disable=protected-access
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        """
+        Stops serving.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def call(name: str, coroutine) -> Tuple[str, str, float]:
+    """
+    Runs one command call and classifies how it ended.
+
+    Returns:
+    ---
+        Tuple[str, str, float]: The command, the outcome and the latency in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        reply = await coroutine
+    except Exception as error:  # pylint:disable=broad-except
+        outcome = "fast failure" if time.perf_counter() - start < 0.05 else "slow failure"
+        return name, f"{outcome} ({type(error).__name__})", time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    if "unavailable right now" in reply:
+        outcome = "fast failure (reply)" if elapsed < 0.05 else "slow failure (reply)"
+    elif "is unavailable, this is" in reply:
+        outcome = "stale"
+    else:
+        outcome = "fresh"
+    return name, outcome, elapsed
+
+
+async def drill(fault: str, phase: float, rate: float) -> None:
+    """
+    Runs the healthy, outage and recovery phases and prints what each call saw.
+    """
+    # the components keep their caches under data/, so run in a scratch directory
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("openWeather_API_KEY", "drill")
+    os.environ.setdefault("giphy_API_KEY", "drill")
+    from animal_fact import DogFact  # pylint:disable=import-outside-toplevel
+    from async_cache import AsyncTTLCache  # pylint:disable=import-outside-toplevel
+    from analytics_queue import AnalyticsQueue  # pylint:disable=import-outside-toplevel
+    from circuit_breaker import BreakerRegistry  # pylint:disable=import-outside-toplevel
+    from giphy import Giphy  # pylint:disable=import-outside-toplevel
+    from http_pool import HttpClient  # pylint:disable=import-outside-toplevel
+    import helper  # pylint:disable=import-outside-toplevel
+    from weather_file import Weather  # pylint:disable=import-outside-toplevel
+
+    server = FaultServer()
+    base = await server.start()
+    breakers = BreakerRegistry(failure_rate=0.5, min_calls=5, window=10.0, open_for=phase / 2)
+    # every upstream is the same stub host here, so don't let them queue behind each other
+    client = HttpClient(timeout=1.0, host_limits={}, default_host_limit=64, breakers=breakers)
+    helper.geocode_cache.put("drilltown", (55.47, 8.45))
+    weather_cache = AsyncTTLCache(ttl=0.5, stale_ttl=3600)
+    dog = DogFact(url=f"{base}/api/facts", client=client, seed_path=None, pool_size=5, low_water=2)
+    dog.fetch_timeout = 1.0
+    giphy = Giphy(base_url=base, client=client, random_id_path=None, cache_ttl=0.5,
+                  analytics=AnalyticsQueue(client))
+    giphy.analytics.start()
+
+    def commands():
+        return [
+            ("weather", Weather("drilltown", url=f"{base}/data/2.5/weather", client=client,
+                                cache=weather_cache).weather()),
+            ("gif", giphy.get_gif(["cats"])),
+            ("dog_facts", dog.random_fact()),
+        ]
+
+    phases = [("healthy", "ok"), ("outage", fault), ("recovery", "ok")]
+    try:
+        for phase_name, mode in phases:
+            server.mode = mode
+            # open loop: users keep sending commands whether or not earlier ones answered
+            tasks: List[asyncio.Task] = []
+            end = time.monotonic() + phase
+            while time.monotonic() < end:
+                tasks.extend(asyncio.create_task(call(n, c)) for n, c in commands())
+                await asyncio.sleep(1 / rate)
+            results: List[Tuple[str, str, float]] = await asyncio.gather(*tasks)
+            report(phase_name, mode, results, breakers.stats())
+    finally:
+        await dog.stop()
+        await giphy.analytics.close(timeout=1.0)
+        await client.close()
+        await server.stop()
+
+
+def report(phase: str, mode: str, results: List[Tuple[str, str, float]],
+           breakers: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Prints the outcomes and latencies of a phase, per command, and the breakers' states.
+    """
+    print(f"\n== {phase} (fault: {mode}) ==")
+    by_command: Dict[str, List[Tuple[str, float]]] = {}
+    for name, outcome, latency in results:
+        by_command.setdefault(name, []).append((outcome, latency))
+    for name, calls in by_command.items():
+        latencies = sorted(latency for _, latency in calls)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        outcomes = Counter(outcome for outcome, _ in calls)
+        print(f"{name:<10} calls {len(calls):>4}  p50 {statistics.median(latencies) * 1000:8.1f} ms"
+              f"  p99 {p99 * 1000:8.1f} ms  " + ", ".join(f"{k}: {v}" for k, v in outcomes.items()))
+    states = {0: "closed", 1: "half-open", 2: "open"}
+    print("breakers:  " + ", ".join(
+        f"{name} {states[stats['state']]} (opened {stats['opened']}x, rejected {stats['rejected']})"
+        for name, stats in sorted(breakers.items())
+    ))
+
+
+async def serve(port: int) -> None:
+    """
+    Runs only the stub server, until interrupted.
+    """
+    server = FaultServer()
+    print(f"serving on {await server.start(port)}; inject faults with /_fault?mode={'|'.join(FAULT_MODES)}")
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    """
+    Parses the arguments and runs the drill or the stub server.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fault", choices=FAULT_MODES[1:], default="timeout")
+    parser.add_argument("--phase", type=float, default=6.0, help="seconds per phase")
+    parser.add_argument("--rate", type=float, default=10.0, help="rounds of commands per second")
+    parser.add_argument("--serve", action="store_true", help="only run the stub server")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve(args.port))
+    else:
+        asyncio.run(drill(args.fault, args.phase, args.rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures the memory and startup time of discord.py's caches in lean mode against the old
+setup (Intents.all() with the default member and message caches).
+
+Offline (the default), synthetic gateway payloads are fed to the client's connection state
+in a fresh interpreter per mode: a GUILD_CREATE per guild, the member chunks the old setup
+downloads at startup, and a stream of MESSAGE_CREATE events. The memory kept by the caches
+is measured with tracemalloc and the time to process the guilds is reported as startup.
+
+With --live and the TOKEN environment variable, the bot connects to Discord once per mode
+and reports the time until on_ready and the peak resident memory of the process.
+
+Run from the repository root:
+    python benchmarks/gateway_memory.py [--guilds N] [--members N] [--messages N] [--live]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OFFLINE_SCRIPT = """
+import asyncio, json, os, sys, time, tracemalloc
+sys.path.insert(0, {repo!r})
+import discord
+from discord.member import Member
+import bot
+from gateway import client_options, enabled_events
+
+GUILDS, MEMBERS, MESSAGES, LEAN = {guilds}, {members}, {messages}, {lean}
+LARGE_THRESHOLD = 250
+
+
+def user(user_id):
+    return {{"id": str(user_id), "username": f"user{{user_id}}", "discriminator": "0001", "avatar": None}}
+
+
+def member(user_id):
+    return {{"user": user(user_id), "roles": [], "joined_at": "2022-12-24T18:00:00+00:00",
+             "deaf": False, "mute": False}}
+
+
+def presence(user_id):
+    return {{"user": {{"id": str(user_id)}}, "status": "online", "activities": [],
+             "client_status": {{"desktop": "online"}}}}
+
+
+def guild_payload(guild_id, intents):
+    first = guild_id * 1_000_000
+    # Discord sends up to large_threshold members (and their presences) in GUILD_CREATE,
+    # and only with the members and presences intents
+    members = range(first, first + min(MEMBERS, LARGE_THRESHOLD)) if intents.members else range(first, first + 1)
+    return {{
+        "id": str(guild_id), "name": f"guild{{guild_id}}", "member_count": MEMBERS,
+        "large": MEMBERS > LARGE_THRESHOLD, "owner_id": str(first),
+        "roles": [{{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0,
+                    "color": 0, "hoist": False, "managed": False, "mentionable": False}}],
+        "channels": [{{"id": str(guild_id * 10 + n), "type": 0, "name": f"channel{{n}}", "position": n,
+                       "permission_overwrites": []}} for n in range(5)],
+        "members": [member(user_id) for user_id in members],
+        "presences": [presence(user_id) for user_id in members] if intents.presences else [],
+        "emojis": [], "stickers": [], "threads": [], "voice_states": [], "features": [],
+    }}
+
+
+def message_payload(n):
+    guild_id = n % GUILDS + 1
+    author = guild_id * 1_000_000 + n % MEMBERS
+    return {{"id": str(10**12 + n), "channel_id": str(guild_id * 10 + n % 5), "guild_id": str(guild_id),
+             "author": user(author), "member": {{"roles": [], "joined_at": "2022-12-24T18:00:00+00:00",
+             "deaf": False, "mute": False}}, "content": f"message number {{n}} with some chatter",
+             "timestamp": "2022-12-24T18:00:00+00:00", "edited_timestamp": None, "tts": False,
+             "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+             "embeds": [], "pinned": False, "type": 0}}
+
+
+async def run():
+    names = enabled_events([handler.__name__ for handler in bot.EVENT_HANDLERS], LEAN)
+    options = client_options(names, LEAN)
+    client = discord.Client(**options)
+    state = client._connection
+    intents = options["intents"]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for guild_id in range(1, GUILDS + 1):
+        guild = state._add_guild_from_data(guild_payload(guild_id, intents))
+        if options.get("chunk_guilds_at_startup", True) and intents.members:
+            # the member chunks requested for every guild at startup
+            first = guild_id * 1_000_000
+            for user_id in range(first + LARGE_THRESHOLD, first + MEMBERS):
+                guild._add_member(Member(data=member(user_id), guild=guild, state=state))
+    startup = time.perf_counter() - start
+    after_guilds = tracemalloc.get_traced_memory()[0]
+    for n in range(MESSAGES):
+        state.parse_message_create(message_payload(n))
+    current, peak = tracemalloc.get_traced_memory()
+    print(json.dumps({{
+        "startup": startup, "guild_bytes": after_guilds, "total_bytes": current, "peak_bytes": peak,
+        "cached_members": sum(len(guild.members) for guild in client.guilds),
+        "cached_messages": len(state._messages or []),
+        "intents": [name for name, value in intents if value],
+    }}))
+
+asyncio.run(run())
+"""
+
+LIVE_SCRIPT = """
+import asyncio, json, os, resource, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import bot
+
+async def run():
+    client = bot.create_app(lean={lean})
+    async with client:
+        task = asyncio.create_task(client.start(bot.TOKEN))
+        await client.wait_until_ready()
+        elapsed = time.perf_counter() - start
+        guilds, members = len(client.guilds), len(client.users)
+        await client.close()
+        await asyncio.gather(task, return_exceptions=True)
+    await bot.shutdown()
+    return elapsed, guilds, members
+
+elapsed, guilds, members = asyncio.run(run())
+bot.logger.close_files()
+print(json.dumps({{"startup": elapsed, "guilds": guilds, "cached_users": members,
+                   "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}}))
+"""
+
+
+def run_script(script: str, **params) -> Dict:
+    """
+    Runs a measuring script in a fresh interpreter and returns the JSON it printed last.
+    """
+    env = dict(os.environ, METRICS_PORT="", PLUGIN_RELOAD_INTERVAL="0")
+    result = subprocess.run(
+        [sys.executable, "-c", script.format(repo=REPO, **params)],
+        cwd=REPO,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def mib(value: float) -> str:
+    """
+    Formats a number of bytes in MiB.
+    """
+    return f"{value / (1 << 20):8.1f} MiB"
+
+
+def main() -> None:
+    """
+    Measures both modes and prints them side by side.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5000, help="members per guild")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--live", action="store_true",
+                        help="connect to Discord with TOKEN instead of using synthetic payloads")
+    args = parser.parse_args()
+
+    if args.live and not os.getenv("TOKEN"):
+        parser.error("--live needs the TOKEN environment variable")
+    results = {}
+    for name, lean in (("all intents", False), ("lean", True)):
+        if args.live:
+            results[name] = run_script(LIVE_SCRIPT, lean=lean)
+        else:
+            results[name] = run_script(
+                OFFLINE_SCRIPT, guilds=args.guilds, members=args.members,
+                messages=args.messages, lean=lean,
+            )
+
+    for name, result in results.items():
+        if args.live:
+            print(f"{name:<12} on_ready {result['startup'] * 1000:9.1f} ms  "
+                  f"peak RSS {mib(result['peak_rss_bytes'])}  cached users {result['cached_users']}")
+        else:
+            print(f"{name:<12} guilds {result['startup'] * 1000:9.1f} ms  "
+                  f"guild caches {mib(result['guild_bytes'])}  "
+                  f"after messages {mib(result['total_bytes'])}  "
+                  f"members {result['cached_members']:>8}  messages {result['cached_messages']:>5}")
+            print(f"{'':<12} intents: {', '.join(result['intents'])}")
+    if not args.live:
+        full, lean = results["all intents"], results["lean"]
+        print(f"lean keeps {lean['total_bytes'] / max(full['total_bytes'], 1):.1%} of the memory and "
+              f"processes the guilds {full['startup'] / max(lean['startup'], 1e-9):.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures the memory footprint, load time and lookup latency of the offline gazetteer.
+
+By default a synthetic GeoNames-style dump of --cities made-up cities is generated (about
+the size of cities15000.txt); pass --dump to measure a real one, e.g. cities15000.txt or
+cities1000.txt from https://download.geonames.org/export/dump/. The index's memory is
+compared with a plain dict of name -> (name, latitude, longitude, population) tuples, and
+exact, prefix, misspelled ("did you mean") and unknown lookups are timed.
+
+Run from the repository root:
+    python benchmarks/gazetteer_bench.py [--dump cities15000.txt] [--cities N] [--lookups N]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import Gazetteer  # pylint:disable=wrong-import-position
+from geocache import normalize_city  # pylint:disable=wrong-import-position
+
+SYLLABLES = (
+    "ber", "lin", "ham", "burg", "es", "bjerg", "aar", "hus", "ko", "pen", "ha", "gen",
+    "par", "is", "lon", "don", "ma", "drid", "ro", "ma", "vi", "en", "na", "os", "lo",
+    "to", "ky", "o", "san", "ta", "fe", "ville", "ton", "field", "sk", "ov", "grad", "stad",
+)
+COUNTRIES = ("DK", "DE", "FR", "GB", "US", "ES", "IT", "SE", "NO", "PL", "RU", "JP", "BR")
+
+
+def synthetic_dump(path: str, cities: int, seed: int) -> List[str]:
+    """
+    Writes a GeoNames-style dump of made-up cities and returns their names.
+    """
+    rng = random.Random(seed)
+    names = []
+    with open(path, "w", encoding="utf-8") as dump:
+        for geoname_id in range(cities):
+            name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+            if rng.random() < 0.1:
+                name += " " + "".join(rng.choice(SYLLABLES) for _ in range(2))
+            names.append(name)
+            population = int(15000 * rng.paretovariate(1.2))
+            columns = [
+                str(geoname_id), name, name, "", f"{rng.uniform(-60, 70):.5f}",
+                f"{rng.uniform(-180, 180):.5f}", "P", "PPL", rng.choice(COUNTRIES), "", "", "",
+                "", "", str(population), "", "", "", "2023-01-01",
+            ]
+            dump.write("\t".join(columns) + "\n")
+    return names
+
+
+def real_names(path: str) -> List[str]:
+    """
+    Returns the names of the cities in a real dump.
+    """
+    with open(path, encoding="utf-8") as dump:
+        return [line.split("\t")[1] for line in dump if line.count("\t") >= 14]
+
+
+def typo(name: str, rng: random.Random) -> str:
+    """
+    Misspells a name: swaps two adjacent letters, drops one or doubles one.
+    """
+    if len(name) < 5:
+        return name + name[-1]
+    i = rng.randrange(1, len(name) - 2)
+    kind = rng.randrange(3)
+    if kind == 0:
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == 1:
+        return name[:i] + name[i + 1:]
+    return name[:i] + name[i] + name[i:]
+
+
+def time_lookups(function: Callable[[str], object], queries: List[str]) -> Dict[str, float]:
+    """
+    Times a lookup function over the queries, in microseconds.
+    """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main() -> None:
+    """
+    Builds the index, measures it and prints the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dump", help="a GeoNames dump; a synthetic one is generated by default")
+    parser.add_argument("--cities", type=int, default=26000, help="cities in the synthetic dump")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.dump:
+        path, names = args.dump, real_names(args.dump)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "cities.txt")
+        names = synthetic_dump(path, args.cities, args.seed)
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer(path)
+    gazetteer.lookup("warm up")
+    load = time.perf_counter() - start
+    tracemalloc.start()
+    measured = Gazetteer(path)
+    measured.lookup("warm up")
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measured
+
+    tracemalloc.start()
+    baseline = {}
+    with open(path, encoding="utf-8") as dump:
+        for line in dump:
+            row = line.split("\t")
+            baseline[normalize_city(row[1])] = (row[1], float(row[4]), float(row[5]), int(row[14] or 0))
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rng = random.Random(args.seed)
+    picks = [rng.choice(names) for _ in range(args.lookups)]
+    typos = [typo(name.lower(), rng) for name in picks]
+    suggested = sum(
+        1 for name, misspelled in zip(picks, typos)
+        if gazetteer.lookup(misspelled) is None and any(
+            normalize_city(suggestion.rsplit(",", 1)[0]) == normalize_city(name)
+            for suggestion in gazetteer.suggest(misspelled)
+        )
+    )
+    unknown = ["".join(rng.choice("qxzjvw") for _ in range(8)) for _ in range(args.lookups)]
+
+    print(f"{gazetteer.stats()['entries']} cities, {gazetteer.stats()['names']} names, loaded in {load * 1000:.0f} ms")
+    print(f"index {index_bytes / (1 << 20):6.1f} MiB   plain dict {dict_bytes / (1 << 20):6.1f} MiB "
+          f"({index_bytes / max(dict_bytes, 1):.0%}, with the prefix and trigram indexes)")
+    for label, function, queries in (
+        ("exact", gazetteer.lookup, picks),
+        ("prefix", lambda query: gazetteer.complete(query[:4]), picks),
+        ("typo", gazetteer.suggest, typos),
+        ("unknown", gazetteer.suggest, unknown),
+    ):
+        result = time_lookups(function, queries)
+        print(f"{label:<8} p50 {result['p50']:8.1f} us  p99 {result['p99']:8.1f} us")
+    print(f"typos answered with the right city among the suggestions: {suggested / len(picks):.1%}")
+
+
+if __name__ == "__main__":
+    main()
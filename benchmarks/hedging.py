@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures what adaptive timeouts and hedged requests do to the tail latency of an upstream
+call, and how much extra load they put on the upstream.
+
+A local stub answers most requests in a few milliseconds and a small share of them slowly,
+like an API with a long tail (a cold cache, a GC pause, a slow replica). The same stream of
+requests is sent through HttpClient without and with hedging, and the latency percentiles
+and the number of requests the stub received are printed side by side.
+
+Run from the repository root:
+    python benchmarks/hedging.py [--requests N] [--slow-rate 0.03] [--slow-ms 400]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # pylint:disable=wrong-import-position
+
+
+class TailServer:
+    """
+    A stub answering in `fast_ms` milliseconds, or `slow_ms` for `slow_rate` of the requests.
+    """
+
+    def __init__(self, fast_ms: float, slow_ms: float, slow_rate: float) -> None:
+        self.fast = fast_ms / 1000
+        self.slow = slow_ms / 1000
+        self.slow_rate = slow_rate
+        self.requests = 0
+        self._runner = None
+
+    async def answer(self, request: web.Request) -> web.Response:  # pylint:disable=unused-argument
+        self.requests += 1
+        await asyncio.sleep(self.slow if random.random() < self.slow_rate else self.fast)
+        return web.json_response({"ok": True})
+
+    async def start(self) -> str:
+        """
+        Starts serving on localhost and returns the URL to request.
+        """
+        app = web.Application()
+        app.router.add_get("/", self.answer)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint:disable=protected-access
+        return f"http://127.0.0.1:{port}/"
+
+    async def stop(self) -> None:
+        """
+        Stops serving.
+        """
+        await self._runner.cleanup()
+
+
+async def run(hedge: bool, args: argparse.Namespace) -> Dict[str, float]:
+    """
+    Sends the requests at a steady rate and returns the latency percentiles and load.
+    """
+    from adaptive_timeout import HedgeBudget, LatencyTracker  # pylint:disable=import-outside-toplevel
+    from circuit_breaker import BreakerRegistry  # pylint:disable=import-outside-toplevel
+    from http_pool import HttpClient  # pylint:disable=import-outside-toplevel
+
+    random.seed(args.seed)
+    server = TailServer(args.fast_ms, args.slow_ms, args.slow_rate)
+    url = await server.start()
+    budget = HedgeBudget(ratio=args.budget)
+    client = HttpClient(
+        timeout=2.0, host_limits={}, default_host_limit=64, breakers=BreakerRegistry(),
+        latencies=LatencyTracker(), hedge_budget=budget,
+    )
+    # warm up, so the latency percentiles are known before measuring
+    for _ in range(50):
+        await client.get_json(url, upstream="stub")
+    server.requests = 0
+
+    async def one() -> float:
+        start = time.perf_counter()
+        await client.get_json(url, upstream="stub", hedge=hedge)
+        return time.perf_counter() - start
+
+    tasks: List[asyncio.Task] = []
+    for _ in range(args.requests):
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(1 / args.rate)
+    latencies = sorted(await asyncio.gather(*tasks))
+    stats = budget.stats()
+    timeout = client.latencies.timeout("stub", client.timeout)
+    await client.close()
+    await server.stop()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "max": latencies[-1],
+        "load": server.requests / args.requests,
+        "sent": stats["sent"],
+        "won": stats["won"],
+        "denied": stats["denied"],
+        "timeout": timeout,
+    }
+
+
+def main() -> None:
+    """
+    Runs the requests without and with hedging and prints the results side by side.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=400.0, help="requests per second")
+    parser.add_argument("--fast-ms", type=float, default=5.0)
+    parser.add_argument("--slow-ms", type=float, default=400.0)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="share of slow answers")
+    parser.add_argument("--budget", type=float, default=0.05, help="share of requests that may be hedged")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for name, hedge in (("no hedging", False), ("hedging", True)):
+        result = asyncio.run(run(hedge, args))
+        print(f"{name:<11} p50 {result['p50'] * 1000:7.1f} ms  p95 {result['p95'] * 1000:7.1f} ms  "
+              f"p99 {result['p99'] * 1000:7.1f} ms  max {result['max'] * 1000:7.1f} ms  "
+              f"upstream load {result['load']:.3f}x  timeout {result['timeout']:.2f}s")
+        if hedge:
+            print(f"{'':<11} hedges sent {result['sent']}, won {result['won']}, "
+                  f"denied by the budget {result['denied']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Replays Discord traffic through the bot's real event handlers, without Discord and without
+the upstream APIs, and reports throughput, per-handler latency and memory per event.
+
+Traffic is either generated (a mix of chat, commands, edits, deletes and reactions) or read
+from a JSONL trace in the format of the structured chat log (logs/chatlog.jsonl), so real
+traffic recorded by Logger can be replayed. Each event is turned into fake discord.py
+objects and passed to the handler registered with `client.event` (on_message,
+on_raw_message_edit, on_raw_message_delete, on_raw_reaction_add). Replies go to a fake transport,
+and the HTTP client and the geocoder are replaced by in-process stubs with a configurable
+latency, so the numbers only measure the bot itself.
+
+Run from the repository root:
+    python benchmarks/replay.py [--events N] [--concurrency N] [--trace FILE]
+    python benchmarks/replay.py --save-baseline        # store the current numbers
+    python benchmarks/replay.py --check                # exit 1 on a regression
+
+The bot is imported inside a temporary directory, so its logs and caches never touch the
+repository. Memory is measured in a separate, sequential pass with tracemalloc: "peak" is
+the memory allocated while handling an event, "kept" is what was still allocated afterwards.
+Background work (fact refills, the log writer thread) is included in both.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+DEFAULT_BASELINE = os.path.join(REPO, "benchmarks", "replay_baseline.json")
+
+# share of each kind of event in generated traffic
+TRAFFIC_MIX = {"chat": 0.70, "command": 0.15, "edit": 0.07, "delete": 0.04, "reaction": 0.04}
+COMMAND_MESSAGES = [
+    "ping",
+    "!hello",
+    "!sup",
+    "!dogfact",
+    "!catfact",
+    "!weather esbjerg",
+    "!weather copenhagen",
+    "!w london",
+    "!gif happy cat",
+    "!sticker dancing dog",
+    "!help",
+]
+CHAT_WORDS = (
+    "the a pizza tonight anyone up for games lol what did you think of that match "
+    "i am so tired today this weather is wild did you see the new trailer"
+).split()
+EMOJIS = ["👍", "😂", "❤️", "🎉", "👀"]
+
+
+def generate_traffic(
+    count: int, seed: int = 1, users: int = 200, channels: int = 8
+) -> List[Dict[str, Any]]:
+    """
+    Generates a reproducible stream of events in the structured chat log format.
+
+    Args:
+    ---
+        - count (int): The number of events.
+        - seed (int): The random seed.
+        - users (int): The number of distinct authors.
+        - channels (int): The number of distinct channels.
+
+    Returns:
+    ---
+        List[Dict[str, Any]]: The events, oldest first.
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*TRAFFIC_MIX.items())
+    sent: List[Dict[str, Any]] = []
+    events = []
+    for message_id in range(1, count + 1):
+        kind = rng.choices(kinds, weights)[0]
+        if kind in ("edit", "delete", "reaction") and sent:
+            original = rng.choice(sent[-200:])
+            event = dict(original, event="reaction_add" if kind == "reaction" else kind)
+            if kind == "edit":
+                event["after"] = original["content"] + " (edited)"
+            elif kind == "reaction":
+                event["emoji"] = rng.choice(EMOJIS)
+            events.append(event)
+            continue
+        author_id = rng.randrange(users)
+        channel_id = rng.randrange(channels)
+        if kind == "command":
+            content = rng.choice(COMMAND_MESSAGES)
+        else:
+            content = " ".join(rng.choices(CHAT_WORDS, k=rng.randint(2, 14)))
+        event = {
+            "event": "chat",
+            "message_id": message_id,
+            "author_id": 1000 + author_id,
+            "author": f"user{author_id}#{author_id % 10000:04d}",
+            "channel_id": 100 + channel_id,
+            "channel": f"channel-{channel_id}",
+            "content": content,
+        }
+        sent.append(event)
+        events.append(event)
+    return events
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads a JSONL trace, e.g. the structured chat log, skipping lines that are not JSON.
+
+    Args:
+    ---
+        - path (str): The path of the trace.
+
+    Returns:
+    ---
+        List[Dict[str, Any]]: The events, in file order.
+    """
+    events = []
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+###### FAKE DISCORD OBJECTS ######
+
+
+class FakeChannel:
+    """
+    A text channel whose `send` only counts messages.
+    """
+
+    def __init__(self, channel_id: int, name: str) -> None:
+        self.id = channel_id  # pylint:disable=invalid-name
+        self.name = name
+        self.sent = 0
+
+    async def send(self, content: str) -> None:  # pylint:disable=unused-argument
+        """
+        Counts a message sent to the channel.
+        """
+        self.sent += 1
+
+
+class FakeWorld:
+    """
+    Builds and reuses the fake users, channels and messages the handlers are called with.
+    """
+
+    def __init__(self) -> None:
+        self.users: Dict[int, SimpleNamespace] = {}
+        self.channels: Dict[int, FakeChannel] = {}
+
+    def user(self, event: Dict[str, Any]) -> SimpleNamespace:
+        """
+        Returns the author of an event.
+        """
+        user_id = event.get("author_id") or 0
+        user = self.users.get(user_id)
+        if user is None:
+            name, _, discriminator = (event.get("author") or "user#0000").partition("#")
+            user = self.users[user_id] = SimpleNamespace(
+                id=user_id, name=name, discriminator=discriminator or "0000", bot=False
+            )
+        return user
+
+    def channel(self, event: Dict[str, Any]) -> FakeChannel:
+        """
+        Returns the channel of an event.
+        """
+        channel_id = event.get("channel_id") or 0
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(
+                channel_id, event.get("channel") or "general"
+            )
+        return channel
+
+    def message(self, event: Dict[str, Any], content: Optional[str] = None) -> SimpleNamespace:
+        """
+        Returns a message with the attributes the handlers and Logger read.
+        """
+        return SimpleNamespace(
+            id=event.get("message_id") or 0,
+            content=(event.get("content") or "") if content is None else content,
+            author=self.user(event),
+            channel=self.channel(event),
+            guild=None,
+            created_at=datetime.now(timezone.utc),
+        )
+
+    def raw_edit(self, event: Dict[str, Any]) -> SimpleNamespace:
+        """
+        Returns a raw edit payload for a message that is not in the message cache, as in
+        lean mode.
+        """
+        user = self.user(event)
+        return SimpleNamespace(
+            message_id=event.get("message_id") or 0,
+            channel_id=event.get("channel_id") or 0,
+            guild_id=None,
+            cached_message=None,
+            data={
+                "content": event.get("after") or "",
+                "author": {
+                    "id": str(user.id), "username": user.name, "discriminator": user.discriminator,
+                },
+            },
+        )
+
+    def raw_delete(self, event: Dict[str, Any]) -> SimpleNamespace:
+        """
+        Returns a raw delete payload for a message that is not in the message cache.
+        """
+        return SimpleNamespace(
+            message_id=event.get("message_id") or 0,
+            channel_id=event.get("channel_id") or 0,
+            guild_id=None,
+            cached_message=None,
+        )
+
+    def reaction(self, event: Dict[str, Any]) -> SimpleNamespace:
+        """
+        Returns a raw reaction payload.
+        """
+        user = self.user(event)
+        return SimpleNamespace(
+            emoji=SimpleNamespace(name=event.get("emoji") or "👍"),
+            member=user,
+            user_id=user.id,
+            channel_id=event.get("channel_id"),
+            message_id=event.get("message_id"),
+        )
+
+
+###### STUB UPSTREAMS ######
+
+
+class StubUpstreams:
+    """
+    Stands in for the shared HttpClient, answering every API the bot calls from memory
+    after `latency` seconds.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        self._fact = 0
+
+    def _facts(self, count: int) -> List[str]:
+        self._fact += count
+        return [f"Fact number {n}." for n in range(self._fact - count, self._fact)]
+
+    def is_open(self, upstream: str) -> bool:  # pylint:disable=unused-argument
+        """
+        The stub never fails, so no breaker is ever open.
+        """
+        return False
+
+    async def get_json(self, url: str, params=None, timeout=None, upstream=None, hedge=False) -> Any:  # pylint:disable=unused-argument,too-many-arguments
+        """
+        Returns a canned response for the API the URL points at.
+        """
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = params or {}
+        if "dogapi" in url:
+            return {"facts": self._facts(int(params.get("number", 1)))}
+        if "meowfacts" in url:
+            return {"data": self._facts(int(params.get("count", 1)))}
+        if "openweathermap" in url:
+            return {
+                "weather": [{"main": "Clouds"}],
+                "main": {"temp": 4.2, "feels_like": 1.3, "humidity": 87},
+                "wind": {"speed": 6.1},
+            }
+        if "randomid" in url:
+            return {"data": {"random_id": "benchmark"}}
+        if "/search" in url:
+            return {
+                "data": [
+                    {
+                        "url": f"https://giphy.example/{params.get('q', '')}/{n}",
+                        "analytics": {"onsent": {"url": f"https://giphy.example/onsent?n={n}"}},
+                        "analytics_response_payload": "payload",
+                    }
+                    for n in range(int(params.get("limit", 25)))
+                ]
+            }
+        raise ValueError(f"no stub for {url}")
+
+    async def get(self, url: str, params=None, timeout=None, upstream=None, hedge=False) -> int:  # pylint:disable=unused-argument,too-many-arguments
+        """
+        Accepts an analytics ping.
+        """
+        self.calls += 1
+        return 200
+
+    async def close(self) -> None:
+        """
+        Nothing to close.
+        """
+
+
+class StubGeolocator:
+    """
+    Stands in for Nominatim, placing every city at a made-up but stable position.
+    """
+
+    def geocode(self, city: str) -> SimpleNamespace:
+        """
+        Returns a location for any city.
+        """
+        seed = sum(map(ord, city))
+        return SimpleNamespace(latitude=(seed % 180) - 90.0, longitude=(seed * 7 % 360) - 180.0)
+
+
+def load_bot(workdir: str, latency: float) -> Tuple[Any, StubUpstreams]:
+    """
+    Imports the bot inside `workdir` and replaces everything that would leave the process.
+
+    Args:
+    ---
+        - workdir (str): The directory the bot writes its logs and caches to.
+        - latency (float): The simulated latency of every upstream call, in seconds.
+
+    Returns:
+    ---
+        Tuple[module, StubUpstreams]: The bot module and the stub upstreams.
+    """
+    os.chdir(workdir)
+    os.environ.setdefault("openWeather_API_KEY", "benchmark")
+    os.environ.setdefault("giphy_API_KEY", "benchmark")
+    os.environ["METRICS_PORT"] = ""
+    os.environ["PLUGIN_RELOAD_INTERVAL"] = "0"
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot  # pylint:disable=import-outside-toplevel
+        import helper  # pylint:disable=import-outside-toplevel
+        import http_pool  # pylint:disable=import-outside-toplevel
+        bot.create_app()
+    stub = StubUpstreams(latency)
+    # every component holds the shared client, so patching the instance reaches them all
+    http_pool.shared_client.get_json = stub.get_json
+    http_pool.shared_client.get = stub.get
+    helper._geolocator = StubGeolocator()  # pylint:disable=protected-access
+
+    async def transport(channel, content: str) -> None:
+        await channel.send(content)
+
+    bot.outbox.transport = transport
+    # Discord's pacing would make the replay measure sleeps, not the bot
+    bot.outbox.channel_rate = 1 << 30
+    return bot, stub
+
+
+###### REPLAY ######
+
+
+def dispatch(bot, world: FakeWorld, event: Dict[str, Any]) -> Tuple[str, Any]:
+    """
+    Builds the fake objects for an event and returns its label and handler coroutine.
+
+    Args:
+    ---
+        - bot (module): The bot module.
+        - world (FakeWorld): The fake users and channels.
+        - event (Dict[str, Any]): The event.
+
+    Returns:
+    ---
+        Tuple[str, Coroutine]: The name latencies are reported under, and the coroutine
+        running the handler.
+    """
+    kind = event.get("event", "chat")
+    if kind == "edit":
+        return "on_raw_message_edit", bot.on_raw_message_edit(world.raw_edit(event))
+    if kind == "delete":
+        return "on_raw_message_delete", bot.on_raw_message_delete(world.raw_delete(event))
+    if kind == "reaction_add":
+        return "on_raw_reaction_add", bot.on_raw_reaction_add(world.reaction(event))
+    message = world.message(event)
+    found = bot.registry.resolve(message.content)
+    label = f"!{found[0].name}" if found is not None else "on_message"
+    return label, bot.on_message(message)
+
+
+async def replay(
+    bot, events: List[Dict[str, Any]], concurrency: int
+) -> Tuple[float, Dict[str, List[float]], int]:
+    """
+    Replays events through the handlers, with at most `concurrency` handled at once.
+
+    Returns:
+    ---
+        Tuple[float, Dict[str, List[float]], int]: The wall time in seconds, the latencies
+        of every handler in seconds, and the number of handlers that raised.
+    """
+    world = FakeWorld()
+    latencies: Dict[str, List[float]] = {}
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(label: str, handler) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await handler
+        except Exception:  # pylint:disable=broad-except
+            errors += 1
+        finally:
+            slots.release()
+        latencies.setdefault(label, []).append(time.perf_counter() - start)
+
+    tasks = []
+    start = time.perf_counter()
+    for event in events:
+        await slots.acquire()
+        label, handler = dispatch(bot, world, event)
+        tasks.append(asyncio.create_task(run(label, handler)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start, latencies, errors
+
+
+async def measure_memory(bot, events: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Replays events one at a time under tracemalloc.
+
+    Returns:
+    ---
+        Dict[str, Dict[str, float]]: For every handler, the mean bytes allocated at the
+        peak of handling an event ("peak_bytes") and still allocated afterwards ("kept_bytes").
+    """
+    world = FakeWorld()
+    totals: Dict[str, List[float]] = {}
+    tracemalloc.start()
+    try:
+        for event in events:
+            label, handler = dispatch(bot, world, event)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                await handler
+            except Exception:  # pylint:disable=broad-except
+                pass
+            current, peak = tracemalloc.get_traced_memory()
+            total = totals.setdefault(label, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += peak - before
+            total[2] += current - before
+    finally:
+        tracemalloc.stop()
+    return {
+        label: {"peak_bytes": peak / count, "kept_bytes": kept / count}
+        for label, (count, peak, kept) in totals.items()
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Returns the value below which `fraction` of the values fall.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(
+    events: int, wall: float, latencies: Dict[str, List[float]], memory: Dict[str, Dict[str, float]]
+) -> Dict[str, Any]:
+    """
+    Builds the results in the format stored as a baseline.
+    """
+    handlers = {}
+    for label, values in sorted(latencies.items()):
+        handlers[label] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            **memory.get(label, {}),
+        }
+    return {"events": events, "throughput": events / wall, "handlers": handlers}
+
+
+def print_report(results: Dict[str, Any], wall: float, errors: int) -> None:
+    """
+    Prints the results as a table.
+    """
+    print(
+        f"{results['events']:,} events in {wall:.2f}s: "
+        f"{results['throughput']:,.0f} events/s, {errors} handler errors"
+    )
+    print(f"{'handler':<22}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}{'kept B':>10}")
+    for label, handler in results["handlers"].items():
+        print(
+            f"{label:<22}{handler['count']:>8}{handler['p50_ms']:>10.3f}{handler['p99_ms']:>10.3f}"
+            f"{handler.get('peak_bytes', 0) / 1024:>10.1f}{handler.get('kept_bytes', 0):>10.0f}"
+        )
+
+
+def find_regressions(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, floor_ms: float = 0.05
+) -> List[str]:
+    """
+    Compares results with a baseline.
+
+    Throughput may drop, and p99 latency and peak memory per event may grow, by at most
+    `tolerance` (a fraction). Latencies below `floor_ms` are too noisy to compare.
+
+    Returns:
+    ---
+        List[str]: A description of every regression.
+    """
+    regressions = []
+    if results["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {results['throughput']:,.0f}/s < baseline {baseline['throughput']:,.0f}/s"
+        )
+    checks: List[Tuple[str, Callable[[float], bool]]] = [
+        ("p99_ms", lambda old: old >= floor_ms),
+        ("peak_bytes", lambda old: True),
+    ]
+    for label, old in baseline["handlers"].items():
+        new = results["handlers"].get(label)
+        if new is None:
+            continue
+        for key, comparable in checks:
+            if key in old and key in new and comparable(old[key]):
+                if new[key] > old[key] * (1 + tolerance):
+                    regressions.append(f"{label} {key} {new[key]:.3f} > baseline {old[key]:.3f}")
+    return regressions
+
+
+async def run_benchmark(args: argparse.Namespace, events: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], float, int]:  # pylint:disable=line-too-long
+    """
+    Loads the bot, warms it up, replays the events and measures memory.
+    """
+    workdir = tempfile.mkdtemp(prefix="tr4shbot-replay-")
+    cwd = os.getcwd()
+    bot, _ = load_bot(workdir, args.latency)
+    try:
+        # the handlers print every event; keep that cost but not the output
+        with contextlib.redirect_stdout(io.StringIO()):
+            await bot.setup_hook()
+            # fill the fact pools and caches the way a running bot has them
+            await replay(bot, events[: args.warmup], args.concurrency)
+            wall, latencies, errors = await replay(bot, events, args.concurrency)
+            memory = await measure_memory(bot, events[: args.memory_events])
+            await bot.shutdown()
+        bot.logger.close_files()
+    finally:
+        os.chdir(cwd)
+    return summarize(len(events), wall, latencies, memory), wall, errors
+
+
+def main() -> None:
+    """
+    Parses the command line, runs the benchmark and compares it with the baseline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=20_000, help="events to generate")
+    parser.add_argument("--trace", help="replay this JSONL trace instead of generated traffic")
+    parser.add_argument("--save-trace", help="write the generated traffic to this file")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32, help="events handled at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub upstream latency, s")
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--memory-events", type=int, default=2_000)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results")
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    events = load_trace(args.trace) if args.trace else generate_traffic(args.events, args.seed)
+    if args.save_trace:
+        with open(args.save_trace, "w", encoding="utf-8") as trace_file:
+            trace_file.writelines(json.dumps(event) + "\n" for event in events)
+
+    results, wall, errors = asyncio.run(run_benchmark(args, events))
+    print_report(results, wall, errors)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if not regressions:
+            print(f"no regressions against {args.baseline}")
+        if regressions and args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
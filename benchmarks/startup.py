@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures the bot's startup time against a budget: importing bot, building the client with
+create_app and, if a token is available, connecting to Discord until on_ready.
+
+Each step is timed in a fresh interpreter, so nothing is already imported, and run several
+times to report the median. Importing bot must also not pull in the heavy dependencies
+that are only needed once a command is used (discord.py, aiohttp, geopy, rich).
+
+Run from the repository root:
+    python benchmarks/startup.py [--runs N] [--live]
+
+Exits with 1 if a step is over its budget or a heavy dependency is imported by `import bot`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["discord", "aiohttp", "geopy", "rich"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+APP_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import bot
+bot.create_app()
+elapsed = time.perf_counter() - start
+bot.logger.close_files()
+print(json.dumps({{"seconds": elapsed}}))
+"""
+
+READY_SCRIPT = """
+import asyncio, json, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import bot
+
+async def run():
+    client = bot.create_app()
+    async with client:
+        task = asyncio.create_task(client.start(bot.TOKEN))
+        await client.wait_until_ready()
+        elapsed = time.perf_counter() - start
+        await client.close()
+        await asyncio.gather(task, return_exceptions=True)
+    await bot.shutdown()
+    return elapsed
+
+elapsed = asyncio.run(run())
+bot.logger.close_files()
+print(json.dumps({{"seconds": elapsed}}))
+"""
+
+
+def run_script(script: str, workdir: str) -> Dict:
+    """
+    Runs a timing script in a fresh interpreter and returns the JSON it printed last.
+    """
+    env = dict(os.environ, METRICS_PORT="")
+    result = subprocess.run(
+        [sys.executable, "-c", script.format(repo=REPO, heavy=HEAVY_MODULES)],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(script: str, runs: int, workdir: str) -> List[Dict]:
+    """
+    Runs a timing script `runs` times.
+    """
+    return [run_script(script, workdir) for _ in range(runs)]
+
+
+def main() -> None:
+    """
+    Measures every step, prints the medians and checks them against the budgets.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=0.25, help="seconds")
+    parser.add_argument("--app-budget", type=float, default=1.0, help="seconds")
+    parser.add_argument("--ready-budget", type=float, default=10.0, help="seconds")
+    parser.add_argument("--live", action="store_true",
+                        help="also connect to Discord with TOKEN and time reaching on_ready")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        steps = [("import bot", IMPORT_SCRIPT, args.import_budget, args.runs),
+                 ("create_app", APP_SCRIPT, args.app_budget, args.runs)]
+        if args.live:
+            if not os.getenv("TOKEN"):
+                parser.error("--live needs the TOKEN environment variable")
+            steps.append(("on_ready", READY_SCRIPT, args.ready_budget, 1))
+        for name, script, budget, runs in steps:
+            results = measure(script, runs, workdir)
+            median = statistics.median(result["seconds"] for result in results)
+            status = "ok" if median <= budget else "OVER BUDGET"
+            print(f"{name:<12} {median * 1000:>9.1f} ms  (budget {budget * 1000:.0f} ms)  {status}")
+            if median > budget:
+                failures.append(name)
+            heavy = sorted({module for result in results for module in result.get("heavy", [])})
+            if heavy:
+                print(f"{'':<12} imported eagerly: {', '.join(heavy)}")
+                failures.append(f"{name} imports {', '.join(heavy)}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures how many OpenWeatherMap requests the weather subscriptions make.
+
+--subscribers users subscribe to --cities cities at --slots times of day, in --channels
+channels. Every time of day is then posted through SubscriptionScheduler.fire with a
+stub report that takes --latency seconds, and the fetches and messages are counted
+against one request per subscriber, as if each of them typed the command.
+
+Run from the repository root:
+    python benchmarks/subscriptions_bench.py [--subscribers N] [--cities N] [--slots N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Subscribes the users, posts every time of day and prints the counts.
+    """
+    os.chdir(tempfile.mkdtemp())
+    import helper  # pylint:disable=import-outside-toplevel
+    from subscriptions import SubscriptionScheduler, SubscriptionStore  # pylint:disable=import-outside-toplevel
+
+    rng = random.Random(args.seed)
+    cities = [f"city{n}" for n in range(args.cities)]
+    for n, city in enumerate(cities):
+        helper.geocode_cache.put(city, (50.0 + n / 10, 10.0))
+    # the same places under another spelling share the fetch too
+    aliases = {city: f"  {city.upper()} " for city in cities}
+    store = SubscriptionStore(None, max_per_user=args.subscribers)
+    slots = [7 * 60 + 15 * slot for slot in range(args.slots)]
+    for user_id in range(args.subscribers):
+        city = rng.choice(cities)
+        store.add(user_id, rng.randrange(args.channels), aliases[city] if user_id % 7 == 0 else city,
+                  rng.choice(slots))
+    scheduler = SubscriptionScheduler(store)
+    fetched = []
+    sent = []
+
+    async def report(city: str) -> str:
+        fetched.append(city)
+        await asyncio.sleep(args.latency)
+        return f"\nIn {city.title()}\nit's currently 4°C.\n"
+
+    async def send(channel_id: int, content: str) -> None:
+        sent.append((channel_id, content))
+
+    start = time.perf_counter()
+    for minute in slots:
+        await scheduler.fire([minute], report, send)
+    elapsed = time.perf_counter() - start
+    stats = scheduler.stats()
+    print(f"{args.subscribers} subscribers, {args.cities} cities, {args.slots} times of day, "
+          f"{args.channels} channels")
+    print(f"one request per subscriber: {args.subscribers} fetches, {args.subscribers} messages")
+    print(f"scheduled:                  {stats['fetches']} fetches, {stats['messages']} messages, "
+          f"{stats['delivered']} subscriptions delivered in {elapsed * 1000:.0f} ms")
+    print(f"fetches saved: {1 - stats['fetches'] / args.subscribers:.1%}")
+
+
+def main() -> None:
+    """
+    Parses the arguments and runs the measurement.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Measures how long a batch weather command takes against the time of its slowest city.
+
+A local stub of OpenWeatherMap answers each city after its own delay. The cities are
+asked for one by one and then as one batch through weather_report, for the current
+weather and for a forecast; the batch should take about as long as the slowest city,
+not the sum of all of them.
+
+Run from the repository root:
+    python benchmarks/weather_batch.py [--cities N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # pylint:disable=wrong-import-position
+
+
+class WeatherStub:
+    """
+    Answers like OpenWeatherMap's weather and forecast APIs, after a per-place delay.
+    """
+
+    def __init__(self, delays: Dict[float, float]) -> None:
+        # delay in seconds by latitude
+        self.delays = delays
+        self._runner = None
+
+    async def weather(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.delays.get(float(request.query["lat"]), 0.0))
+        return web.json_response({
+            "weather": [{"main": "Clouds"}],
+            "main": {"temp": 4.2, "feels_like": 1.3, "humidity": 87},
+            "wind": {"speed": 6.1},
+        })
+
+    async def forecast(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.delays.get(float(request.query["lat"]), 0.0))
+        start = int(time.time()) // 10800 * 10800
+        return web.json_response({"city": {"timezone": 3600}, "list": [
+            {"dt": start + step * 10800,
+             "main": {"temp_min": 2.0 + step % 8, "temp_max": 5.0 + step % 8},
+             "weather": [{"main": "Rain" if step % 3 else "Clouds"}]}
+            for step in range(40)
+        ]})
+
+    async def start(self) -> str:
+        """
+        Starts serving on localhost and returns the base URL.
+        """
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.weather)
+        app.router.add_get("/data/2.5/forecast", self.forecast)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint:disable=protected-access
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        """
+        Stops serving.
+        """
+        await self._runner.cleanup()
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Times the cities one by one and as a batch, for the weather and the forecast.
+    """
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("openWeather_API_KEY", "bench")
+    from async_cache import AsyncTTLCache  # pylint:disable=import-outside-toplevel
+    from circuit_breaker import BreakerRegistry  # pylint:disable=import-outside-toplevel
+    from http_pool import HttpClient  # pylint:disable=import-outside-toplevel
+    import helper  # pylint:disable=import-outside-toplevel
+    from weather_file import Weather, weather_report  # pylint:disable=import-outside-toplevel
+
+    cities = [f"city{n}" for n in range(args.cities)]
+    delays = {}
+    for n, city in enumerate(cities):
+        latitude = float(n + 1)
+        helper.geocode_cache.put(city, (latitude, 10.0))
+        delays[latitude] = 0.05 + 0.25 * n / max(1, args.cities - 1)
+    stub = WeatherStub(delays)
+    base = await stub.start()
+    client = HttpClient(timeout=5.0, breakers=BreakerRegistry())
+
+    def options():
+        # a fresh cache for every run, so nothing is answered from memory
+        return {
+            "url": f"{base}/data/2.5/weather", "forecast_url": f"{base}/data/2.5/forecast",
+            "client": client, "cache": AsyncTTLCache(ttl=600),
+        }
+
+    print(f"{args.cities} cities, slowest {max(delays.values()) * 1000:.0f} ms, "
+          f"sum of all {sum(delays.values()) * 1000:.0f} ms")
+    for label, days in (("weather", None), ("forecast", 3)):
+        sequential_options = options()
+        start = time.perf_counter()
+        for city in cities:
+            place = Weather(city=city, **sequential_options)
+            await (place.forecast(days) if days else place.weather())
+        sequential = time.perf_counter() - start
+        start = time.perf_counter()
+        reply = await weather_report(cities, days, concurrency=args.concurrency, **options())
+        batch = time.perf_counter() - start
+        print(f"{label:<9} one by one {sequential * 1000:7.0f} ms   batch {batch * 1000:7.0f} ms   "
+              f"reply {len(reply)} chars")
+    if args.show:
+        print(reply)
+    await client.close()
+    await stub.stop()
+
+
+def main() -> None:
+    """
+    Parses the arguments and runs the measurement.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cities", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--show", action="store_true", help="print the last reply")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
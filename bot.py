@@ -8,354 +8,701 @@ This module contains a Discord bot that responds to commands with various functi
 The bot is implemented using the Discord API,
 and can be run on a Discord server by providing a valid token and the name of the target guild.
 
-The module contains a Commands class with methods for accessing lists of different types of
-commands, and several event handlers for responding to different events that can occur
-within a Discord server, such as a user sending a message or the bot connecting to the server.
-The module also utilizes the Logger, DogFact, CatFact, and helper modules for various functions.
+The module contains several event handlers for responding to different events that can occur
+within a Discord server, such as a user sending a message or the bot connecting to the server,
+and create_app, which builds the Discord client and registers them. The aliases of every
+command are listed by the Commands class in command_aliases.
+
+Most commands live in plugins (see plugin_loader): animal_fact, weather_file, giphy and the
+modules of the plugins package. They are loaded by create_app and reloaded when their files
+change, without reconnecting. The help text is built from the commands' metadata.
+
+By default the bot runs in lean mode (see gateway): it only asks Discord for the intents
+its handlers need, keeps no member or message cache, and logs edits, deletions and
+reactions from the on_raw_* events. LEAN_MODE=0 restores Intents.all() and the default caches.
+
+Importing the module is cheap: discord.py is imported, the log files are opened and the
+plugins are loaded by create_app, and the objects behind each command (with their
+dependencies, such as geopy and aiohttp) are only built the first time the command is used.
 
 Attributes:
 ---
-    logger: An instance of the Logger class for logging system messages.
-    dog_fact: An instance of the DogFact class for retrieving random dog facts from an online API.
-    cat_fact: An instance of the CatFact class for retrieving random cat facts from an online API.
+    logger: An instance of the Logger class for logging system messages, set by create_app.
     TOKEN: A string containing the Discord API token for the bot.
-    GUILD: A string containing the name of the target Discord guild for the bot.
-    client: An instance of the discord.Client class for connecting to and
-    interacting with a Discord server.
+    GUILD: A string containing the name of a guild whose members are listed on ready, if set.
+    SHARD_COUNT / SHARD_IDS: The total number of shards and the shards this process runs,
+    read from the environment variables of the same name. By default discord.py picks the
+    shard count and the process runs every shard; running a process per group of shards
+    means giving each process the same SHARD_COUNT and its own SHARD_IDS, e.g. "0,1,2,3".
+    STATUS_CHANNEL: The id of a channel the bot announces it is running in, besides the
+    status channels configured per guild, read from the environment variable of the same
+    name. Unset by default.
+    client: An instance of the discord.AutoShardedClient class for connecting to and
+    interacting with Discord, set by create_app.
+    shard_health: An instance of the ShardHealth class following the state of every shard,
+    exported as metrics and served at /health.
+    registry: An instance of the CommandRegistry class mapping every command alias
+    to its handler.
+    plugins: An instance of the PluginManager class loading the command plugins, checked for
+    changes every PLUGIN_RELOAD_INTERVAL seconds (0 disables hot reloading).
+    outbox: An instance of the Outbox class, the per-channel queue every reply is sent through.
+    executor: An instance of the CommandExecutor class running the command handlers
+    under their concurrency limits.
+    rate_limiter: An instance of the CommandRateLimiter class limiting how often each
+    user and channel can call the commands listed in RATE_LIMITS.
+    metrics_server: An instance of the MetricsServer class serving the bot's metrics at
+    /metrics on METRICS_HOST:METRICS_PORT (set METRICS_PORT to an empty string to disable it).
+    subscription_task: The task posting the daily weather subscriptions (see subscriptions),
+    started by setup_hook.
 
 Methods:
 ---
+    - create_app(): Builds the Discord client, opens the log files and registers the
+        event handlers.
     - on_connect(): A function that runs when the bot connects to the Discord server.
         Prints a message to the console indicating that the bot is connected.
-    - on_ready(): A function that runs when the bot is ready to interact with the Discord server.
-        Prints a message to the console indicating the bot's readiness and
-        lists the members of the guild.
+    - on_ready(): A function that runs when every shard is ready to interact with Discord.
+        Prints a summary of the guilds per shard and announces the bot in the status channels.
     - on_message(message): An event handler function that runs when a message is sent on the
-        Discord server. Prints a message to the console and responds to the message with
-        various functions depending on the content of the message.
+        Discord server. Prints a message to the console and dispatches the message to the
+        command handler registered for its first word, if any, following the guild's config.
 """
 import os
 import sys
-from typing import List
-import discord
-from discord import Intents
+import asyncio
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
-from rich import print as rprint
 from logger import Logger
-from animal_fact import DogFact
-from animal_fact import CatFact
-from giphy import Giphy
-import weather_file
+from command_aliases import Commands
+from command_registry import CommandRegistry
+from command_executor import BUSY_REPLY, CommandExecutor, blocking_pool
+from rate_limit import CommandRateLimiter
+from outbox import Outbox
+from plugin_loader import PluginManager
+from metrics import REGISTRY, MetricsServer, track_command
+from guild_config import guild_configs
+from shard_health import ShardHealth
+from gateway import client_options, enabled_events, lean_mode
+from subscriptions import subscription_scheduler, weather_subscriptions
 import helper
 
 load_dotenv()
 try:
     if len(sys.argv) == 2:
         DEBUG = True
+        from rich import print as rprint  # pylint:disable=import-outside-toplevel
         rprint("[red underline]WARNING! RUNNING IN DEBUG MODE![red underline]")
 except IndexError:
     DEBUG = False
 
-logger = Logger()
-dog_fact = DogFact()
-cat_fact = CatFact()
 TOKEN = os.getenv("TOKEN")
 GUILD = os.getenv("GUILD")
-client = discord.Client(intents=Intents.all())
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = (
+    [int(shard_id) for shard_id in os.getenv("SHARD_IDS").split(",")]
+    if os.getenv("SHARD_IDS")
+    else None
+)
+STATUS_CHANNEL = int(os.getenv("STATUS_CHANNEL") or 0) or None
+logger: Optional[Logger] = None
+client = None
+EVENT_HANDLERS: List[Callable] = []
+
+
+def event(handler: Callable) -> Callable:
+    """
+    Marks a coroutine as a Discord event handler, registered on the client by create_app.
 
+    Args:
+    ---
+        handler (Callable): The event handler, named after the event (e.g. on_message).
 
-class Commands:
+    Returns:
+    ---
+        Callable: The handler, unchanged.
     """
-    A class containing methods for accessing lists of commands.
+    EVENT_HANDLERS.append(handler)
+    return handler
+
 
-    The class has methods for accessing lists of greetings and dog facts,
-    as well as a method for accessing all commands.
+def create_app(intents=None, lean=None):
     """
+    Builds the sharded Discord client, opens the log files and registers the event handlers.
 
-    def __init__(self) -> None:
-        """
-        Initializes the Commands class.
-        """
+    In lean mode (see gateway) only the enabled logging handlers are registered, the client
+    only asks for the intents they need, and the member and message caches are off.
+
+    Args:
+    ---
+        - intents (Optional[discord.Intents]): The intents to connect with. Defaults to the
+                intents of the registered handlers in lean mode, and to all otherwise.
+        - lean (Optional[bool]): Whether to run in lean mode. Defaults to LEAN_MODE.
 
-    def greets(self) -> List[str]:
-        """
-        Returns a list of greetings.
+    Returns:
+    ---
+        discord.AutoShardedClient: The client, ready to be started.
+    """
+    global client, logger  # pylint:disable=global-statement
+    import discord  # pylint:disable=import-outside-toplevel
+    if logger is None:
+        logger = Logger()
+    lean = lean_mode() if lean is None else lean
+    names = enabled_events([handler.__name__ for handler in EVENT_HANDLERS], lean)
+    options = client_options(names, lean)
+    if intents is not None:
+        options["intents"] = intents
+    client = discord.AutoShardedClient(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **options)
+    for handler in EVENT_HANDLERS:
+        if handler.__name__ in names:
+            client.event(handler)
+    plugins.load_all()
+    return client
+
+
+@event
+async def setup_hook():
+    """
+    Runs once before the bot connects to Discord.
 
-        Returns:
-        ---
-            list: A list of greetings.
-        """
-        return helper.fix_command(
-            ["hello", "hey", "hi", "hiya", "greetings",
-                "yo", "sup", "wassup", "howdy"]
-        )
+    Starts serving the metrics, watching the plugins for changes and posting the weather
+    subscriptions, and loads the city gazetteer on the blocking pool. The plugins' pools and
+    background tasks are started by the first command using them.
+    """
+    global plugin_watcher, subscription_task  # pylint:disable=global-statement
+    if metrics_server is not None:
+        await metrics_server.start()
+    asyncio.get_running_loop().run_in_executor(blocking_pool, helper.gazetteer.load)
+    subscription_task = asyncio.create_task(
+        subscription_scheduler.run(_subscription_report, _subscription_send, log=_plugin_log)
+    )
+    if PLUGIN_RELOAD_INTERVAL > 0:
+        plugin_watcher = asyncio.create_task(plugins.watch(PLUGIN_RELOAD_INTERVAL))
+
+
+@event
+async def on_connect():
+    """
+    Event for when the bot connects to Discord.
 
-    def dog_facts(self) -> List[str]:
-        """
-        Returns a list of commands for requesting dog facts.
+    Prints a system log message indicating that the bot has connected.
+    """
+    print(logger.sys_log("Bot Is Connected!" if not DEBUG else "Bot Is Connected! [DEBUG MODE]"))
 
-        Returns:
-        ---
-            list: A list of commands for requesting dog facts.
-        """
-        return helper.fix_command(["dogfact", "dog-fact"])
 
-    def cat_facts(self) -> List[str]:
-        """
-        Returns a list of commands for requesting cat facts.
+@event
+async def on_ready():
+    """
+    Event for when every shard of the bot is ready to receive messages.
 
-        Returns:
-        ---
-            list: A list of commands for requesting cat facts.
-        """
-        return helper.fix_command(["catfact", "cat-fact"])
+    Prints how many guilds each shard serves and announces the bot in the status channels.
+    Lists the members of the GUILD guild, if set. Member lists are not downloaded at startup
+    in lean mode, so that guild's members are fetched now if the members intent is enabled.
+    """
+    status = "Tr4shBot Running" if not DEBUG else "Tr4shBot Running [DEBUG MODE]"
+    channel_ids = set(guild_configs.status_channels().values())
+    if STATUS_CHANNEL is not None:
+        channel_ids.add(STATUS_CHANNEL)
+    for channel_id in channel_ids:
+        channel = client.get_channel(channel_id)
+        if channel is not None:
+            await outbox.send(channel, status, merge=False)
+
+    guild_counts = shard_guild_counts()
+    shards = ", ".join(f"shard {shard_id}: {count}" for shard_id, count in sorted(guild_counts.items()))
+    print(f"{client.user} is ready on {len(client.guilds)} servers ({shards})")
+
+    guild = next((guild for guild in client.guilds if guild.name == GUILD), None) if GUILD else None
+    if guild is not None:
+        if client.intents.members and not guild.chunked:
+            await guild.chunk()
+        if guild.members:
+            g_members = "\n - ".join([member.name for member in guild.members])
+            print(f"Guild Member of {guild.name}(ID: {guild.id}):\n - {g_members}")
+        else:
+            print(f"{guild.name}(ID: {guild.id}) has {guild.member_count} members")
+
+
+@event
+async def on_shard_connect(shard_id):
+    """
+    Event for when a shard connects to the gateway.
+    """
+    shard_health.connected(shard_id)
 
-    def weather_commands(self) -> List[str]:
-        """
-        Returns a list of commands for requesting weather information.
 
-        Returns:
-        ---
-            List[str]: A list of commands for requesting weather information.
-        """
-        return helper.fix_command(["weather", "w"])
+@event
+async def on_shard_ready(shard_id):
+    """
+    Event for when a shard is ready.
+    """
+    shard_health.ready(shard_id)
+    print(logger.sys_log(f"Shard {shard_id} is ready"))
 
-    def help_commands(self) -> List[str]:
-        """
-        Returns a list of commands for accessing help information.
 
-        Returns:
-        ---
-            List[str]: A list of commands for accessing help information.
-        """
-        return helper.fix_command(["help", "h", "?"])
+@event
+async def on_shard_disconnect(shard_id):
+    """
+    Event for when a shard loses its gateway connection. discord.py reconnects it.
+    """
+    shard_health.disconnected(shard_id)
+    print(logger.sys_log(f"Shard {shard_id} disconnected"))
 
-    def giphy_gif_commands(self) -> List[str]:
-        return helper.fix_command(["gif", "giphy-gif"])
 
-    def giphy_sticker_commands(self) -> List[str]:
-        return helper.fix_command(["sticker", "stick", "giphy-sticker"])
+@event
+async def on_shard_resumed(shard_id):
+    """
+    Event for when a shard resumes its session after a disconnect.
+    """
+    shard_health.resumed(shard_id)
 
-    def all_commands(self) -> List[str]:
-        """
-        Returns a tuple containing lists of all commands.
 
-        Returns:
-        ---
-            tuple: A tuple containing lists of all commands, including greetings and commands for
-            requesting dog facts.
-        """
-        return (self.greets(), self.dog_facts(), self.weather_commands(), self.help_commands())
+def shard_guild_counts():
+    """
+    Returns the number of guilds served by each shard.
+    """
+    counts = {}
+    if client is not None:
+        for guild in client.guilds:
+            counts[guild.shard_id] = counts.get(guild.shard_id, 0) + 1
+    return counts
 
 
-@client.event
-async def on_connect():
+def shard_latencies():
     """
-    Event for when the bot connects to Discord.
+    Returns the heartbeat latency of each shard, in seconds.
+    """
+    return dict(client.latencies) if client is not None and client.shards else {}
 
-    Prints a system log message indicating that the bot has connected.
+
+shard_health = ShardHealth(shard_latencies, shard_guild_counts)
+
+###### MESSAGE HANDLING ######
+
+commands = Commands()
+registry = CommandRegistry()
+outbox = Outbox()
+executor = CommandExecutor(send=outbox.send)
+# (calls, seconds) per user and per channel, for the commands that call paid upstream APIs
+RATE_LIMITS = {
+    "weather": {"user": (3, 60), "channel": (10, 60)},
+    "gif": {"user": (5, 60), "channel": (20, 60)},
+    "sticker": {"user": (5, 60), "channel": (20, 60)},
+    "dog_facts": {"user": (10, 60), "channel": (30, 60)},
+    "cat_facts": {"user": (10, 60), "channel": (30, 60)},
+}
+rate_limiter = CommandRateLimiter(RATE_LIMITS)
+
+###### PLUGINS ######
+
+
+def _plugin_log(text: str) -> None:
+    print(logger.sys_log(text) if logger is not None else text)
+
+
+plugins = PluginManager(registry, log=_plugin_log)
+PLUGIN_RELOAD_INTERVAL = float(os.getenv("PLUGIN_RELOAD_INTERVAL", "2"))
+plugin_watcher: Optional[asyncio.Task] = None
+# the stats() of every cache outside the plugins, exported as metrics with the plugins' caches
+CACHES = {"geocode": helper.geocode_cache.stats, "gazetteer": helper.gazetteer.stats}
+
+###### WEATHER SUBSCRIPTIONS ######
+
+subscription_task: Optional[asyncio.Task] = None
+
+
+async def _subscription_report(city: str) -> str:
+    # looked up through sys.modules so a reloaded weather plugin is used
+    return await sys.modules["weather_file"].weather_report([city])
+
+
+async def _subscription_send(channel_id: int, content: str) -> None:
+    # the channel may not be cached in lean mode; a partial one is enough to send to
+    channel = client.get_channel(channel_id) or client.get_partial_messageable(channel_id)
+    await outbox.send(channel, content, merge=False)
+
+
+def all_caches():
     """
-    print(logger.sys_log("Bot Is Connected!" if not DEBUG else "Bot Is Connected! [DEBUG MODE]"))
+    Returns the stats() method of every cache, by name: CACHES and the plugins' caches.
+    """
+    return {**CACHES, **plugins.caches()}
 
 
-@client.event
-async def on_ready():
+def giphy_analytics_stats():
+    """
+    Returns the counters of the Giphy analytics queue, or an empty dict if the giphy
+    plugin is not loaded or has not been used yet.
     """
-    Event for when the bot is ready to receive messages.
-    Prints the bot's status and list of guild members.
+    module = sys.modules.get("giphy")
+    if module is None or not hasattr(module, "giphy") or not module.giphy.loaded:
+        return {}
+    return module.giphy.get().analytics.stats()
+
+###### METRICS ######
+
+METRICS_PORT = os.getenv("METRICS_PORT", "9100")
+metrics_server = (
+    MetricsServer(
+        REGISTRY, os.getenv("METRICS_HOST", "127.0.0.1"), int(METRICS_PORT), shard_health.healthy
+    )
+    if METRICS_PORT
+    else None
+)
+REGISTRY.stats("tr4shbot_cache_hits_total", "Cache hits.", "cache", all_caches, "hits", "counter")
+REGISTRY.stats(
+    "tr4shbot_cache_misses_total", "Cache misses.", "cache", all_caches, "misses", "counter"
+)
+REGISTRY.stats("tr4shbot_cache_entries", "Entries in each cache.", "cache", all_caches, "entries")
+REGISTRY.stats(
+    "tr4shbot_cache_stale_total",
+    "Expired values served because the upstream was unavailable.",
+    "cache",
+    all_caches,
+    "stale",
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_command_pending",
+    "Commands running or waiting for a concurrency slot.",
+    ("command",),
+    lambda: {(name,): stats["pending"] for name, stats in executor.stats().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_command_busy_total",
+    'Commands refused with a "busy" reply because too many were waiting.',
+    ("command",),
+    lambda: {(name,): stats["rejected"] for name, stats in executor.stats().items()},
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_command_rate_limited_total",
+    "Commands dropped by the per-user or per-channel rate limit.",
+    ("command", "scope"),
+    lambda: dict(rate_limiter.denied),
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_analytics_events_total",
+    "Giphy analytics pings, by outcome.",
+    ("result",),
+    lambda: {(key,): value for key, value in giphy_analytics_stats().items() if key != "depth"},
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_analytics_queue_depth",
+    "Giphy analytics pings waiting to be sent.",
+    (),
+    lambda: {(): giphy_analytics_stats()["depth"]} if giphy_analytics_stats() else {},
+)
+REGISTRY.callback(
+    "tr4shbot_shard_up",
+    "Whether each shard is connected and ready.",
+    ("shard",),
+    lambda: {(str(shard),): float(state["up"]) for shard, state in shard_health.snapshot().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_shard_latency_seconds",
+    "Gateway heartbeat latency of each shard.",
+    ("shard",),
+    lambda: {
+        (str(shard),): state["latency"]
+        for shard, state in shard_health.snapshot().items()
+        if state["latency"] is not None
+    },
+)
+REGISTRY.callback(
+    "tr4shbot_shard_disconnects_total",
+    "Gateway disconnects of each shard.",
+    ("shard",),
+    lambda: {(str(shard),): state["disconnects"] for shard, state in shard_health.snapshot().items()},
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_shard_guilds",
+    "Guilds served by each shard.",
+    ("shard",),
+    lambda: {(str(shard),): count for shard, count in shard_guild_counts().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_outbox_messages_total",
+    "Messages handled by the outbox, by outcome.",
+    ("result",),
+    lambda: {
+        (key,): value
+        for key, value in outbox.stats().items()
+        if key in ("sent", "merged", "rate_limited", "failed")
+    },
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_outbox_queued",
+    "Replies waiting in the outbox.",
+    (),
+    lambda: {(): outbox.stats()["queued"]},
+)
+REGISTRY.callback(
+    "tr4shbot_outbox_latency_seconds",
+    "Time replies spend in the outbox before delivery.",
+    ("quantile",),
+    lambda: {("0.5",): outbox.stats()["latency_p50"], ("0.99",): outbox.stats()["latency_p99"]},
+)
+
+
+@registry.command(["ping"], exact=True)
+async def ping(message, tokens):  # pylint:disable=unused-argument
     """
-    bot_status_channel = client.get_channel(1056239557084979260)
-    await bot_status_channel.send("Tr4shBot Running" if not DEBUG else "Tr4shBot Running [DEBUG MODE]")
-    # gets server membes
-    guild = None
-    for guild in client.guilds:
-        if guild.name == GUILD:
-            break
-    print(f"{client.user} is ready on the following servers:\n - {guild.name}(ID: {guild.id})")
+    Replies "pong" to "ping".
+    """
+    return "pong"
 
-    g_members = "\n - ".join([member.name for member in guild.members])
-    print(f"Guild Member:\n - {g_members}")
-    #if DEBUG:
 
-###### MESSAGE HANDLING ######
+@registry.command(
+    commands.greets(), exact=True, help="Send a greeting to the user", help_aliases=3
+)
+async def greet(message, tokens):  # pylint:disable=unused-argument
+    """
+    Replies with a random greeting to the author of the message.
+    """
+    guild_id = message.guild.id if message.guild is not None else None
+    return helper.random_greeting(message.author.name, guild_id)
+
 
+# help texts by (registry version, prefix, enabled commands), so each guild setup is built once
+_help_cache = {}
 
-@client.event
+
+def help_text(config=None) -> str:
+    """
+    Returns the help text, built from the help metadata of every registered command and
+    rebuilt only when a command is added or removed.
+
+    Args:
+    ---
+        config (Optional[GuildConfig]): The config of the guild asking. Its disabled commands
+            are left out and its prefix is shown instead of "!".
+
+    Returns:
+    ---
+        str: The help text.
+    """
+    config = config or guild_configs.get(None)
+    key = (registry.version, config.prefix, config.enabled)
+    text = _help_cache.get(key)
+    if text is None:
+        lines = [cmd.help_line() for cmd in registry.commands() if config.allows(cmd.name)]
+        text = "\n".join(["**Available commands:**"] + [line for line in lines if line])
+        if config.prefix != "!":
+            text = text.replace("**!", f"**{config.prefix}").replace(", !", f", {config.prefix}")
+        if len(_help_cache) > 256 or any(cached[0] != registry.version for cached in _help_cache):
+            _help_cache.clear()
+        _help_cache[key] = text
+    return text
+
+
+@registry.command(commands.help_commands(), exact=True)
+async def help_command(message, tokens):  # pylint:disable=unused-argument
+    """
+    Replies with the list of commands available in the guild.
+    """
+    guild_id = message.guild.id if message.guild is not None else None
+    return help_text(guild_configs.get(guild_id))
+
+
+@event
 async def on_message(message):
     """
     Handles messages sent in the Discord server.
 
+    The guild's config is looked up in memory: a message written with the guild's prefix is
+    rewritten to "!", and commands the guild disabled are ignored.
+    The message is tokenized once and its handler is found with a single
+    lookup in the command registry; messages that are not commands return right away.
+    Commands over their per-user or per-channel rate limit are dropped without a reply.
+    The handler is run by the command executor, and if the command already has too many
+    requests waiting, a short "busy" reply is sent instead. The command's latency, errors
+    and in-flight count are recorded in the metrics.
+
     Args:
     ---
         message (discord.Message): The message sent in the Discord server.
     """
-    commands = Commands()
     print(logger.chat_log(message=message))
-    # ping-pong command
-    if message.content.lower() == "ping":
-        await message.channel.send("pong")
-    # gretting commands
-    elif message.content.lower() in commands.greets():
-        await message.channel.send(helper.random_greeting(message.author.name))
-    # dog commands
-    elif message.content.lower() in commands.dog_facts():
-        await message.channel.send(dog_fact.random_fact())
-    # cat commands
-    elif message.content.lower() in commands.cat_facts():
-        await message.channel.send(cat_fact.random_fact())
-    # weather commands
-    elif message.content.lower().split()[0] in commands.weather_commands():
-        city_name = message.content.lower().split(" ")
-        weather_class = weather_file.Weather(
-            city="esbjerg" if len(city_name) < 2 else city_name[-1]
-        )
-        await message.channel.send(weather_class.weather())
-    # gif commands
-    elif message.content.lower().split()[0] in commands.giphy_gif_commands():
-        search_query = message.content.lower().split(" ")
-        if len(search_query) < 2:
-            await message.channel.send("No Search query was given :(")
-            return 
-        search_query = search_query[1:]
-        giphy = Giphy(search=search_query)
-        await message.channel.send(giphy.get_gif())
-    # sticker commands
-    elif message.content.lower().split()[0] in commands.giphy_sticker_commands():
-        search_query = message.content.lower().split(" ")
-        if len(search_query) < 2:
-            await message.channel.send("No Search query was given :(")
-            return 
-        search_query = search_query[1:]
-        giphy = Giphy(search=search_query)
-        await message.channel.send(giphy.get_sticker())
-
-    elif message.content.lower() in commands.help_commands():
-        help_text = "**Available commands:**\n"
-        help_text += (
-            f"**{', '.join(commands.greets()[0:3])}**: Send a greeting to the user\n"
-        )
-        help_text += f"**{', '.join(commands.dog_facts())}**: Get a random dog fact\n"
-        help_text += f"**{', '.join(commands.cat_facts())}**: Get a random cat fact\n"
-        help_text += f"**{', '.join(commands.weather_commands())} [city]**: Get weather information for a city\n"  # pylint: disable=line-too-long
-        help_text += f"**{', '.join(commands.giphy_gif_commands())} [search]**: displays a GIF based on the search terms"
-
-        await message.channel.send(help_text)
-
-
-@client.event
-async def on_message_edit(before, after):
+    config = guild_configs.get(message.guild.id if message.guild is not None else None)
+    content = config.translate(message.content)
+    found = registry.resolve(content) if content is not None else None
+    if found is None or not config.allows(found[0].name):
+        return
+    cmd, tokens = found
+    if not rate_limiter.allow(cmd.name, message.author.id, message.channel.id):
+        return
+    with track_command(cmd.name):
+        ran = await executor.run(cmd, message, tokens)
+    if not ran:
+        await outbox.send(message.channel, BUSY_REPLY, merge=False)
+
+
+@event
+async def on_raw_message_edit(payload):
     """
     Logs any edits made to a message in a Discord server.
 
-    This event handler is triggered when a message is edited in a Discord server.
-    It prints the original and edited versions of the message to the console.
+    The raw event fires whether or not the message is in discord.py's message cache, which
+    is off in lean mode. The original content is only logged when the message was cached.
 
     Args:
     ---
-        before (discord.Message): The original version of the message.
-        after (discord.Message): The edited version of the message.
+        payload (discord.RawMessageUpdateEvent): The edit.
 
     Returns:
     ---
         None
     """
-    print(logger.chat_edit_log(before, after))
+    msg = logger.chat_raw_edit_log(payload, client.get_channel(payload.channel_id))
+    if msg is not None:
+        print(msg)
 
 
-@client.event
-async def on_message_delete(before):
+@event
+async def on_raw_message_delete(payload):
     """
     Logs the deletion of a message in a Discord server.
 
+    The raw event fires whether or not the message is in discord.py's message cache.
+    The deleted content is only logged when the message was cached.
+
     Args:
     ---
-        before: The message that was deleted.
+        payload (discord.RawMessageDeleteEvent): The deletion.
 
     Returns:
     ---
         None
     """
-    print(logger.chat_delete_log(before))
+    print(logger.chat_raw_delete_log(payload, client.get_channel(payload.channel_id)))
 
 ###### REACTION HANDLING ######
 
 
-@client.event
+@event
 async def on_raw_reaction_add(payload):
     reaction = payload.emoji.name
-    user = f"{payload.member.name}#{payload.member.discriminator}"
+    # the member is only sent for reactions in guilds
+    user = (
+        f"{payload.member.name}#{payload.member.discriminator}"
+        if payload.member is not None
+        else f"user {payload.user_id}"
+    )
     print(f"{user} reacted with {reaction} to a message")
 
 
-@client.event
+@event
 async def on_raw_reaction_remove(payload):
     # print(payload)
     reaction = payload.emoji.name
     print(f"{reaction} removed from a message")
 
 
-@client.event
+@event
 async def on_raw_reaction_clear(payload):
     print(payload)
 
 ###### MEMBER HANDLING ######
 
 
-@client.event
+@event
 async def on_member_join(member):
     print(member)
 
 
-@client.event
+@event
 async def on_member_remove(member):
     print(member)
 
 
-@client.event
+@event
 async def on_member_update(member_befor, member_after):
     print(member_befor, member_after)
 
 
-@client.event
+@event
 async def on_member_ban(guild, user):
     print(guild, user)
 
 
-@client.event
+@event
 async def on_member_unban(guild, user):
     print(guild, user)
 
 ###### THREAD HANDLING ######
 
 
-@client.event
+@event
 async def on_thread_create(thread):
     print(thread)
 
 
-@client.event
+@event
 async def on_thread_join(thread):
     print(thread)
 
 
-@client.event
+@event
 async def on_thread_update(thread_before, thread_after):
     print(thread_before, thread_after)
 
 
-@client.event
+@event
 async def on_thread_remove(thread):
     print(thread)
 
 
-@client.event
+@event
 async def on_thread_delete(thread):
     print(thread)
 
 
+async def shutdown():
+    """
+    Stops watching the plugins and posting the weather subscriptions, runs the plugins'
+    cleanup (stopping the fact pools and flushing the Giphy analytics queue), flushes the
+    outbox, closes the pooled HTTP connections, the geocode cache and the subscriptions
+    database, and stops serving the metrics.
+    """
+    if plugin_watcher is not None:
+        plugin_watcher.cancel()
+    if subscription_task is not None:
+        subscription_task.cancel()
+    await plugins.close()
+    await outbox.close()
+    # the HTTP client is only imported by the command modules
+    http_pool = sys.modules.get("http_pool")
+    if http_pool is not None:
+        await http_pool.shared_client.close()
+    helper.geocode_cache.close()
+    weather_subscriptions.close()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+
+async def main():
+    """
+    Builds the client and runs the bot until it is stopped, then shuts it down.
+    """
+    import discord  # pylint:disable=import-outside-toplevel
+    discord.utils.setup_logging()
+    async with create_app():
+        try:
+            await client.start(TOKEN)
+        finally:
+            await shutdown()
+
+
 if __name__ == "__main__":
     try:
-        client.run(TOKEN)
-    except RuntimeError:
+        asyncio.run(main())
+    except (RuntimeError, KeyboardInterrupt):
         print("STOPPING BOT")
-        logger.close_files()
+    finally:
+        blocking_pool.shutdown(wait=False, cancel_futures=True)
+        if logger is not None:
+            logger.close_files()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the CircuitBreaker class, which stops the bot from calling an upstream
+API that is failing, so commands fail fast (or fall back to cached data) instead of every
+user waiting out the request timeout for the whole outage.
+
+A breaker is closed while its upstream is healthy. When the error rate over a rolling window
+reaches its threshold it opens, and every call is refused right away with CircuitOpenError.
+After `open_for` seconds it lets a few trial calls through (half-open): if they succeed it
+closes again, if one fails it opens for another `open_for` seconds.
+
+Attributes:
+---
+    CLOSED / OPEN / HALF_OPEN: The states of a breaker.
+    UPSTREAM_SETTINGS: The breaker settings of the upstreams that differ from the defaults.
+    breakers: The BreakerRegistry holding the breaker of every upstream, exported as metrics.
+
+Methods:
+---
+    CircuitBreaker.check: Raises CircuitOpenError if a call is not allowed.
+    CircuitBreaker.record: Records the outcome of a call.
+    CircuitBreaker.guard: Checks and records a call in a `with` block.
+    BreakerRegistry.get: Returns the breaker of an upstream.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+from metrics import REGISTRY
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+# the weather, Giphy search and geocoding are cached and coalesced, so an outage reaches
+# their breakers as a trickle of calls, diluted by the successes from before it: a short
+# window with few calls, and a few failures in a row, let them trip anyway
+UPSTREAM_SETTINGS: Dict[str, Dict[str, float]] = {
+    "openweathermap": {"min_calls": 3, "window": 10.0, "consecutive_failures": 3},
+    "giphy_search": {"min_calls": 3, "window": 10.0, "consecutive_failures": 3},
+    "nominatim": {"min_calls": 3, "window": 10.0, "consecutive_failures": 3},
+}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream whose breaker is open.
+
+    Attributes:
+    ---
+        - upstream (str): The name of the upstream.
+        - retry_in (float): The number of seconds until the breaker lets a trial call through.
+    """
+
+    def __init__(self, upstream: str, retry_in: float) -> None:
+        super().__init__(f"{upstream} is unavailable, retrying in {retry_in:.0f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    A closed/open/half-open circuit breaker with a rolling error-rate window.
+
+    Outcomes are counted in one-second buckets covering the last `window` seconds, so
+    recording a call and checking the error rate cost the same no matter the traffic. The
+    breaker only opens once at least `min_calls` calls were made in the window, so a single
+    failure in a quiet period does not trip it. With `consecutive_failures`, it also opens
+    after that many failures in a row, however many successes came before them in the window.
+
+    Attributes:
+    ---
+        - name (str): The name of the upstream.
+        - failure_rate (float): The share of failed calls, from 0 to 1, that opens the breaker.
+        - min_calls (int): The number of calls in the window needed before it can open.
+        - window (float): The length of the rolling window, in seconds.
+        - open_for (float): How long the breaker stays open before a trial call, in seconds.
+        - half_open_calls (int): The number of trial calls allowed at once while half-open.
+        - consecutive_failures (int): The number of failures in a row that opens the breaker,
+                or 0 to only go by the failure rate.
+        - rejected (int): The number of calls refused while open.
+        - opened (int): The number of times the breaker opened.
+
+    Methods:
+    ---
+        - state(self) -> str: Returns the current state.
+        - check(self) -> None: Raises CircuitOpenError if a call is not allowed.
+        - record(self, success) -> None: Records the outcome of a call.
+        - release(self) -> None: Gives back an allowed call without an outcome.
+        - guard(self, is_failure) -> ContextManager: Checks and records a call.
+        - stats(self) -> Dict[str, float]: Returns the breaker's counters.
+    """
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window: float = 30.0,
+        open_for: float = 15.0,
+        half_open_calls: int = 1,
+        consecutive_failures: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_for = open_for
+        self.half_open_calls = half_open_calls
+        self.consecutive_failures = int(consecutive_failures)
+        self.rejected = 0
+        self.opened = 0
+        self._clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._failures_in_a_row = 0
+        # [second, successes, failures], oldest first
+        self._buckets: Deque[List[int]] = deque()
+        self._lock = threading.Lock()
+
+    def state(self) -> str:
+        """
+        Returns the current state: CLOSED, OPEN or HALF_OPEN.
+
+        Returns:
+        ---
+            str: The state.
+        """
+        with self._lock:
+            self._advance()
+            return self._state
+
+    def check(self) -> None:
+        """
+        Allows a call, or refuses it by raising CircuitOpenError. An allowed call must be
+        followed by `record`.
+
+        Raises:
+        ---
+            CircuitOpenError: If the breaker is open, or half-open with every trial slot taken.
+        """
+        with self._lock:
+            self._advance()
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self._opened_at + self.open_for - self._clock())
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, success: bool) -> None:
+        """
+        Records the outcome of a call allowed by `check`.
+
+        Args:
+        ---
+            success (bool): Whether the call succeeded.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == HALF_OPEN:
+                self._trials = max(0, self._trials - 1)
+                if success:
+                    self._state = CLOSED
+                    self._buckets.clear()
+                else:
+                    self._open(now)
+                return
+            if self._state == OPEN:
+                return  # a call that started before the breaker opened
+            second = int(now)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0])
+            self._buckets[-1][1 if success else 2] += 1
+            self._failures_in_a_row = 0 if success else self._failures_in_a_row + 1
+            if self.consecutive_failures and self._failures_in_a_row >= self.consecutive_failures:
+                self._open(now)
+                return
+            self._prune(now)
+            successes = sum(bucket[1] for bucket in self._buckets)
+            failures = sum(bucket[2] for bucket in self._buckets)
+            calls = successes + failures
+            if not success and calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(now)
+
+    @contextmanager
+    def guard(self, is_failure: Optional[Callable[[BaseException], bool]] = None) -> Iterator[None]:
+        """
+        Checks that a call is allowed and records its outcome: the block failed if it raised
+        an exception for which `is_failure` returns True (every exception by default).
+
+        Args:
+        ---
+            is_failure (Optional[Callable[[BaseException], bool]]): Decides whether an
+                exception means the upstream failed, e.g. False for "404 Not Found".
+
+        Raises:
+        ---
+            CircuitOpenError: If the call is not allowed.
+        """
+        self.check()
+        try:
+            yield
+        except Exception as error:
+            self.record(is_failure is not None and not is_failure(error))
+            raise
+        except BaseException:
+            # cancelled: says nothing about the upstream
+            self.release()
+            raise
+        self.record(True)
+
+    def release(self) -> None:
+        """
+        Gives back a call allowed by `check` without recording an outcome, e.g. when the
+        call was cancelled.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trials = max(0, self._trials - 1)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the breaker's counters.
+
+        Returns:
+        ---
+            Dict[str, float]: The state as a number (0 closed, 1 half-open, 2 open),
+            the calls and failures in the window, the calls rejected and the times opened.
+        """
+        with self._lock:
+            self._advance()
+            self._prune(self._clock())
+            return {
+                "state": STATE_VALUES[self._state],
+                "calls": sum(bucket[1] + bucket[2] for bucket in self._buckets),
+                "failures": sum(bucket[2] for bucket in self._buckets),
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._trials = 0
+        self._failures_in_a_row = 0
+        self._buckets.clear()
+        self.opened += 1
+
+    def _advance(self) -> None:
+        if self._state == OPEN and self._clock() >= self._opened_at + self.open_for:
+            self._state = HALF_OPEN
+            self._trials = 0
+
+    def _prune(self, now: float) -> None:
+        oldest = int(now - self.window)
+        while self._buckets and self._buckets[0][0] <= oldest:
+            self._buckets.popleft()
+
+
+class BreakerRegistry:
+    """
+    The circuit breaker of every upstream, created on first use.
+
+    The default settings are read from the environment: BREAKER_FAILURE_RATE (default 0.5),
+    BREAKER_MIN_CALLS (5), BREAKER_WINDOW (30 seconds) and BREAKER_OPEN_FOR (15 seconds).
+    `overrides` changes some of them for some upstreams, by name.
+
+    Attributes:
+    ---
+        - settings (Dict[str, float]): The default settings of the breakers.
+        - overrides (Dict[str, Dict[str, float]]): The settings that differ, by upstream.
+
+    Methods:
+    ---
+        - get(self, name) -> CircuitBreaker: Returns the breaker of an upstream.
+        - stats(self) -> Dict[str, Dict[str, float]]: Returns the counters of every breaker.
+    """
+
+    def __init__(self, overrides: Optional[Dict[str, Dict[str, float]]] = None, **settings) -> None:
+        self.overrides = dict(UPSTREAM_SETTINGS if overrides is None else overrides)
+        self.settings = settings or {
+            "failure_rate": float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+            "min_calls": int(os.getenv("BREAKER_MIN_CALLS", "5")),
+            "window": float(os.getenv("BREAKER_WINDOW", "30")),
+            "open_for": float(os.getenv("BREAKER_OPEN_FOR", "15")),
+        }
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        """
+        Returns the breaker of an upstream, creating it if needed.
+
+        Args:
+        ---
+            name (str): The name of the upstream, as recorded in the metrics.
+
+        Returns:
+        ---
+            CircuitBreaker: The breaker.
+        """
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    settings = {**self.settings, **self.overrides.get(name, {})}
+                    breaker = self._breakers[name] = CircuitBreaker(name, **settings)
+        return breaker
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the counters of every breaker.
+
+        Returns:
+        ---
+            Dict[str, Dict[str, float]]: The stats() of every breaker, by upstream.
+        """
+        return {name: breaker.stats() for name, breaker in list(self._breakers.items())}
+
+
+breakers = BreakerRegistry()
+
+REGISTRY.callback(
+    "tr4shbot_circuit_state",
+    "State of each upstream's circuit breaker: 0 closed, 1 half-open, 2 open.",
+    ("upstream",),
+    lambda: {(name,): stats["state"] for name, stats in breakers.stats().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_circuit_rejected_total",
+    "Upstream calls refused because the circuit breaker was open.",
+    ("upstream",),
+    lambda: {(name,): stats["rejected"] for name, stats in breakers.stats().items()},
+    "counter",
+)
+REGISTRY.callback(
+    "tr4shbot_circuit_opened_total",
+    "Times each upstream's circuit breaker opened.",
+    ("upstream",),
+    lambda: {(name,): stats["opened"] for name, stats in breakers.stats().items()},
+    "counter",
+)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the Commands class, which lists the aliases of every command.
+
+It lives apart from bot so that modules needing the aliases (such as helper, for the
+greetings) can use them without importing the bot, discord.py and every command module.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    Commands.greets: Returns the greeting commands.
+    Commands.all_commands: Returns every list of commands.
+"""
+from typing import List
+from helper import fix_command
+
+
+class Commands:
+    """
+    A class containing methods for accessing lists of commands.
+
+    The class has methods for accessing lists of greetings and dog facts,
+    as well as a method for accessing all commands.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the Commands class.
+        """
+
+    def greets(self) -> List[str]:
+        """
+        Returns a list of greetings.
+
+        Returns:
+        ---
+            list: A list of greetings.
+        """
+        return fix_command(
+            ["hello", "hey", "hi", "hiya", "greetings",
+                "yo", "sup", "wassup", "howdy"]
+        )
+
+    def dog_facts(self) -> List[str]:
+        """
+        Returns a list of commands for requesting dog facts.
+
+        Returns:
+        ---
+            list: A list of commands for requesting dog facts.
+        """
+        return fix_command(["dogfact", "dog-fact"])
+
+    def cat_facts(self) -> List[str]:
+        """
+        Returns a list of commands for requesting cat facts.
+
+        Returns:
+        ---
+            list: A list of commands for requesting cat facts.
+        """
+        return fix_command(["catfact", "cat-fact"])
+
+    def weather_commands(self) -> List[str]:
+        """
+        Returns a list of commands for requesting weather information.
+
+        Returns:
+        ---
+            List[str]: A list of commands for requesting weather information.
+        """
+        return fix_command(["weather", "w"])
+
+    def help_commands(self) -> List[str]:
+        """
+        Returns a list of commands for accessing help information.
+
+        Returns:
+        ---
+            List[str]: A list of commands for accessing help information.
+        """
+        return fix_command(["help", "h", "?"])
+
+    def giphy_gif_commands(self) -> List[str]:
+        return fix_command(["gif", "giphy-gif"])
+
+    def giphy_sticker_commands(self) -> List[str]:
+        return fix_command(["sticker", "stick", "giphy-sticker"])
+
+    def all_commands(self) -> List[str]:
+        """
+        Returns a tuple containing lists of all commands.
+
+        Returns:
+        ---
+            tuple: A tuple containing lists of all commands, including greetings and commands for
+            requesting dog facts.
+        """
+        return (self.greets(), self.dog_facts(), self.weather_commands(), self.help_commands())
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the CommandExecutor class, which runs command handlers under
+per-command concurrency limits, and the shared thread pool used for blocking work.
+
+Attributes:
+---
+    BUSY_REPLY: The reply sent when a command has too many requests waiting.
+    blocking_pool: The bounded thread pool blocking calls are run on.
+
+Methods:
+---
+    run_blocking: Runs a blocking function on the shared thread pool.
+    CommandExecutor.run: Runs a command, or refuses it if the command is saturated.
+    CommandExecutor.stats: Returns the in-flight and rejected counters of every command.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from command_registry import Command
+
+BUSY_REPLY = "I'm a bit busy right now, please try again in a moment :("
+
+blocking_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_POOL_SIZE", "8")), thread_name_prefix="blocking"
+)
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a blocking function on the shared thread pool without blocking the event loop.
+
+    Args:
+    ---
+        - func (Callable[..., Any]): The blocking function.
+        - *args, **kwargs: The arguments to call it with.
+
+    Returns:
+    ---
+        Any: What the function returned.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool, functools.partial(func, *args, **kwargs))
+
+
+class _CommandLimit:
+    __slots__ = ("concurrency", "semaphore", "pending", "rejected")
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = 0
+        self.rejected = 0
+
+
+class CommandExecutor:
+    """
+    Runs command handlers, limiting how many of each command run and wait at once.
+
+    A command registered with `concurrency` runs at most that many times at once, with at most
+    `queue` more invocations waiting for a slot. Past that the command is saturated, and `run`
+    returns False right away so the caller can send a cheap "busy" reply. One hot command can
+    then only tie up its own slots and never starves the others.
+
+    Handlers return the reply text, or None if they have nothing to say, and the reply is sent
+    to the message's channel with `send`, a coroutine taking the channel and the text (by
+    default the channel's own send). Handlers registered with `blocking=True` are plain
+    functions, run on the shared thread pool.
+
+    Methods:
+    ---
+        - run(self, cmd, message, tokens) -> bool: Runs a command, or returns False if
+                the command is saturated.
+        - stats(self) -> Dict[str, Dict[str, int]]: Returns the in-flight and
+                rejected counters of every limited command.
+    """
+
+    def __init__(self, send: Optional[Callable[[Any, str], Awaitable[Any]]] = None) -> None:
+        self.send = send or (lambda channel, content: channel.send(content))
+        self._limits: Dict[str, _CommandLimit] = {}
+
+    async def run(self, cmd: Command, message, tokens: List[str]) -> bool:
+        """
+        Runs a command's handler, waiting for a free slot if the command is at its concurrency.
+
+        Args:
+        ---
+            - cmd (Command): The command to run.
+            - message (discord.Message): The message that triggered the command.
+            - tokens (List[str]): The lowercased words of the message.
+
+        Returns:
+        ---
+            bool: True if the command ran, False if it was refused because it is saturated.
+        """
+        if cmd.concurrency is None:
+            await self._invoke(cmd, message, tokens)
+            return True
+        limit = self._limits.get(cmd.name)
+        if limit is None or limit.concurrency != cmd.concurrency:
+            # a reloaded plugin may have changed the limit; invocations already running
+            # finish on the old semaphore
+            rejected = limit.rejected if limit is not None else 0
+            limit = self._limits[cmd.name] = _CommandLimit(cmd.concurrency)
+            limit.rejected = rejected
+        if limit.pending >= cmd.concurrency + cmd.queue:
+            limit.rejected += 1
+            return False
+        limit.pending += 1
+        try:
+            async with limit.semaphore:
+                await self._invoke(cmd, message, tokens)
+        finally:
+            limit.pending -= 1
+        return True
+
+    async def _invoke(self, cmd: Command, message, tokens: List[str]) -> None:
+        if cmd.blocking:
+            reply = await run_blocking(cmd.handler, message, tokens)
+        else:
+            reply = await cmd.handler(message, tokens)
+        if reply:
+            await self.send(message.channel, reply)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the counters of every command with a concurrency limit.
+
+        Returns:
+        ---
+            Dict[str, Dict[str, int]]: For every command name, the number of invocations
+            running or waiting ("pending") and the number refused ("rejected").
+        """
+        return {
+            name: {"pending": limit.pending, "rejected": limit.rejected}
+            for name, limit in self._limits.items()
+        }
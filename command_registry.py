@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the CommandRegistry class, which maps command aliases to
+their handler coroutines so a message can be dispatched with a single dictionary lookup.
+
+Attributes:
+---
+    Handler: The type of a command handler: a coroutine function, or a plain
+        function returning the reply text for blocking commands.
+
+Methods:
+---
+    make_command: Builds a Command for a handler, checking its arguments.
+    CommandRegistry.command: Decorator that registers a handler under one or more aliases.
+    CommandRegistry.register / CommandRegistry.unregister: Adds or removes commands at runtime.
+    CommandRegistry.resolve: Finds the handler for a message's content.
+"""
+import inspect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+Handler = Callable[..., Any]
+
+
+class Command:
+    """
+    A registered command.
+
+    Attributes:
+    ---
+        - name (str): The name of the command, taken from the handler function.
+        - aliases (List[str]): Every alias the command answers to.
+        - handler (Handler): The coroutine that handles the command.
+        - exact (bool): If True the whole message must equal an alias,
+                otherwise only the first word has to.
+        - blocking (bool): If True the handler is a plain function that blocks,
+                and is run on the shared thread pool.
+        - concurrency (Optional[int]): How many invocations may run at once, or None for no limit.
+        - queue (int): How many invocations may wait for a slot before new ones are refused.
+        - help (Optional[str]): The description shown by the help command, or None to hide it.
+        - usage (str): The arguments shown after the aliases in the help, e.g. "[city]".
+        - help_aliases (Optional[int]): How many aliases the help shows, or None for all.
+    """
+
+    __slots__ = (
+        "name", "aliases", "handler", "exact", "blocking", "concurrency", "queue",
+        "help", "usage", "help_aliases",
+    )
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        name: str,
+        aliases: List[str],
+        handler: Handler,
+        exact: bool,
+        blocking: bool = False,
+        concurrency: Optional[int] = None,
+        queue: int = 0,
+        help: Optional[str] = None,  # pylint:disable=redefined-builtin
+        usage: str = "",
+        help_aliases: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.aliases = aliases
+        self.handler = handler
+        self.exact = exact
+        self.blocking = blocking
+        self.concurrency = concurrency
+        self.queue = queue
+        self.help = help
+        self.usage = usage
+        self.help_aliases = help_aliases
+
+    def help_line(self) -> Optional[str]:
+        """
+        Returns the command's line in the help text.
+
+        Returns:
+        ---
+            Optional[str]: The line, or None if the command is hidden from the help.
+        """
+        if self.help is None:
+            return None
+        aliases = ", ".join(self.aliases[: self.help_aliases])
+        usage = f" {self.usage}" if self.usage else ""
+        return f"**{aliases}{usage}**: {self.help}"
+
+
+def make_command(  # pylint:disable=too-many-arguments
+    handler: Handler,
+    aliases: Iterable[str],
+    exact: bool = False,
+    blocking: bool = False,
+    concurrency: Optional[int] = None,
+    queue: int = 0,
+    help: Optional[str] = None,  # pylint:disable=redefined-builtin
+    usage: str = "",
+    help_aliases: Optional[int] = None,
+) -> Command:
+    """
+    Builds a Command named after its handler.
+
+    Args:
+    ---
+        The handler, followed by the arguments of CommandRegistry.command.
+
+    Returns:
+    ---
+        Command: The command.
+
+    Raises:
+    ---
+        TypeError: If the handler is a coroutine function and `blocking` is set, or the other
+            way around.
+    """
+    if blocking == inspect.iscoroutinefunction(handler):
+        raise TypeError(
+            f"{handler.__name__} must be a {'plain' if blocking else 'coroutine'} function"
+        )
+    return Command(
+        handler.__name__, [alias.lower() for alias in aliases], handler, exact, blocking,
+        concurrency, queue, help, usage, help_aliases,
+    )
+
+
+class CommandRegistry:
+    """
+    A table of commands.
+
+    Handlers register themselves with the `command` decorator, and plugins add and remove
+    theirs at runtime with `register` and `unregister`. Every alias is lowercased
+    and stored as a key in a dictionary, so finding the handler for a message costs one
+    tokenization and one hash lookup no matter how many commands exist. Messages whose
+    first character can not start any alias are rejected without being tokenized.
+
+    Methods:
+    ---
+        - command(self, aliases, exact) -> Callable: Decorator registering a handler.
+        - register(self, cmd, position) -> None: Adds a command.
+        - unregister(self, name) -> Optional[int]: Removes a command.
+        - resolve(self, content) -> Optional[Tuple[Command, List[str]]]: Finds the command
+                for a message and returns it together with the message's tokens.
+        - commands(self) -> List[Command]: Every registered command, in registration order.
+
+    Attributes:
+    ---
+        - version (int): Incremented whenever a command is added or removed, so tables built
+                from the commands (such as the help text) know when to rebuild.
+    """
+
+    def __init__(self) -> None:
+        self._table: Dict[str, Command] = {}
+        self._commands: List[Command] = []
+        # first characters of every alias, in both cases, so plain chat is rejected
+        # before it is lowercased or split.
+        self._leading: Set[str] = set()
+        self.version = 0
+
+    def command(  # pylint:disable=too-many-arguments
+        self,
+        aliases: Iterable[str],
+        exact: bool = False,
+        blocking: bool = False,
+        concurrency: Optional[int] = None,
+        queue: int = 0,
+        help: Optional[str] = None,  # pylint:disable=redefined-builtin
+        usage: str = "",
+        help_aliases: Optional[int] = None,
+    ) -> Callable[[Handler], Handler]:
+        """
+        Registers the decorated function as the handler for the given aliases.
+
+        Args:
+        ---
+            - aliases (Iterable[str]): The aliases that trigger the command, e.g. ["!w", "!weather"].
+            - exact (bool): If True the whole message must equal an alias. Defaults to False.
+            - blocking (bool): If True the handler is a plain function returning the reply,
+                    run on the shared thread pool. Defaults to False.
+            - concurrency (Optional[int]): How many invocations may run at once.
+                    Defaults to no limit.
+            - queue (int): How many invocations may wait for a slot. Defaults to 0.
+            - help (Optional[str]): The description shown by the help command.
+                    Defaults to None, hiding the command from the help.
+            - usage (str): The arguments shown in the help, e.g. "[city]". Defaults to "".
+            - help_aliases (Optional[int]): How many aliases the help shows. Defaults to all.
+
+        Returns:
+        ---
+            Callable: A decorator that returns the handler unchanged.
+        """
+        aliases = list(aliases)
+
+        def decorator(handler: Handler) -> Handler:
+            self.register(
+                make_command(
+                    handler, aliases, exact, blocking, concurrency, queue, help, usage, help_aliases
+                )
+            )
+            return handler
+
+        return decorator
+
+    def register(self, cmd: Command, position: Optional[int] = None) -> None:
+        """
+        Adds a command.
+
+        Args:
+        ---
+            - cmd (Command): The command.
+            - position (Optional[int]): Where to insert it in the command list (which orders
+                    the help text). Defaults to the end.
+
+        Raises:
+        ---
+            ValueError: If one of its aliases is already registered.
+        """
+        for alias in cmd.aliases:
+            if alias in self._table:
+                raise ValueError(f'alias "{alias}" is already registered to {self._table[alias].name}')
+        for alias in cmd.aliases:
+            self._table[alias] = cmd
+        self._commands.insert(len(self._commands) if position is None else position, cmd)
+        self._rebuild_leading()
+
+    def unregister(self, name: str) -> Optional[int]:
+        """
+        Removes a command.
+
+        Args:
+        ---
+            - name (str): The name of the command.
+
+        Returns:
+        ---
+            Optional[int]: The position the command had in the command list,
+            or None if no command has that name.
+        """
+        for position, cmd in enumerate(self._commands):
+            if cmd.name == name:
+                del self._commands[position]
+                for alias in cmd.aliases:
+                    if self._table.get(alias) is cmd:
+                        del self._table[alias]
+                self._rebuild_leading()
+                return position
+        return None
+
+    def _rebuild_leading(self) -> None:
+        self._leading = {
+            char for alias in self._table for char in (alias[:1], alias[:1].upper())
+        }
+        self.version += 1
+
+    def resolve(self, content: str) -> Optional[Tuple[Command, List[str]]]:
+        """
+        Finds the command for a message.
+
+        Args:
+        ---
+            - content (str): The content of the message.
+
+        Returns:
+        ---
+            Optional[Tuple[Command, List[str]]]: The command and the lowercased tokens of the
+            message, or None if the message is not a command.
+        """
+        # split() below ignores leading whitespace, so the first-character check must too
+        if content.lstrip()[:1] not in self._leading:
+            return None
+        content = content.lower()
+        tokens = content.split()
+        if not tokens:
+            return None
+        cmd = self._table.get(tokens[0])
+        if cmd is None or (cmd.exact and content != tokens[0]):
+            return None
+        return cmd, tokens
+
+    def commands(self) -> List[Command]:
+        """
+        Returns every registered command, in registration order.
+
+        Returns:
+        ---
+            List[Command]: The registered commands.
+        """
+        return list(self._commands)
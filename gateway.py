@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the gateway settings of the Discord client: the intents each event
+handler needs, and "lean mode", which only asks Discord for those intents and keeps
+discord.py's member and message caches small.
+
+With Intents.all() discord.py receives, and caches, every member, presence and message of
+every guild. In lean mode (the default, LEAN_MODE=1) the client instead:
+
+    - only requests the intents of the event handlers that are registered;
+    - does not cache members, and does not download member lists at startup;
+    - keeps no message cache (or one of MAX_MESSAGES messages), since edits, deletions
+      and reactions are logged from the on_raw_* events, which don't need it.
+
+The member, ban and thread logging handlers need privileged or extra intents, so in lean
+mode they are only registered if their group is listed in LOG_EVENTS, e.g.
+"LOG_EVENTS=members,threads".
+
+Attributes:
+---
+    EVENT_INTENTS: The intents each event handler needs.
+    EVENT_GROUPS: The optional logging handlers, by group.
+    DEFAULT_GROUPS: The groups enabled by default.
+
+Methods:
+---
+    lean_mode: Whether lean mode is enabled.
+    enabled_events: Returns the handlers to register.
+    intents_for: Returns the intents a set of handlers needs.
+    client_options: Returns the keyword arguments the client is built with.
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+EVENT_INTENTS: Dict[str, Iterable[str]] = {
+    "on_message": ("guild_messages", "dm_messages", "message_content"),
+    "on_raw_message_edit": ("guild_messages", "dm_messages"),
+    "on_raw_message_delete": ("guild_messages", "dm_messages"),
+    "on_raw_reaction_add": ("guild_reactions", "dm_reactions"),
+    "on_raw_reaction_remove": ("guild_reactions", "dm_reactions"),
+    "on_raw_reaction_clear": ("guild_reactions", "dm_reactions"),
+    "on_member_join": ("members",),
+    "on_member_remove": ("members",),
+    "on_member_update": ("members",),
+    "on_member_ban": ("bans",),
+    "on_member_unban": ("bans",),
+}
+
+EVENT_GROUPS: Dict[str, Iterable[str]] = {
+    "edits": ("on_raw_message_edit",),
+    "deletes": ("on_raw_message_delete",),
+    "reactions": ("on_raw_reaction_add", "on_raw_reaction_remove", "on_raw_reaction_clear"),
+    "members": ("on_member_join", "on_member_remove", "on_member_update"),
+    "bans": ("on_member_ban", "on_member_unban"),
+    "threads": (
+        "on_thread_create", "on_thread_join", "on_thread_update", "on_thread_remove",
+        "on_thread_delete",
+    ),
+}
+
+DEFAULT_GROUPS = ("edits", "deletes", "reactions")
+
+
+def lean_mode() -> bool:
+    """
+    Whether lean mode is enabled, read from the LEAN_MODE environment variable ("0" disables
+    it and restores Intents.all() with discord.py's default caches).
+
+    Returns:
+    ---
+        bool: True if lean mode is enabled.
+    """
+    return os.getenv("LEAN_MODE", "1") != "0"
+
+
+def enabled_groups() -> Set[str]:
+    """
+    Returns the logging groups enabled in lean mode, read from LOG_EVENTS.
+
+    Returns:
+    ---
+        Set[str]: The groups, e.g. {"edits", "deletes", "reactions"}.
+    """
+    value = os.getenv("LOG_EVENTS")
+    if value is None:
+        return set(DEFAULT_GROUPS)
+    return {group.strip() for group in value.split(",") if group.strip()}
+
+
+def enabled_events(names: Iterable[str], lean: bool, groups: Optional[Set[str]] = None) -> List[str]:
+    """
+    Returns the event handlers to register: every handler outside the logging groups, and
+    the handlers of the enabled groups. Outside lean mode every handler is registered.
+
+    Args:
+    ---
+        - names (Iterable[str]): The names of the event handlers.
+        - lean (bool): Whether lean mode is enabled.
+        - groups (Optional[Set[str]]): The enabled groups. Defaults to LOG_EVENTS.
+
+    Returns:
+    ---
+        List[str]: The names of the handlers to register.
+    """
+    names = list(names)
+    if not lean:
+        return names
+    groups = enabled_groups() if groups is None else groups
+    disabled = {
+        name for group, events in EVENT_GROUPS.items() if group not in groups for name in events
+    }
+    return [name for name in names if name not in disabled]
+
+
+def intents_for(names: Iterable[str]):
+    """
+    Returns the intents a set of event handlers needs. The guilds intent is always included:
+    discord.py needs it to know the guilds and channels.
+
+    Args:
+    ---
+        names (Iterable[str]): The names of the registered event handlers.
+
+    Returns:
+    ---
+        discord.Intents: The intents.
+    """
+    import discord  # pylint:disable=import-outside-toplevel
+    intents = discord.Intents.none()
+    intents.guilds = True
+    for name in names:
+        for intent in EVENT_INTENTS.get(name, ()):
+            setattr(intents, intent, True)
+    return intents
+
+
+def client_options(names: Iterable[str], lean: bool) -> Dict[str, Any]:
+    """
+    Returns the intents and cache settings the client is built with.
+
+    In lean mode members are not cached nor downloaded at startup (the members of a guild
+    can still be fetched on demand with `guild.chunk()` if the members intent is enabled),
+    and the message cache holds MAX_MESSAGES messages, none by default.
+
+    Args:
+    ---
+        - names (Iterable[str]): The names of the registered event handlers.
+        - lean (bool): Whether lean mode is enabled.
+
+    Returns:
+    ---
+        Dict[str, Any]: The keyword arguments for discord.Client.
+    """
+    import discord  # pylint:disable=import-outside-toplevel
+    if not lean:
+        return {"intents": discord.Intents.all()}
+    max_messages = int(os.getenv("MAX_MESSAGES", "0"))
+    return {
+        "intents": intents_for(names),
+        # discord.py treats 0 as "use the default of 1000", None disables the cache
+        "max_messages": max_messages if max_messages > 0 else None,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the Gazetteer class, an offline index of the world's cities loaded
+from a GeoNames dump, so helper.get_lat_long can find most cities without asking Nominatim
+and suggest the right name when a city is misspelled.
+
+The dump is a GeoNames tab-separated file such as cities15000.txt (every city with at least
+15000 inhabitants), from https://download.geonames.org/export/dump/. It is read from
+GAZETTEER_PATH, "data/cities15000.txt" by default. Without it the gazetteer is empty and
+every lookup goes to Nominatim, as before.
+
+Attributes:
+---
+    GAZETTEER_PATH: The path of the GeoNames dump.
+    Place: A city: its display name, coordinates and population.
+
+Methods:
+---
+    Gazetteer.lookup: Returns the city with exactly that name.
+    Gazetteer.complete: Returns the cities whose name starts with a prefix.
+    Gazetteer.fuzzy: Returns the cities whose name is a few typos away.
+    Gazetteer.suggest: Returns "did you mean" names for a city that was not found.
+"""
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from geocache import normalize_city
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "data/cities15000.txt")
+
+# the columns of a GeoNames dump used here
+_NAME, _ASCII_NAME, _ALTERNATE_NAMES, _LATITUDE, _LONGITUDE = 1, 2, 3, 4, 5
+_FEATURE_CLASS, _COUNTRY, _POPULATION = 6, 8, 14
+
+
+class Place(NamedTuple):
+    """
+    A city of the gazetteer.
+
+    Attributes:
+    ---
+        - name (str): The city's name and country code, e.g. "Esbjerg, DK".
+        - latitude (float): The latitude of the city.
+        - longitude (float): The longitude of the city.
+        - population (int): The number of inhabitants.
+    """
+
+    name: str
+    latitude: float
+    longitude: float
+    population: int
+
+
+class _Strings:
+    # many strings packed in one, with an array of where each starts: a few bytes per
+    # string instead of a str object each, and still indexable (and bisectable) like a list
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, strings: List[str]) -> None:
+        self.text = "".join(strings)
+        self.offsets = array("I", [0])
+        for string in strings:
+            self.offsets.append(self.offsets[-1] + len(string))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """
+    Returns the number of single-character insertions, deletions, substitutions and
+    transpositions of two adjacent characters needed to turn one string into the other,
+    so "esbjreg" is one edit from "esbjerg". Gives up once the distance exceeds `limit`.
+
+    Args:
+    ---
+        - first (str): The first string.
+        - second (str): The second string.
+        - limit (int): The largest distance of interest.
+
+    Returns:
+    ---
+        int: The distance, or `limit + 1` if it is larger than `limit`.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    before: List[int] = []
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, other in enumerate(second, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != other),
+            )
+            if i > 1 and j > 1 and char == second[j - 2] and first[i - 2] == other:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class Gazetteer:
+    """
+    An in-memory index of the cities in a GeoNames dump.
+
+    Every normalized city name (see geocache.normalize_city) is a key, pointing at the
+    cities of that name, most populous first. The keys are kept sorted in one packed string,
+    so exact and prefix lookups are a binary search, and every key is indexed by its trigrams (the
+    three-letter slices of the padded name) for fuzzy lookups: the keys sharing enough
+    trigrams with a misspelled name are the only ones whose edit distance is computed.
+    The cities' coordinates, populations and country codes are kept in arrays. The dump is read on first
+    use; the gazetteer is safe to use from several threads.
+
+    Attributes:
+    ---
+        - path (Optional[str]): The path of the GeoNames dump.
+        - min_population (int): Cities with fewer inhabitants are skipped.
+        - alternate_names (bool): Whether the cities' alternate names (e.g. "Copenhague")
+                are keys too. They make the index several times larger.
+        - hits (int): The number of lookups answered by the gazetteer.
+        - misses (int): The number of lookups of names not in the gazetteer.
+
+    Methods:
+    ---
+        - load(self) -> None: Reads the dump and builds the index, if not done yet.
+        - lookup(self, city) -> Optional[Place]: Returns the city with exactly that name.
+        - complete(self, prefix, limit) -> List[Place]: Returns the cities starting with a prefix.
+        - fuzzy(self, city, max_distance, limit) -> List[Tuple[int, Place]]: Returns the
+                cities whose name is a few typos away.
+        - suggest(self, city, limit) -> List[str]: Returns "did you mean" names.
+        - stats(self) -> Dict[str, int]: Returns the lookup counters and the index's size.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = GAZETTEER_PATH,
+        min_population: int = 0,
+        alternate_names: bool = False,
+    ) -> None:
+        self.path = path
+        self.min_population = min_population
+        self.alternate_names = alternate_names
+        self.hits = 0
+        self.misses = 0
+        self._names = _Strings([])
+        self._countries = ""
+        self._latitudes = array("f")
+        self._longitudes = array("f")
+        self._populations = array("I")
+        self._keys = _Strings([])
+        self._key_places = array("I")
+        self._trigram_keys: Dict[str, array] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _rows(self) -> Iterator[List[str]]:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as dump:
+            for line in dump:
+                row = line.rstrip("\n").split("\t")
+                if len(row) <= _POPULATION or row[_FEATURE_CLASS] not in ("P", ""):
+                    continue
+                if int(row[_POPULATION] or 0) >= self.min_population:
+                    yield row
+
+    def _load(self) -> None:
+        names: List[str] = []
+        countries: List[str] = []
+        entries: List[Tuple[str, int, int]] = []
+        for row in self._rows():
+            place = len(names)
+            population = int(row[_POPULATION] or 0)
+            names.append(row[_NAME])
+            countries.append(f"{row[_COUNTRY]:<2.2}")
+            self._latitudes.append(float(row[_LATITUDE]))
+            self._longitudes.append(float(row[_LONGITUDE]))
+            self._populations.append(population)
+            spellings = [row[_NAME], row[_ASCII_NAME]]
+            if self.alternate_names and row[_ALTERNATE_NAMES]:
+                spellings.extend(row[_ALTERNATE_NAMES].split(","))
+            for key in {normalize_city(spelling) for spelling in spellings} - {""}:
+                entries.append((key, -population, place))
+        # the cities sharing a name are next to each other, the most populous first
+        entries.sort()
+        self._names = _Strings(names)
+        self._countries = "".join(countries)
+        self._keys = _Strings([key for key, _, _ in entries])
+        self._key_places = array("I", (place for _, _, place in entries))
+        postings: Dict[str, List[int]] = {}
+        for index, (key, _, _) in enumerate(entries):
+            if index == 0 or entries[index - 1][0] != key:
+                for trigram in _trigrams(key):
+                    postings.setdefault(trigram, []).append(index)
+        self._trigram_keys = {trigram: array("I", ids) for trigram, ids in postings.items()}
+        self._loaded = True
+
+    def load(self) -> None:
+        """
+        Reads the dump and builds the index, unless it is already built. Lookups call it
+        on first use; calling it ahead (on a thread, it takes about half a second for
+        cities15000.txt) spares the first lookup the wait.
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def _place(self, index: int) -> Place:
+        country = self._countries[2 * index:2 * index + 2].strip()
+        return Place(
+            f"{self._names[index]}, {country}" if country else self._names[index],
+            # float32 keeps about a metre of precision, shown as 5 decimals
+            round(self._latitudes[index], 5),
+            round(self._longitudes[index], 5),
+            self._populations[index],
+        )
+
+    def lookup(self, city: str) -> Optional[Place]:
+        """
+        Returns the city with exactly that name, after normalization. If several cities
+        have the name, the most populous one is returned, or the one in the given country
+        if the name ends with a country code, e.g. "Paris, US".
+
+        Args:
+        ---
+            city (str): The name of the city, optionally followed by a comma and the
+                two-letter code of its country.
+
+        Returns:
+        ---
+            Optional[Place]: The city, or None if no city has that name.
+        """
+        self.load()
+        name, _, country = city.rpartition(",") if "," in city else (city, "", "")
+        country = country.strip().upper()
+        if len(country) not in (0, 2):
+            self.misses += 1
+            return None
+        key = normalize_city(name)
+        index = bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index] == key:
+            place = self._key_places[index]
+            if not country or self._countries[2 * place:2 * place + 2] == country:
+                self.hits += 1
+                return self._place(place)
+            index += 1
+        self.misses += 1
+        return None
+
+    def complete(self, prefix: str, limit: int = 5) -> List[Place]:
+        """
+        Returns the most populous cities whose name starts with a prefix.
+
+        Args:
+        ---
+            - prefix (str): The start of the name.
+            - limit (int): The number of cities returned at most.
+
+        Returns:
+        ---
+            List[Place]: The cities, most populous first.
+        """
+        self.load()
+        key = normalize_city(prefix)
+        if not key:
+            return []
+        start = bisect_left(self._keys, key)
+        end = bisect_left(self._keys, key + "\U0010ffff", start)
+        places = {self._key_places[index] for index in range(start, end)}
+        ranked = sorted(places, key=lambda place: -self._populations[place])
+        return [self._place(place) for place in ranked[:limit]]
+
+    def fuzzy(
+        self, city: str, max_distance: Optional[int] = None, limit: int = 5
+    ) -> List[Tuple[int, Place]]:
+        """
+        Returns the cities closest to the given name, at most `max_distance` edits away
+        (see edit_distance). Names one edit away are looked for first, and only if there
+        are none, names two edits away and so on: a typo is usually a single edit, and
+        the wider searches compare many more names.
+
+        Args:
+        ---
+            - city (str): The name, possibly misspelled.
+            - max_distance (Optional[int]): The number of edits allowed. Defaults to 1 for
+                    names of up to 4 letters and 2 for longer ones.
+            - limit (int): The number of cities returned at most.
+
+        Returns:
+        ---
+            List[Tuple[int, Place]]: The edit distance and the city, most populous first.
+        """
+        self.load()
+        key = normalize_city(city)
+        if not key:
+            return []
+        if max_distance is None:
+            max_distance = 1 if len(key) <= 4 else 2
+        trigrams = _trigrams(key)
+        shared: Counter = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigram_keys.get(trigram, ()))
+        offsets = self._keys.offsets
+        for distance in range(1, max_distance + 1):
+            # an edit changes at most 4 trigrams (3, or 4 for a transposition), so a key
+            # within `distance` edits shares at least this many with the name
+            needed = len(trigrams) - 4 * distance
+            found: Set[int] = set()
+            for index, count in shared.items():
+                if count < needed or abs(offsets[index + 1] - offsets[index] - len(key)) > distance:
+                    continue
+                if edit_distance(key, self._keys[index], distance) <= distance:
+                    found.add(self._key_places[index])
+            if found:
+                ranked = sorted(found, key=lambda place: -self._populations[place])
+                return [(distance, self._place(place)) for place in ranked[:limit]]
+        return []
+
+    def suggest(self, city: str, limit: int = 3) -> List[str]:
+        """
+        Returns the names of the cities the user may have meant: the closest misspellings
+        first, then the most populous cities starting with the name.
+
+        Args:
+        ---
+            - city (str): The name that was not found.
+            - limit (int): The number of names returned at most.
+
+        Returns:
+        ---
+            List[str]: The display names, e.g. ["Esbjerg, DK"].
+        """
+        names = [place.name for _, place in self.fuzzy(city, limit=limit)]
+        if len(normalize_city(city)) >= 3:
+            names.extend(place.name for place in self.complete(city, limit=limit))
+        return list(dict.fromkeys(names))[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the gazetteer's counters.
+
+        Returns:
+        ---
+            Dict[str, int]: The number of hits and misses, of cities ("entries") and of
+            names indexed.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._latitudes),
+            "names": len(self._keys),
+        }
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the GeocodeCache class, a bounded cache of city coordinates
+used by helper.get_lat_long so a city is only geocoded once.
+
+Attributes:
+---
+    DEFAULT_MAX_ENTRIES: The default number of cities kept in the cache.
+    DEFAULT_TTL: The default number of seconds a found city is kept.
+    DEFAULT_NEGATIVE_TTL: The default number of seconds a city that was not found is kept.
+
+Methods:
+---
+    normalize_city: Normalizes a city name into a cache key.
+    GeocodeCache.get: Returns the cached coordinates of a city.
+    GeocodeCache.put: Stores the coordinates of a city.
+    GeocodeCache.stats: Returns the hit, miss and eviction counters.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+
+Coordinates = Tuple[float, float]
+
+
+def normalize_city(city: str) -> str:
+    """
+    Normalizes a city name so different spellings of the same name share a cache entry.
+
+    The name is casefolded, stripped of diacritics and has its whitespace collapsed,
+    so "  Århus", "arhus" and "ARHUS " all become "arhus".
+
+    Args:
+    ---
+        city (str): The name of the city.
+
+    Returns:
+    ---
+        str: The normalized name.
+    """
+    decomposed = unicodedata.normalize("NFKD", city)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", stripped).strip().casefold()
+
+
+class GeocodeCache:
+    """
+    A least-recently-used cache of city coordinates with expiry, persisted to SQLite.
+
+    Cities that could not be found are cached too (as None), with a shorter time to live,
+    so repeated typos don't reach the geocoder either. The SQLite file is opened on first
+    use and every entry still in memory is loaded from it, so a restarted bot starts warm.
+    The cache is safe to use from several threads.
+
+    Attributes:
+    ---
+        - path (Optional[str]): The path of the SQLite file, or None to keep the cache in memory.
+        - max_entries (int): The number of cities kept before the least recently used is evicted.
+        - ttl (float): The number of seconds a found city is kept.
+        - negative_ttl (float): The number of seconds a city that was not found is kept.
+        - hits (int): The number of lookups answered by the cache.
+        - misses (int): The number of lookups that were not cached or had expired.
+        - evictions (int): The number of entries evicted to stay under `max_entries`.
+
+    Methods:
+    ---
+        - get(self, city) -> Optional[Coordinates]: Returns the cached coordinates of a city.
+        - put(self, city, coordinates) -> None: Stores the coordinates of a city.
+        - stats(self) -> Dict[str, int]: Returns the hit, miss and eviction counters.
+        - close(self) -> None: Closes the SQLite file.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Optional[Coordinates], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._loaded = False
+
+    def _load(self) -> None:
+        self._loaded = True
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode "
+            "(key TEXT PRIMARY KEY, lat REAL, lon REAL, expires REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM geocode WHERE expires < ?", (time.time(),))
+        rows = self._db.execute(
+            "SELECT key, lat, lon, expires FROM geocode ORDER BY rowid DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for key, lat, lon, expires in reversed(rows):
+            self._entries[key] = (None if lat is None else (lat, lon), expires)
+        self._db.commit()
+
+    def get(self, city: str) -> Optional[Coordinates]:
+        """
+        Returns the cached coordinates of a city.
+
+        Args:
+        ---
+            city (str): The name of the city.
+
+        Returns:
+        ---
+            Optional[Coordinates]: The latitude and longitude of the city,
+            or None if the city is cached as not found.
+
+        Raises:
+        ---
+            KeyError: If the city is not cached or its entry has expired.
+        """
+        key = normalize_city(city)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                raise KeyError(city)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, city: str, coordinates: Optional[Coordinates]) -> None:
+        """
+        Stores the coordinates of a city, evicting the least recently used city if the cache is full.
+
+        Args:
+        ---
+            city (str): The name of the city.
+            coordinates (Optional[Coordinates]): The latitude and longitude of the city,
+                or None if the city could not be found.
+        """
+        key = normalize_city(city)
+        expires = time.time() + (self.ttl if coordinates is not None else self.negative_ttl)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[key] = (coordinates, expires)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self.evictions += 1
+            if self._db is not None:
+                lat, lon = coordinates if coordinates is not None else (None, None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocode (key, lat, lon, expires) VALUES (?, ?, ?, ?)",
+                    (key, lat, lon, expires),
+                )
+                self._db.executemany("DELETE FROM geocode WHERE key = ?", [(k,) for k in evicted])
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+        ---
+            Dict[str, int]: The number of hits, misses, evictions and entries.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+    def close(self) -> None:
+        """
+        Closes the SQLite file. The entries in memory are kept.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,23 +1,83 @@
 from urllib.parse import urlencode, urlparse, urlunparse
+import asyncio
 import time
 import os
-import requests
 from dotenv import load_dotenv
+from http_pool import HttpClient, shared_client
+from async_cache import AsyncTTLCache
+from analytics_queue import AnalyticsQueue
+from circuit_breaker import CircuitOpenError
+from command_aliases import Commands
+from plugin_loader import Plugin
 load_dotenv()
 
 class Giphy:
-    def __init__(self, search="search") -> None:
-        self.search = search
+    # one long-lived instance serves every !gif and !sticker command:
+    # the random_id is fetched once and kept on disk, and search results
+    # are cached per query and handed out in turn. analytics pings go through
+    # a background queue so they never delay the reply. while giphy is down
+    # (its circuit breaker is open) expired search results are served for up to stale_ttl,
+    # and while it is slow they are served after stale_after seconds instead of waiting
+    # out the timeout. searches slower than giphy's p95 are hedged with a second request
+    def __init__(self, base_url="http://api.giphy.com", client: HttpClient = shared_client,
+                 random_id_path="data/giphy_random_id", cache_ttl=3600, limit=25,
+                 analytics: AnalyticsQueue = None, stale_ttl=86400, stale_after=0.5) -> None:
         self.API_KEY = os.getenv("giphy_API_KEY")
-        self.random_id = requests.get(f"http://api.giphy.com/v1/randomid?api_key={self.API_KEY}", timeout=1).json()["data"]["random_id"]
-        self.gif_search_url = f"http://api.giphy.com/v1/gifs/search?api_key={self.API_KEY}&q={self.search}&random_id={self.random_id}"
-        self.sticker_search_url = f"http://api.giphy.com/v1/stickers/search?api_key={self.API_KEY}&q={self.search}&random_id={self.random_id}"
-        self.unix_timestamp = int(time.time()) * 1000
+        self.base_url = base_url
+        self.client = client
+        self.random_id_path = random_id_path
+        self.limit = limit
+        self.random_id = None
+        self.search_cache = AsyncTTLCache(ttl=cache_ttl, stale_ttl=stale_ttl)
+        self.stale_after = stale_after
+        self.analytics = analytics if analytics is not None else AnalyticsQueue(client)
+        self._random_id_lock = asyncio.Lock()
+        self._cursors = {}
 
+    @staticmethod
+    def normalize_query(search):
+        if not isinstance(search, str):
+            search = " ".join(search)
+        return " ".join(search.lower().split())
+
+    async def get_random_id(self):
+        async with self._random_id_lock:
+            if self.random_id is None and self.random_id_path and os.path.exists(self.random_id_path):
+                with open(self.random_id_path, encoding="utf-8") as random_id_file:
+                    self.random_id = random_id_file.read().strip() or None
+            if self.random_id is None:
+                resp = await self.client.get_json(f"{self.base_url}/v1/randomid", params={"api_key": self.API_KEY}, upstream="giphy_random_id")
+                self.random_id = resp["data"]["random_id"]
+                if self.random_id_path:
+                    os.makedirs(os.path.dirname(self.random_id_path) or ".", exist_ok=True)
+                    with open(self.random_id_path, "w", encoding="utf-8") as random_id_file:
+                        random_id_file.write(self.random_id)
+        return self.random_id
+
+    async def fetch_results(self, kind, query):
+        params = {"api_key": self.API_KEY, "q": query, "limit": self.limit, "random_id": await self.get_random_id()}
+        resp = await self.client.get_json(f"{self.base_url}/v1/{kind}/search", params=params, upstream="giphy_search", hedge=True)
+        return resp["data"]
+
+    # returns the result and, if it came from an expired search, how long ago that expired
+    async def search(self, kind, search):
+        query = self.normalize_query(search)
+        key = (kind, query)
+        stale_after = 0.0 if self.client.is_open("giphy_search") else self.stale_after
+        results, stale_for = await self.search_cache.get_or_stale(
+            key, lambda: self.fetch_results(kind, query), stale_after=stale_after)
+        if not results:
+            return None, stale_for
+        # rotate through the cached page so repeated searches don't return the same result
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        if len(self._cursors) > self.search_cache.max_entries:
+            self._cursors.pop(next(iter(self._cursors)))
+        return results[cursor % len(results)], stale_for
 
     def handle_analytics(self,analytics, analytics_payload, random_id, unix_timestamp):
         onsent  = [analytics["onsent"]["url"],"SENT"]
-        
+
         params = {
             "ts": unix_timestamp,
             "action_type": onsent[1],
@@ -27,26 +87,63 @@ class Giphy:
         query_string = urlencode(params)
         parsed_url = urlparse(onsent[0])
         new_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, parsed_url.params, query_string, parsed_url.fragment))
-        requests.get(new_url, timeout=1)
-
-    def get_gif(self):
-        gif_resp = requests.get(self.gif_search_url, timeout=1).json()
-        data = gif_resp["data"]
-        gif_url = data[0]["url"]
-        
-        analytics = data[0]["analytics"]
-        analytics_payload = data[0]["analytics_response_payload"]
-        self.handle_analytics(analytics, analytics_payload, self.random_id, self.unix_timestamp)
-
-        return gif_url
-
-    def get_sticker(self):
-        sticker_resp = requests.get(self.sticker_search_url, timeout=1).json()
-        analytics = sticker_resp["data"][0]["analytics"]
-        analytics_payload = sticker_resp["data"][0]["analytics_response_payload"]
-        self.handle_analytics(analytics, analytics_payload, self.random_id, self.unix_timestamp)
-
-        
-        data = sticker_resp["data"]
-        sticker_url = data[0]["url"]
-        return sticker_url
\ No newline at end of file
+        self.analytics.put(new_url)
+
+    async def get_result_url(self, kind, search):
+        try:
+            result, stale_for = await self.search(kind, search)
+        except CircuitOpenError as error:
+            return f"Giphy is unavailable right now, please try again in {max(1, round(error.retry_in))} seconds :("
+        if result is None:
+            return f'Nothing was found for "{self.normalize_query(search)}" :('
+
+        analytics = result["analytics"]
+        analytics_payload = result["analytics_response_payload"]
+        self.handle_analytics(analytics, analytics_payload, self.random_id, int(time.time()) * 1000)
+
+        if stale_for is not None:
+            return f"{result['url']}\n(Giphy is unavailable, this is an earlier search result)"
+        return result["url"]
+
+    async def get_gif(self, search):
+        return await self.get_result_url("gifs", search)
+
+    async def get_sticker(self, search):
+        return await self.get_result_url("stickers", search)
+
+
+# the !gif and !sticker commands. the Giphy instance lives in the plugin's state,
+# so a reload keeps its random_id, search cache and analytics queue
+plugin = Plugin("giphy", description="GIF and sticker search.")
+
+
+def _load_giphy():
+    instance = Giphy()
+    instance.analytics.start()
+    plugin.cache("giphy_search", instance.search_cache.stats)
+    return instance
+
+
+giphy = plugin.state("giphy", _load_giphy)
+NO_QUERY = "No Search query was given :("
+
+
+@plugin.command(Commands().giphy_gif_commands(), concurrency=4, queue=8,
+                usage="[search]", help="displays a GIF based on the search terms")
+async def gif(message, tokens):  # pylint:disable=unused-argument
+    if len(tokens) < 2:
+        return NO_QUERY
+    return await giphy.get().get_gif(tokens[1:])
+
+
+@plugin.command(Commands().giphy_sticker_commands(), concurrency=4, queue=8)
+async def sticker(message, tokens):  # pylint:disable=unused-argument
+    if len(tokens) < 2:
+        return NO_QUERY
+    return await giphy.get().get_sticker(tokens[1:])
+
+
+@plugin.on_close
+async def flush_analytics():
+    if giphy.loaded:
+        await giphy.get().analytics.close()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the GreetingEngine class, which picks the greeting the bot replies with.
+
+The greetings are turned into format templates once, when a table is built, so greeting
+someone is a single indexed (or weighted) choice and one `str.format`.
+
+Besides the built-in English greetings (the greeting commands plus a few phrases), locale
+packs can be dropped into the packs directory as JSON files named after the locale, e.g.
+"data/greetings/da.json":
+
+    {"greetings": ["Hej", "Goddag", "Hejsa"]}
+    {"greetings": {"Hej": 5, "Goddag": 1, "Hejsa": 2}}
+
+the second form giving each greeting a weight. A guild is greeted from the pack of the
+locale set in its config (the "locale" of guild_config), or from the built-in greetings if
+it has none or there is no pack for it. Packs are reloaded when their files change.
+
+Attributes:
+---
+    DEFAULT_LOCALE: The locale of the built-in greetings.
+    EXTRA_GREETINGS: Greetings that are not commands but are replied with too.
+    greeting_engine: The GreetingEngine used by helper.random_greeting.
+
+Methods:
+---
+    GreetingTable.pick: Returns a greeting for a name.
+    GreetingEngine.greet: Returns a greeting for a name, in a guild's locale.
+    GreetingEngine.reload: Rebuilds every table.
+"""
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect
+from itertools import accumulate
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+from guild_config import guild_configs
+
+DEFAULT_LOCALE = "en"
+EXTRA_GREETINGS = ["How's it going?", "How are ya?", "How's it hangin'?", "what's up?", "good'ay"]
+
+Greetings = Union[Iterable[str], Mapping[str, float]]
+
+
+class GreetingTable:
+    """
+    The templates of one locale's greetings, with optional weights.
+
+    A greeting such as "!hey" becomes the template "Hey, {}!": the command's "!" is dropped
+    and the text is capitalized once, here, instead of on every call. The name is lowercased
+    when it is filled in, which gives the same text the old implementation did by
+    capitalizing the whole reply.
+
+    Attributes:
+    ---
+        - templates (List[str]): The templates, each with one "{}" for the name.
+
+    Methods:
+    ---
+        - pick(self, name, rng) -> str: Returns a greeting for a name.
+    """
+
+    __slots__ = ("templates", "_cumulative", "_total")
+
+    def __init__(self, greetings: Greetings) -> None:
+        """
+        Args:
+        ---
+            - greetings (Greetings): The greetings, or a mapping from each greeting to its
+                    weight. Duplicates are merged.
+        """
+        weights: Dict[str, float] = {}
+        items = greetings.items() if isinstance(greetings, Mapping) else ((g, 1) for g in greetings)
+        for greeting, weight in items:
+            template = self.template(greeting)
+            weights[template] = weights.get(template, 0) + weight
+        self.templates: List[str] = list(weights)
+        if not self.templates:
+            raise ValueError("a greeting table needs at least one greeting")
+        if len(set(weights.values())) == 1:
+            self._cumulative: Optional[List[float]] = None
+            self._total = float(len(self.templates))
+        else:
+            self._cumulative = list(accumulate(weights.values()))
+            self._total = self._cumulative[-1]
+
+    @staticmethod
+    def template(greeting: str) -> str:
+        """
+        Turns a greeting into a template with one "{}" for the name.
+
+        Args:
+        ---
+            greeting (str): The greeting, e.g. "!hey" or "How are ya?".
+
+        Returns:
+        ---
+            str: The template, e.g. "Hey, {}!".
+        """
+        word = greeting[1:] if greeting.startswith("!") else greeting
+        return word.capitalize().replace("{", "{{").replace("}", "}}") + ", {}!"
+
+    def pick(self, name: str, rng: Callable[[], float] = random.random) -> str:
+        """
+        Returns a greeting for a name.
+
+        Args:
+        ---
+            - name (str): The name of the person greeted.
+            - rng (Callable[[], float]): Returns a random float in [0, 1).
+
+        Returns:
+        ---
+            str: The greeting.
+        """
+        if self._cumulative is None:
+            template = self.templates[int(rng() * self._total)]
+        else:
+            template = self.templates[bisect(self._cumulative, rng() * self._total)]
+        return template.format(name.lower())
+
+
+class GreetingEngine:
+    """
+    Greets people with the greetings of their guild's locale.
+
+    The built-in table is built from `source`, a function returning the greetings, so a
+    change to the greeting commands is picked up by `reload`. Locale packs are read from
+    `packs_dir`, and checked for changes at most every `check_interval` seconds. A guild's
+    locale is asked from `locale_of` on every greeting, so a changed config applies at once.
+
+    Attributes:
+    ---
+        - source (Callable[[], Greetings]): Returns the built-in greetings.
+        - packs_dir (Optional[str]): The directory holding the locale packs.
+        - check_interval (float): How often, in seconds, the packs are checked for changes.
+        - locale_of (Callable[[Optional[int]], Optional[str]]): Returns the locale of a
+                guild, or None for the built-in greetings.
+
+    Methods:
+    ---
+        - greet(self, name, guild_id) -> str: Returns a greeting for a name.
+        - reload(self) -> None: Rebuilds every table.
+        - locales(self) -> List[str]: Returns the locales available.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], Greetings],
+        packs_dir: Optional[str] = None,
+        check_interval: float = 30.0,
+        locale_of: Callable[[Optional[int]], Optional[str]] = lambda guild_id: None,
+    ) -> None:
+        self.source = source
+        self.packs_dir = packs_dir
+        self.check_interval = check_interval
+        self.locale_of = locale_of
+        self._tables: Dict[str, GreetingTable] = {}
+        self._pack_mtimes: Dict[str, float] = {}
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def greet(self, name: str, guild_id: Optional[int] = None) -> str:
+        """
+        Returns a greeting for a name, in the locale of a guild.
+
+        Args:
+        ---
+            - name (str): The name of the person greeted.
+            - guild_id (Optional[int]): The guild they are greeted in, if any.
+
+        Returns:
+        ---
+            str: The greeting.
+        """
+        if time.monotonic() >= self._next_check:
+            self._check()
+        locale = self.locale_of(guild_id) or DEFAULT_LOCALE
+        table = self._tables.get(locale) or self._tables[DEFAULT_LOCALE]
+        return table.pick(name)
+
+    def locales(self) -> List[str]:
+        """
+        Returns the locales available.
+
+        Returns:
+        ---
+            List[str]: The locales, the built-in one first.
+        """
+        if not self._tables:
+            self._check()
+        return list(self._tables)
+
+    def reload(self) -> None:
+        """
+        Rebuilds the built-in table from `source` and reads every locale pack again.
+        """
+        with self._lock:
+            self._pack_mtimes.clear()
+            self._tables = {DEFAULT_LOCALE: GreetingTable(self.source())}
+        self._check(force=True)
+
+    def _check(self, force: bool = False) -> None:
+        with self._lock:
+            if not force and time.monotonic() < self._next_check:
+                return
+            tables = dict(self._tables)
+            if DEFAULT_LOCALE not in tables:
+                tables[DEFAULT_LOCALE] = GreetingTable(self.source())
+            for locale, path, mtime in self._scan_packs():
+                if self._pack_mtimes.get(locale) == mtime and locale in tables:
+                    continue
+                try:
+                    tables[locale] = GreetingTable(self._read_pack(path))
+                except (OSError, ValueError, TypeError, KeyError):
+                    continue  # keep the last good table of a broken pack
+                self._pack_mtimes[locale] = mtime
+            # swapped in whole, so greet never sees a half-built dict
+            self._tables = tables
+            self._next_check = time.monotonic() + self.check_interval
+
+    def _scan_packs(self) -> List[Tuple[str, str, float]]:
+        if not self.packs_dir or not os.path.isdir(self.packs_dir):
+            return []
+        packs = []
+        for entry in os.scandir(self.packs_dir):
+            locale, extension = os.path.splitext(entry.name)
+            if extension == ".json" and locale != DEFAULT_LOCALE and entry.is_file():
+                packs.append((locale, entry.path, entry.stat().st_mtime))
+        return packs
+
+    @staticmethod
+    def _read_pack(path: str) -> Greetings:
+        with open(path, encoding="utf-8") as pack_file:
+            greetings = json.load(pack_file)["greetings"]
+        if not isinstance(greetings, (list, dict)):
+            raise TypeError(f"{path}: greetings must be a list or an object")
+        return greetings
+
+
+def default_greetings() -> List[str]:
+    """
+    Returns the built-in greetings: the greeting commands and EXTRA_GREETINGS.
+
+    Returns:
+    ---
+        List[str]: The greetings.
+    """
+    # command_aliases imports helper, which imports this module lazily
+    from command_aliases import Commands  # pylint:disable=import-outside-toplevel
+    return Commands().greets() + EXTRA_GREETINGS
+
+
+greeting_engine = GreetingEngine(
+    default_greetings,
+    packs_dir=os.getenv("GREETINGS_DIR", "data/greetings"),
+    locale_of=lambda guild_id: guild_configs.get(guild_id).locale,
+)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the per-guild configuration: the GuildConfig class holding one guild's
+settings, and the GuildConfigStore class, which reads every guild's settings once from a
+JSON file and keeps them in memory, so looking up a guild's config on every message is a
+single dictionary lookup.
+
+The file maps guild ids to the settings that differ from the defaults, e.g.:
+
+    {
+        "1056239555000000000": {"city": "aarhus", "prefix": "?", "status_channel": 1056239557084979260, "locale": "da"},
+        "1056239555000000001": {"enabled": ["greet", "weather", "help_command"]}
+    }
+
+Attributes:
+---
+    DEFAULT_CITY: The city the weather command uses when none is given, read from the
+        environment variable of the same name. Defaults to "esbjerg".
+    DEFAULT_PREFIX: The prefix the commands are written with.
+    guild_configs: The GuildConfigStore used by the bot and its plugins.
+
+Methods:
+---
+    GuildConfig.translate: Rewrites a message written with the guild's prefix.
+    GuildConfig.allows: Whether a command is enabled in the guild.
+    GuildConfigStore.get: Returns a guild's config.
+    GuildConfigStore.update: Changes a guild's config and saves the file.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+DEFAULT_CITY = os.getenv("DEFAULT_CITY", "esbjerg")
+DEFAULT_PREFIX = "!"
+
+
+class GuildConfig:
+    """
+    The settings of one guild. Instances are shared and must not be changed in place;
+    GuildConfigStore.update replaces them.
+
+    Attributes:
+    ---
+        - city (str): The city the weather command uses when none is given.
+        - prefix (str): The prefix the guild writes commands with, instead of "!".
+        - enabled (Optional[FrozenSet[str]]): The names of the commands enabled in the guild,
+                or None if every command is.
+        - status_channel (Optional[int]): The channel the bot announces it is running in.
+        - locale (Optional[str]): The locale the guild is greeted in, e.g. "da" for the
+                greetings pack "da.json" (see greetings), or None for the built-in greetings.
+
+    Methods:
+    ---
+        - translate(self, content) -> Optional[str]: Rewrites a message to the "!" prefix.
+        - allows(self, name) -> bool: Whether a command is enabled.
+        - to_dict(self) -> Dict[str, Any]: The settings that differ from the defaults.
+    """
+
+    __slots__ = ("city", "prefix", "enabled", "status_channel", "locale")
+
+    def __init__(
+        self,
+        city: str = DEFAULT_CITY,
+        prefix: str = DEFAULT_PREFIX,
+        enabled: Optional[Iterable[str]] = None,
+        status_channel: Optional[int] = None,
+        locale: Optional[str] = None,
+    ) -> None:
+        if not prefix or prefix.isspace():
+            raise ValueError("a prefix can not be empty")
+        self.city = city
+        self.prefix = prefix
+        self.enabled: Optional[FrozenSet[str]] = frozenset(enabled) if enabled is not None else None
+        self.status_channel = int(status_channel) if status_channel is not None else None
+        self.locale = locale or None
+
+    def translate(self, content: str) -> Optional[str]:
+        """
+        Rewrites a message written with the guild's prefix to the "!" prefix the commands
+        are registered with. In a guild with its own prefix, "!" messages are not commands.
+
+        Args:
+        ---
+            content (str): The content of the message.
+
+        Returns:
+        ---
+            Optional[str]: The rewritten content, or None if the message uses the
+            default prefix in a guild that changed it.
+        """
+        if self.prefix == DEFAULT_PREFIX:
+            return content
+        if content.startswith(self.prefix):
+            return DEFAULT_PREFIX + content[len(self.prefix):]
+        if content.startswith(DEFAULT_PREFIX):
+            return None
+        return content
+
+    def allows(self, name: str) -> bool:
+        """
+        Whether a command is enabled in the guild.
+
+        Args:
+        ---
+            name (str): The name of the command.
+
+        Returns:
+        ---
+            bool: True if the command is enabled.
+        """
+        return self.enabled is None or name in self.enabled
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the settings that differ from the defaults, as they are saved in the file.
+
+        Returns:
+        ---
+            Dict[str, Any]: The settings.
+        """
+        settings: Dict[str, Any] = {}
+        if self.city != DEFAULT_CITY:
+            settings["city"] = self.city
+        if self.prefix != DEFAULT_PREFIX:
+            settings["prefix"] = self.prefix
+        if self.enabled is not None:
+            settings["enabled"] = sorted(self.enabled)
+        if self.status_channel is not None:
+            settings["status_channel"] = self.status_channel
+        if self.locale is not None:
+            settings["locale"] = self.locale
+        return settings
+
+
+DEFAULT_CONFIG = GuildConfig()
+
+
+class GuildConfigStore:
+    """
+    Every guild's config, read once from a JSON file and kept in memory.
+
+    Guilds missing from the file share DEFAULT_CONFIG, so the store only holds the guilds
+    that changed something. A broken file is reported once and treated as empty, so a typo
+    can't keep the bot from starting.
+
+    Attributes:
+    ---
+        - path (Optional[str]): The JSON file the configs are read from and saved to.
+
+    Methods:
+    ---
+        - get(self, guild_id) -> GuildConfig: Returns a guild's config.
+        - update(self, guild_id, **settings) -> GuildConfig: Changes a guild's config.
+        - status_channels(self) -> Dict[int, int]: Returns every configured status channel.
+        - reload(self) -> None: Reads the file again.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._configs: Optional[Dict[int, GuildConfig]] = None
+        self._lock = threading.Lock()
+
+    def get(self, guild_id: Optional[int]) -> GuildConfig:
+        """
+        Returns a guild's config.
+
+        Args:
+        ---
+            guild_id (Optional[int]): The id of the guild, or None for direct messages.
+
+        Returns:
+        ---
+            GuildConfig: The guild's config, or the defaults.
+        """
+        configs = self._configs
+        if configs is None:
+            configs = self._load()
+        return configs.get(guild_id, DEFAULT_CONFIG)
+
+    def update(self, guild_id: int, **settings: Any) -> GuildConfig:
+        """
+        Changes some of a guild's settings and saves the file.
+
+        Args:
+        ---
+            - guild_id (int): The id of the guild.
+            - **settings: The settings to change: city, prefix, enabled, status_channel or locale.
+
+        Returns:
+        ---
+            GuildConfig: The guild's new config.
+
+        Raises:
+        ---
+            TypeError: If a setting does not exist.
+            ValueError: If the prefix is empty.
+        """
+        current = self.get(guild_id).to_dict()
+        current.update(settings)
+        config = GuildConfig(**current)
+        with self._lock:
+            configs = dict(self._configs or {})
+            if config.to_dict():
+                configs[guild_id] = config
+            else:
+                configs.pop(guild_id, None)
+            self._save(configs)
+            self._configs = configs
+        return config
+
+    def status_channels(self) -> Dict[int, int]:
+        """
+        Returns the status channel of every guild that has one.
+
+        Returns:
+        ---
+            Dict[int, int]: The id of the status channel, by guild id.
+        """
+        if self._configs is None:
+            self._load()
+        return {
+            guild_id: config.status_channel
+            for guild_id, config in self._configs.items()
+            if config.status_channel is not None
+        }
+
+    def reload(self) -> None:
+        """
+        Reads the file again.
+        """
+        with self._lock:
+            self._configs = None
+        self._load()
+
+    def _load(self) -> Dict[int, GuildConfig]:
+        with self._lock:
+            if self._configs is not None:
+                return self._configs
+            configs: Dict[int, GuildConfig] = {}
+            if self.path is not None and os.path.exists(self.path):
+                try:
+                    with open(self.path, encoding="utf-8") as config_file:
+                        raw = json.load(config_file)
+                    for guild_id, settings in raw.items():
+                        configs[int(guild_id)] = GuildConfig(**settings)
+                except (OSError, ValueError, TypeError, AttributeError) as error:
+                    print(f"Ignoring the guild config in {self.path}: {error!r}")
+                    configs = {}
+            self._configs = configs
+            return configs
+
+    def _save(self, configs: Dict[int, GuildConfig]) -> None:
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as config_file:
+            json.dump(
+                {str(guild_id): config.to_dict() for guild_id, config in configs.items()},
+                config_file,
+                indent=4,
+            )
+        os.replace(temp_path, self.path)
+
+
+guild_configs = GuildConfigStore(os.getenv("GUILD_CONFIG", "data/guild_config.json"))
@@ -5,7 +5,10 @@ This module provides several utility functions for a Discord bot.
 
 Attributes:
 ---
-    None
+    geocode_cache: The GeocodeCache holding the coordinates of every city looked up so far.
+    gazetteer: The offline Gazetteer of cities, consulted before Nominatim.
+    CityNotFoundError: Raised when a city could not be found, with "did you mean" names.
+    NOMINATIM_TIMEOUT: The timeout of Nominatim lookups until its latency is known, in seconds.
 
 Methods:
 ---
@@ -17,16 +20,56 @@ Methods:
         if they do not already start with one.
     - random_greeting: Returns a random greeting with a specified name.
 """
-from typing import Tuple
-import random
-from geopy.geocoders import Nominatim
-import bot
+import os
+import time
+from typing import Iterable, Optional, Tuple
+from geocache import GeocodeCache
+from gazetteer import Gazetteer
+from greetings import greeting_engine
+from metrics import track_upstream
+from circuit_breaker import breakers
+from adaptive_timeout import latencies
+
+geocode_cache = GeocodeCache("data/geocode.sqlite3")
+gazetteer = Gazetteer()
+# Nominatim is slow on a cold lookup, so its first requests get a generous timeout
+NOMINATIM_TIMEOUT = float(os.getenv("NOMINATIM_TIMEOUT", "5"))
+_geolocator = None
+
+
+class CityNotFoundError(AttributeError):
+    """
+    Raised when a city could not be found.
+
+    It is an AttributeError, which get_lat_long raised for unknown cities before.
+
+    Attributes:
+    ---
+        - city (str): The name that was looked up.
+        - suggestions (List[str]): The names of the cities the user may have meant.
+    """
+
+    def __init__(self, city: str, suggestions: Iterable[str] = ()) -> None:
+        super().__init__(f'could not find the city "{city}"')
+        self.city = city
+        self.suggestions = list(suggestions)
 
 
 def get_lat_long(city: str) -> Tuple[float, float]:
     """
     Returns the latitude and longitude for the specified city.
 
+    The city is looked up in the offline `gazetteer` first, e.g. "Esbjerg" or "Paris, US".
+    Names it does not know, such as places too small for it (e.g. "Ribe"), are looked up
+    with Nominatim. If Nominatim does not know the name either, CityNotFoundError is raised
+    with the gazetteer's names close to it (e.g. "Esbjerg" for "esbjreg"), if any.
+
+    Nominatim's results, including cities that could not be found, are kept in
+    `geocode_cache`, so it is only asked about a city once. geopy is imported on the first
+    lookup that misses the cache. Nominatim is called through its circuit breaker, so while
+    it is down lookups of new cities fail right away, and its timeout follows its recent
+    latency, starting at NOMINATIM_TIMEOUT seconds.
+
     Args:
     ---
         city: The name of the city.
@@ -34,12 +77,39 @@ def get_lat_long(city: str) -> Tuple[float, float]:
     Returns:
     ---
         Tuple[float, float]: A tuple containing the latitude and longitude for the city.
+
+    Raises:
+    ---
+        CityNotFoundError: If the city could not be found.
+        CircuitOpenError: If the city is not known locally and Nominatim's breaker is open.
     """
-    geolocator = Nominatim(user_agent="discord python weather bot")
-    location = geolocator.geocode(city)
-    lat = location.latitude
-    lon = location.longitude
-    return (lat, lon)
+    global _geolocator  # pylint:disable=global-statement
+    place = gazetteer.lookup(city)
+    if place is not None:
+        return place.latitude, place.longitude
+    try:
+        coordinates = geocode_cache.get(city)
+    except KeyError:
+        if _geolocator is None:
+            from geopy.geocoders import Nominatim  # pylint:disable=import-outside-toplevel
+            _geolocator = Nominatim(user_agent="discord python weather bot")
+        timeout = latencies.timeout("nominatim", NOMINATIM_TIMEOUT)
+        with breakers.get("nominatim").guard(), track_upstream("nominatim"):
+            start = time.perf_counter()
+            try:
+                location = _geolocator.geocode(city, timeout=timeout)
+            except Exception as error:
+                from geopy.exc import GeocoderTimedOut  # pylint:disable=import-outside-toplevel
+                if isinstance(error, GeocoderTimedOut):
+                    latencies.record_timeout("nominatim")
+                raise
+            latencies.record("nominatim", time.perf_counter() - start)
+        coordinates = None if location is None else (location.latitude, location.longitude)
+        geocode_cache.put(city, coordinates)
+    if coordinates is None:
+        # only suggest other names once the remote lookup came up empty too
+        raise CityNotFoundError(city, [] if "," in city else gazetteer.suggest(city))
+    return coordinates
 
 
 def flatten(lst: list[list[object]]) -> list[object]:
@@ -97,38 +167,20 @@ def fix_command(strings: list) -> list[str]:
     return [command_string(string) for string in strings]
 
 
-def random_greeting(name: str = "<NAME>") -> str:
+def random_greeting(name: str = "<NAME>", guild_id: Optional[int] = None) -> str:
     """
     Returns a random greeting with the specified name.
 
+    The greetings are precomputed by `greetings.greeting_engine`, so this is a single
+    choice and one format.
+
     Args:
     ---
         name: The name to use in the greeting. Defaults to "<NAME>".
+        guild_id: The guild the greeting is for, to use its locale pack. Defaults to None.
 
     Returns:
     ---
         str: A random greeting with the specified name.
     """
-    commands = bot.Commands()
-    greetings = list(
-        set(
-            commands.greets()
-            + [
-                "How's it going?",
-                "How are ya?",
-                "How's it hangin'?",
-                "what's up?",
-                "good'ay",
-            ]
-        )
-    )
-    return random.choice(
-        list(
-            map(
-                lambda word: f"{word[1:].capitalize()}, {name.capitalize()}!"
-                if word.startswith("!")
-                else f"{word.capitalize()}, {name.capitalize()}!",
-                greetings,
-            )
-        )
-    ).capitalize()
+    return greeting_engine.greet(name, guild_id)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the HttpClient class, an asynchronous HTTP client shared by every
+class that talks to an external API (dog and cat facts, weather and Giphy).
+
+All requests go through one aiohttp session, so keep-alive connections to each host are
+pooled and reused instead of being opened for every command. Each host also has its own
+concurrency limit, so one slow upstream can only tie up its own share of the pool.
+Every request is timed and counted under its upstream's name in the metrics registry, and
+goes through that upstream's circuit breaker: while the breaker is open, requests fail
+right away with CircuitOpenError instead of waiting out the timeout.
+
+The timeout of each upstream's requests follows its recent latency (see adaptive_timeout),
+and requests sent with `hedge=True` are duplicated once they are slower than the upstream's
+p95, within a budget, using whichever answer comes first.
+
+Attributes:
+---
+    DEFAULT_TIMEOUT: The total timeout of a request until the upstream's latency is known.
+    DEFAULT_HOST_LIMIT: The default number of concurrent requests allowed to one host.
+    HOST_LIMITS: Concurrency limits for the hosts the bot talks to.
+    shared_client: The HttpClient instance shared by the whole bot.
+
+Methods:
+---
+    HttpClient.get_json: Sends a GET request and returns the decoded JSON body.
+    HttpClient.get: Sends a GET request and discards the body.
+    HttpClient.close: Closes the pooled connections.
+"""
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Set, TypeVar
+from urllib.parse import urlsplit
+from metrics import track_upstream
+from adaptive_timeout import HedgeBudget, LatencyTracker, hedge_budget as shared_budget
+from adaptive_timeout import latencies as shared_latencies
+from circuit_breaker import OPEN, BreakerRegistry, breakers as shared_breakers
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_HOST_LIMIT = 4
+HOST_LIMITS = {
+    "api.giphy.com": 8,
+    "api.openweathermap.org": 8,
+    "dogapi.dog": 4,
+    "meowfacts.herokuapp.com": 4,
+}
+
+if TYPE_CHECKING:
+    import aiohttp
+
+T = TypeVar("T")
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether an error means the upstream is failing, as opposed to a bad request: client
+    errors (4xx) other than 429 Too Many Requests, and errors raised before the request was
+    sent (e.g. a TypeError for a missing API key), don't count against the breaker.
+
+    Args:
+    ---
+        error (BaseException): The error raised by a request.
+
+    Returns:
+    ---
+        bool: True if the error counts as a failure of the upstream.
+    """
+    if isinstance(error, TypeError):
+        return False
+    status = getattr(error, "status", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+
+
+class HttpClient:
+    """
+    An asynchronous HTTP client with a pooled, keep-alive connection per host.
+
+    aiohttp is imported and the underlying session created the first time a request is
+    made, so the client can be built at import time, before the event loop is running,
+    without slowing down the bot's startup.
+
+    Attributes:
+    ---
+        - timeout (float): The total timeout of a request to an upstream whose latency
+                is not known yet, in seconds. Afterwards it is derived from the latency.
+        - host_limits (Dict[str, int]): The number of concurrent requests allowed per host.
+        - default_host_limit (int): The limit used for hosts missing from `host_limits`.
+        - breakers (BreakerRegistry): The circuit breakers of the upstreams.
+        - latencies (LatencyTracker): The recent latencies of the upstreams.
+        - hedge_budget (HedgeBudget): Caps the hedged requests.
+
+    Methods:
+    ---
+        - get_json(self, url, params, timeout, upstream, hedge) -> Any: Sends a GET request
+                and returns the decoded JSON body.
+        - get(self, url, params, timeout, upstream, hedge) -> int: Sends a GET request,
+                discards the body and returns the status code.
+        - is_open(self, upstream) -> bool: Whether an upstream's circuit breaker is open.
+        - close(self) -> None: Closes the session and its pooled connections.
+    """
+
+    def __init__(
+        self,
+        timeout: float = DEFAULT_TIMEOUT,
+        host_limits: Optional[Dict[str, int]] = None,
+        default_host_limit: int = DEFAULT_HOST_LIMIT,
+        breakers: BreakerRegistry = shared_breakers,
+        latencies: LatencyTracker = shared_latencies,
+        hedge_budget: HedgeBudget = shared_budget,
+    ) -> None:
+        self.timeout = timeout
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+        self.default_host_limit = default_host_limit
+        self.breakers = breakers
+        self.latencies = latencies
+        self.hedge_budget = hedge_budget
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._background: Set["asyncio.Future"] = set()
+
+    def is_open(self, upstream: str) -> bool:
+        """
+        Whether an upstream's circuit breaker is open, so its calls would be refused.
+
+        Args:
+        ---
+            upstream (str): The name of the upstream.
+
+        Returns:
+        ---
+            bool: True if the breaker is open.
+        """
+        return self.breakers.get(upstream).state() == OPEN
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            import aiohttp  # pylint:disable=import-outside-toplevel,redefined-outer-name
+            connector = aiohttp.TCPConnector(
+                limit=sum(self.host_limits.values()) + self.default_host_limit,
+                limit_per_host=max([self.default_host_limit, *self.host_limits.values()]),
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": "discord python weather bot"},
+            )
+        return self._session
+
+    def _get_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.host_limits.get(host, self.default_host_limit))
+            self._semaphores[host] = semaphore
+        return semaphore
+
+    async def get_json(  # pylint:disable=too-many-arguments
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        upstream: Optional[str] = None,
+        hedge: bool = False,
+    ) -> Any:
+        """
+        Sends a GET request and returns the decoded JSON body.
+
+        Args:
+        ---
+            - url (str): The URL to request.
+            - params (Optional[Dict[str, Any]]): Query parameters to add to the URL.
+            - timeout (Optional[float]): The total timeout in seconds until the upstream's
+                    latency is known. Defaults to the client's timeout.
+            - upstream (Optional[str]): The name the request is recorded under in the
+                    metrics. Defaults to the URL's host.
+            - hedge (bool): Whether to send a duplicate request if this one is slow. Only
+                    for requests that are safe to send twice.
+
+        Returns:
+        ---
+            Any: The decoded JSON body.
+
+        Raises:
+        ---
+            aiohttp.ClientError: If the request fails or the status code is not 2xx.
+            asyncio.TimeoutError: If the request takes longer than the timeout.
+            CircuitOpenError: If the upstream's circuit breaker is open.
+        """
+
+        async def request(client_timeout: "aiohttp.ClientTimeout") -> Any:
+            async with self._get_session().get(url, params=params, timeout=client_timeout) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+
+        return await self._send(url, upstream, request, timeout, hedge)
+
+    async def get(  # pylint:disable=too-many-arguments
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        upstream: Optional[str] = None,
+        hedge: bool = False,
+    ) -> int:
+        """
+        Sends a GET request and discards the body.
+
+        Args:
+        ---
+            - url (str): The URL to request.
+            - params (Optional[Dict[str, Any]]): Query parameters to add to the URL.
+            - timeout (Optional[float]): The total timeout in seconds until the upstream's
+                    latency is known. Defaults to the client's timeout.
+            - upstream (Optional[str]): The name the request is recorded under in the
+                    metrics. Defaults to the URL's host.
+            - hedge (bool): Whether to send a duplicate request if this one is slow.
+
+        Returns:
+        ---
+            int: The status code of the response.
+
+        Raises:
+        ---
+            CircuitOpenError: If the upstream's circuit breaker is open.
+        """
+
+        async def request(client_timeout: "aiohttp.ClientTimeout") -> int:
+            async with self._get_session().get(url, params=params, timeout=client_timeout) as resp:
+                await resp.read()
+                return resp.status
+
+        return await self._send(url, upstream, request, timeout, hedge)
+
+    async def _send(  # pylint:disable=too-many-arguments
+        self,
+        url: str,
+        upstream: Optional[str],
+        request: Callable[["aiohttp.ClientTimeout"], Awaitable[T]],
+        timeout: Optional[float],
+        hedge: bool,
+    ) -> T:
+        host = urlsplit(url).hostname or ""
+        upstream = upstream or host
+        timeout = self.latencies.timeout(upstream, self.timeout if timeout is None else timeout)
+        # a hedged request is one call as far as the circuit breaker is concerned
+        with self.breakers.get(upstream).guard(is_upstream_failure):
+            self.hedge_budget.deposit()
+            delay = self.latencies.hedge_delay(upstream) if hedge else None
+            if delay is None:
+                return await self._attempt(host, upstream, request, timeout)
+            return await self._hedged(host, upstream, request, timeout, delay)
+
+    async def _attempt(
+        self,
+        host: str,
+        upstream: str,
+        request: Callable[["aiohttp.ClientTimeout"], Awaitable[T]],
+        timeout: float,
+    ) -> T:
+        async with self._get_semaphore(host):
+            start = time.perf_counter()
+            try:
+                with track_upstream(upstream):
+                    result = await request(self._client_timeout(timeout))
+            except asyncio.TimeoutError:
+                # not a latency sample: recording the timeout would raise the next one
+                self.latencies.record_timeout(upstream)
+                raise
+            self.latencies.record(upstream, time.perf_counter() - start)
+            return result
+
+    async def _hedged(  # pylint:disable=too-many-arguments
+        self,
+        host: str,
+        upstream: str,
+        request: Callable[["aiohttp.ClientTimeout"], Awaitable[T]],
+        timeout: float,
+        delay: float,
+    ) -> T:
+        attempts = [asyncio.ensure_future(self._attempt(host, upstream, request, timeout))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done or not self.hedge_budget.acquire():
+                return await attempts[0]
+            attempts.append(asyncio.ensure_future(self._attempt(host, upstream, request, timeout)))
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is attempts[1]:
+                            self.hedge_budget.record_win()
+                        # the slower attempt is left to finish (within its timeout): the
+                        # upstream is already working on it, and cancelling it would lose
+                        # its latency, the very tail the timeouts are derived from
+                        for other in pending:
+                            self._background.add(other)
+                            other.add_done_callback(self._forget)
+                        return attempt.result()
+                    error = error or attempt.exception()
+            raise error
+        except asyncio.CancelledError:
+            for attempt in attempts:
+                attempt.cancel()
+            raise
+
+    def _forget(self, attempt: "asyncio.Future") -> None:
+        self._background.discard(attempt)
+        if not attempt.cancelled():
+            attempt.exception()
+
+    def _client_timeout(self, timeout: float) -> "aiohttp.ClientTimeout":
+        import aiohttp  # pylint:disable=import-outside-toplevel,redefined-outer-name
+        return aiohttp.ClientTimeout(total=timeout)
+
+    async def close(self) -> None:
+        """
+        Closes the session and its pooled connections.
+
+        The client can still be used afterwards; a new session is created on the next request.
+        """
+        for attempt in list(self._background):
+            attempt.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._semaphores.clear()
+
+
+shared_client = HttpClient()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the Lazy class, which builds a component the first time it is needed,
+so the bot can start without importing the modules (and their dependencies) of commands
+nobody has used yet.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    Lazy.get: Returns the component, building it on first use.
+    Lazy.loaded: Whether the component has been built.
+"""
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """
+    A component built by `factory` the first time `get` is called.
+
+    The factory is where the component's module is imported, so neither the module nor its
+    dependencies are loaded until then. It runs at most once, even if `get` is first called
+    from several threads at the same time.
+
+    Attributes:
+    ---
+        - factory (Callable[[], T]): Builds the component.
+
+    Methods:
+    ---
+        - get(self) -> T: Returns the component, building it if needed.
+        - loaded (bool): Whether the component has been built.
+    """
+
+    __slots__ = ("factory", "_value", "_lock")
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self.factory = factory
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        """
+        Returns the component, building it on first use.
+
+        Returns:
+        ---
+            T: The component.
+        """
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.factory()
+                value = self._value
+        return value
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the component has been built.
+        """
+        return self._value is not None
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the RotatingLogFile class, a log file that rotates itself by size
+and by day, compresses old segments on a background thread and keeps an index of which
+segment covers which time range.
+
+Attributes:
+---
+    COMPRESSIONS: The supported compression formats and the suffix of their files.
+
+Methods:
+---
+    RotatingLogFile.write: Writes to the active segment, rotating it first if needed.
+    RotatingLogFile.rotate: Closes the active segment and starts a new one.
+    RotatingLogFile.segments: Returns the index of rotated segments.
+    RotatingLogFile.close: Closes the active segment and waits for pending compressions.
+    read_index: Reads the segment index of a log file.
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def index_path(path: str) -> str:
+    """
+    Returns the path of the segment index of a log file.
+
+    Args:
+    ---
+        path (str): The path of the log file, e.g. "logs/chatlog.log".
+
+    Returns:
+    ---
+        str: The path of its index, e.g. "logs/chatlog.log.index.json".
+    """
+    return f"{path}.index.json"
+
+
+def read_index(path: str) -> Dict[str, Any]:
+    """
+    Reads the segment index of a log file.
+
+    The index holds the start time of the active segment and, for every rotated segment,
+    its file name (relative to the log's directory), the epoch times of its first and
+    last line and its size before compression.
+
+    Args:
+    ---
+        path (str): The path of the log file.
+
+    Returns:
+    ---
+        Dict[str, Any]: The index, {"active_start": float, "segments": [...]}.
+    """
+    try:
+        with open(index_path(path), encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {"active_start": None, "segments": []}
+
+
+def _next_midnight(timestamp: float) -> float:
+    day = datetime.fromtimestamp(timestamp).date() + timedelta(days=1)
+    return datetime(day.year, day.month, day.day).timestamp()
+
+
+class RotatingLogFile:
+    """
+    A log file that rotates when it grows past `max_bytes` or when the day changes.
+
+    On rotation the active file, e.g. "logs/chatlog.log", is renamed to
+    "logs/chatlog.20221224T120000.log" after the time of its first line, a new active file
+    is opened, and the old segment is compressed on a background thread so rotating never
+    waits on compression. Segments older than `retention_days`, and the oldest segments past
+    `max_segments`, are deleted. Every rotated segment is recorded in the index,
+    "logs/chatlog.log.index.json".
+
+    The class has the subset of the file interface used by BufferedLogWriter:
+    write, flush, fileno and close. It is meant to be written to by a single thread.
+
+    Attributes:
+    ---
+        - path (str): The path of the active log file.
+        - max_bytes (Optional[int]): The size a segment is rotated at, or None for no limit.
+        - daily (bool): Whether a segment is rotated when the day changes.
+        - compression (Optional[str]): "gzip", "zstd" or None.
+        - retention_days (Optional[float]): How long rotated segments are kept, or None for ever.
+        - max_segments (Optional[int]): How many rotated segments are kept, or None for no limit.
+
+    Methods:
+    ---
+        - write(self, data) -> int: Writes to the active segment.
+        - flush(self) -> None: Flushes the active segment.
+        - fileno(self) -> int: Returns the file descriptor of the active segment.
+        - rotate(self) -> None: Closes the active segment and starts a new one.
+        - segments(self) -> List[Dict[str, Any]]: Returns the index of rotated segments.
+        - close(self) -> None: Closes the active segment and waits for pending compressions.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        daily: bool = True,
+        compression: Optional[str] = "gzip",
+        retention_days: Optional[float] = 90,
+        max_segments: Optional[int] = None,
+    ) -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {list(COMPRESSIONS)}, not {compression!r}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError('zstd compression needs the "zstandard" package')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.compression = compression
+        self.retention_days = retention_days
+        self.max_segments = max_segments
+        self._directory = os.path.dirname(path) or "."
+        self._stem, self._ext = os.path.splitext(os.path.basename(path))
+        self._index_lock = threading.Lock()
+        self._index = read_index(path)
+        self._compressor: Optional[ThreadPoolExecutor] = None
+        os.makedirs(self._directory, exist_ok=True)
+        self._open()
+        # segments left uncompressed by a crash are compressed now
+        if self.compression is not None:
+            for segment in self._index["segments"]:
+                if not segment["file"].endswith(COMPRESSIONS[self.compression]):
+                    self._submit_compression(segment["file"])
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")  # pylint:disable=consider-using-with
+        self._size = self._file.tell()
+        if self._size:
+            # a segment left by an earlier run; fall back to its mtime if the index lost it
+            self._last = os.path.getmtime(self.path)
+            self._start_segment(self._index.get("active_start") or self._last)
+        else:
+            self._last = self._start = time.time()
+            self._rotate_at = float("inf")
+
+    def _start_segment(self, start: float) -> None:
+        self._start = start
+        self._rotate_at = _next_midnight(start) if self.daily else float("inf")
+        with self._index_lock:
+            self._index["active_start"] = start
+            self._save_index()
+
+    def write(self, data: str) -> int:
+        """
+        Writes to the active segment, rotating it first if it is full or from an earlier day.
+
+        Args:
+        ---
+            data (str): The text to write.
+
+        Returns:
+        ---
+            int: The number of characters written.
+        """
+        now = time.time()
+        if self._size and (
+            now >= self._rotate_at
+            or (self.max_bytes is not None and self._size >= self.max_bytes)
+        ):
+            self.rotate()
+        if self._size == 0:
+            self._start_segment(now)
+        self._size += len(data.encode("utf-8"))
+        self._last = now
+        return self._file.write(data)
+
+    def flush(self) -> None:
+        """
+        Flushes the active segment to the OS.
+        """
+        self._file.flush()
+
+    def fileno(self) -> int:
+        """
+        Returns the file descriptor of the active segment.
+        """
+        return self._file.fileno()
+
+    def rotate(self) -> None:
+        """
+        Closes the active segment, renames it after its start time and opens a new one.
+        The renamed segment is compressed in the background.
+        """
+        self._file.close()
+        if self._size == 0:
+            self._open()
+            return
+        stamp = datetime.fromtimestamp(self._start).strftime("%Y%m%dT%H%M%S")
+        name = f"{self._stem}.{stamp}{self._ext}"
+        suffix = 1
+        while self._taken(name):
+            suffix += 1
+            name = f"{self._stem}.{stamp}-{suffix}{self._ext}"
+        os.replace(self.path, os.path.join(self._directory, name))
+        with self._index_lock:
+            self._index["segments"].append(
+                {"file": name, "start": self._start, "end": self._last, "bytes": self._size}
+            )
+            self._index["active_start"] = None
+            self._save_index()
+        self._open()
+        self._submit_compression(name)
+
+    def _taken(self, name: str) -> bool:
+        return any(
+            os.path.exists(os.path.join(self._directory, name + ext))
+            for ext in COMPRESSIONS.values()
+        )
+
+    def segments(self) -> List[Dict[str, Any]]:
+        """
+        Returns the index of rotated segments, oldest first.
+
+        Returns:
+        ---
+            List[Dict[str, Any]]: One {"file", "start", "end", "bytes"} entry per segment.
+        """
+        with self._index_lock:
+            return [dict(segment) for segment in self._index["segments"]]
+
+    def close(self) -> None:
+        """
+        Closes the active segment and waits for pending compressions to finish.
+        """
+        self._file.close()
+        if self._compressor is not None:
+            self._compressor.shutdown(wait=True)
+            self._compressor = None
+
+    def _submit_compression(self, name: str) -> None:
+        if self._compressor is None:
+            self._compressor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"log-compress:{self._stem}"
+            )
+        self._compressor.submit(self._compress, name)
+
+    def _compress(self, name: str) -> None:
+        source = os.path.join(self._directory, name)
+        compressed = name + COMPRESSIONS[self.compression]
+        if compressed != name and os.path.exists(source):
+            # written under a temporary name, so a crash never leaves a truncated segment
+            tmp_path = os.path.join(self._directory, compressed + ".tmp")
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                if self.compression == "gzip":
+                    with gzip.GzipFile(filename=name, mode="wb", fileobj=dst) as gz_dst:
+                        shutil.copyfileobj(src, gz_dst)
+                else:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+            os.replace(tmp_path, os.path.join(self._directory, compressed))
+            os.remove(source)
+        with self._index_lock:
+            for segment in self._index["segments"]:
+                if segment["file"] == name:
+                    segment["file"] = compressed
+        self._apply_retention()
+
+    def _apply_retention(self) -> None:
+        with self._index_lock:
+            segments = self._index["segments"]
+            expired = []
+            if self.retention_days is not None:
+                cutoff = time.time() - self.retention_days * 24 * 60 * 60
+                expired = [segment for segment in segments if segment["end"] < cutoff]
+            if self.max_segments is not None and len(segments) - len(expired) > self.max_segments:
+                kept = [segment for segment in segments if segment not in expired]
+                expired += kept[: len(kept) - self.max_segments]
+            for segment in expired:
+                try:
+                    os.remove(os.path.join(self._directory, segment["file"]))
+                except FileNotFoundError:
+                    pass
+            self._index["segments"] = [segment for segment in segments if segment not in expired]
+            self._save_index()
+
+    def _save_index(self) -> None:
+        tmp_path = index_path(self.path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as index_file:
+            json.dump(self._index, index_file, indent=1)
+        os.replace(tmp_path, index_path(self.path))
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the BufferedLogWriter class, which takes log lines off the event loop
+and writes them to disk in batches from a background thread.
+
+Attributes:
+---
+    DURABILITY_MODES: The supported durability modes.
+    WRITE_RETRIES: The number of times a failed write is retried before its lines are dropped.
+
+Methods:
+---
+    BufferedLogWriter.write: Buffers a line without touching the disk.
+    BufferedLogWriter.flush: Waits until every buffered line has been written.
+    BufferedLogWriter.close: Writes every buffered line and closes the file.
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from log_rotation import RotatingLogFile
+
+DURABILITY_MODES = ("none", "batch", "event")
+WRITE_RETRIES = 3
+
+
+class BufferedLogWriter:
+    """
+    A file writer that buffers lines in memory and writes them from a background thread.
+
+    `write` only appends to a bounded in-memory buffer. The writer thread writes the
+    buffer out once it holds `flush_size` lines or `flush_interval` seconds have passed,
+    whichever comes first. If the buffer fills up, `write` blocks until the writer thread
+    has made room, so no line is dropped while the disk works. A write that fails (e.g. the
+    disk is full) is retried `write_retries` times; if it still fails, its lines are dropped
+    and reported on stderr, and the thread carries on with the next batch.
+
+    The durability mode controls when data is forced to disk:
+        - "none": each batch is handed to the OS, which writes it out when it sees fit.
+        - "batch": each batch is fsynced.
+        - "event": each line is written and fsynced on its own.
+
+    Attributes:
+    ---
+        - path (str): The path of the log file.
+        - durability (str): The durability mode, one of DURABILITY_MODES.
+        - flush_size (int): The number of buffered lines that triggers a write.
+        - flush_interval (float): The longest time, in seconds, a line stays buffered.
+        - capacity (int): The number of lines the buffer holds before `write` blocks.
+        - rotation (Optional[Dict[str, Any]]): If given, the file is a RotatingLogFile
+                built with these settings, so it is rotated by the writer thread.
+        - written (int): The number of lines written so far.
+        - dropped (int): The number of lines dropped because writing them kept failing.
+
+    Methods:
+    ---
+        - write(self, line) -> None: Buffers a line.
+        - flush(self) -> None: Waits until every buffered line has been written.
+        - close(self) -> None: Writes every buffered line, stops the thread and closes the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        durability: str = "none",
+        flush_size: int = 256,
+        flush_interval: float = 1.0,
+        capacity: int = 65536,
+        rotation: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, not {durability!r}")
+        self.path = path
+        self.durability = durability
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.written = 0
+        self.dropped = 0
+        self.write_retries = WRITE_RETRIES
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file: Any
+        if rotation is not None:
+            self._file = RotatingLogFile(path, **rotation)
+        else:
+            self._file = open(path, "a", encoding="utf-8")  # pylint:disable=consider-using-with
+        self._buffer: Deque[str] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._in_progress = 0
+        self._thread = threading.Thread(
+            target=self._run, name=f"log-writer:{os.path.basename(path)}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def closed(self) -> bool:
+        """
+        Whether the writer has been closed.
+        """
+        return self._closed
+
+    def write(self, line: str) -> None:
+        """
+        Buffers a line to be written by the background thread.
+
+        Args:
+        ---
+            - line (str): The line to write, including its newline.
+
+        Raises:
+        ---
+            ValueError: If the writer has been closed.
+        """
+        if self._closed:
+            raise ValueError("write to closed log writer")
+        if len(self._buffer) >= self.capacity:
+            with self._cond:
+                while len(self._buffer) >= self.capacity and self._thread.is_alive():
+                    self._cond.wait()
+        # deque.append is thread-safe, so the common case takes no lock
+        self._buffer.append(line)
+        if len(self._buffer) == self.flush_size or self.durability == "event":
+            with self._cond:
+                self._cond.notify_all()
+
+    def flush(self) -> None:
+        """
+        Waits until every line buffered so far has been written.
+        """
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._buffer or self._in_progress) and self._thread.is_alive():
+                self._cond.wait()
+
+    def close(self) -> None:
+        """
+        Writes every buffered line, stops the writer thread and closes the file.
+        Calling it more than once does nothing.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _take_batch(self) -> List[str]:
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while not self._closed and not self._flush_requested:
+                if len(self._buffer) >= self.flush_size:
+                    break
+                if self.durability == "event" and self._buffer:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._flush_requested = False
+            # popleft rather than clear(), since write() appends without holding the lock
+            batch = [self._buffer.popleft() for _ in range(len(self._buffer))]
+            self._in_progress = len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def _write_batch(self, batch: List[str]) -> None:
+        if self.durability == "event":
+            for position, line in enumerate(batch):
+                if not self._write_retrying(line, 1):
+                    # the disk is failing: drop the rest rather than retry line by line
+                    self._drop(len(batch) - position - 1, None)
+                    return
+        else:
+            self._write_retrying("".join(batch), len(batch))
+
+    def _write_retrying(self, text: str, lines: int) -> bool:
+        handed_over = False
+        for attempt in range(self.write_retries + 1):
+            try:
+                # once the text is in the file's buffer only the flush is retried,
+                # so a retry never writes it twice
+                if not handed_over:
+                    self._file.write(text)
+                    handed_over = True
+                self._file.flush()
+                if self.durability != "none":
+                    os.fsync(self._file.fileno())
+            except Exception as error:  # pylint:disable=broad-except
+                if attempt == self.write_retries:
+                    self._drop(lines, error)
+                    return False
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                self.written += lines
+                return True
+        return False
+
+    def _drop(self, lines: int, error: Optional[BaseException]) -> None:
+        if not lines:
+            return
+        self.dropped += lines
+        reason = f": {error!r}" if error is not None else ""
+        print(f"log writer {self.path}: dropped {lines} lines{reason}", file=sys.stderr)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write_batch(batch)
+            with self._cond:
+                self._in_progress = 0
+                self._cond.notify_all()
+                if self._closed and not self._buffer:
+                    return
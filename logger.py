@@ -6,8 +6,10 @@ log various events that occur in a Discord chat.
 
 Attributes:
 ---
-    chat_log_file: A file object for the chat log file.
-    sys_log_file: A file object for the system log file.
+    LOG_FORMATS: The supported chat log formats.
+    chat_log_file: A BufferedLogWriter for the chat log file.
+    chat_jsonl_file: A BufferedLogWriter for the structured (JSONL) chat log file.
+    sys_log_file: A BufferedLogWriter for the system log file.
     current_time: A string representing the current time.
 
 Methods:
@@ -19,9 +21,42 @@ Methods:
     chat_log: Logs a message in the chat log file.
     chat_edit_log: Logs an edited message in the chat log file.
     chat_delete_log: Logs a deleted message in the chat log file.
+    chat_raw_edit_log: Logs an edit from a raw gateway event in the chat log file.
+    chat_raw_delete_log: Logs a deletion from a raw gateway event in the chat log file.
     sys_log: Logs a message in the system log file.
 """
+import os
+import json
+import time
 from datetime import datetime
+from typing import Any, Dict, Optional
+from log_writer import BufferedLogWriter
+
+LOG_FORMATS = ("text", "jsonl", "both")
+
+
+def rotation_from_env() -> Dict[str, Any]:
+    """
+    Reads the log rotation settings from the environment.
+
+    Variables:
+    ---
+        - LOG_MAX_BYTES: The size a log segment is rotated at. Defaults to 64 MiB.
+        - LOG_ROTATE_DAILY: "0" to only rotate by size. Defaults to "1".
+        - LOG_COMPRESSION: "gzip", "zstd" or "none". Defaults to "gzip".
+        - LOG_RETENTION_DAYS: How many days rotated segments are kept. Defaults to 90.
+
+    Returns:
+    ---
+        Dict[str, Any]: The keyword arguments for RotatingLogFile.
+    """
+    compression = os.getenv("LOG_COMPRESSION", "gzip")
+    return {
+        "max_bytes": int(os.getenv("LOG_MAX_BYTES", str(64 * 1024 * 1024))),
+        "daily": os.getenv("LOG_ROTATE_DAILY", "1") != "0",
+        "compression": None if compression == "none" else compression,
+        "retention_days": float(os.getenv("LOG_RETENTION_DAYS", "90")),
+    }
 
 
 class Logger:
@@ -30,10 +65,21 @@ class Logger:
     It provides methods to log chat messages, deleted chat messages, edited chat messages,
     and system messages. It also provides methods to close the log files
     when the program is finished running.
+
+    Log lines are handed to a BufferedLogWriter per file, which writes them in batches from
+    a background thread, so logging never waits on the disk. The durability mode is taken
+    from the LOG_DURABILITY environment variable ("none", "batch" or "event").
+    Both files are rotated by size and by day, with old segments compressed in the background;
+    see `rotation_from_env` for the settings.
+
+    The LOG_FORMAT environment variable selects the chat log format: "text" writes
+    logs/chatlog.log, "jsonl" writes one JSON record per event to logs/chatlog.jsonl,
+    and "both" writes both. The JSON records can be searched with logquery.py.
     Attributes:
     ---
-        - chat_log_file (file): The file object for the chat log file.
-        - sys_log_file (file): The file object for the system log file.
+        - chat_log_file (Optional[BufferedLogWriter]): The writer for the text chat log file.
+        - chat_jsonl_file (Optional[BufferedLogWriter]): The writer for the JSONL chat log file.
+        - sys_log_file (BufferedLogWriter): The writer for the system log file.
         - current_time (str): The current time, formatted as a string.
 
     Methods:
@@ -51,17 +97,38 @@ class Logger:
                 Logs edited chat messages to a file and returns the logged message.
         - chat_delete_log(self, message: discord.Message) -> str: Logs a deleted
                 message to the chat log file and returns the logged message.
+        - chat_raw_edit_log(self, payload, channel) -> Optional[str]: Logs an edit from an
+                on_raw_message_edit event, whether or not the message was cached.
+        - chat_raw_delete_log(self, payload, channel) -> str: Logs a deletion from an
+                on_raw_message_delete event, whether or not the message was cached.
         - sys_log(self, message: str) -> str: Logs system messages to a file and
                 returns the logged message.
     """
 
-    def __init__(self) -> None:
-        self.chat_log_file = open(
-            "logs/chatlog.log", "a+", encoding=("utf-8")
-        )  # pylint:disable=consider-using-with
-        self.sys_log_file = open(
-            "logs/syslog.log", "a+", encoding=("utf-8")
-        )  # pylint:disable=consider-using-with
+    def __init__(
+        self,
+        durability: Optional[str] = None,
+        rotation: Optional[Dict[str, Any]] = None,
+        log_format: Optional[str] = None,
+    ) -> None:
+        durability = durability or os.getenv("LOG_DURABILITY", "none")
+        rotation = rotation if rotation is not None else rotation_from_env()
+        log_format = log_format or os.getenv("LOG_FORMAT", "text")
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"log_format must be one of {LOG_FORMATS}, not {log_format!r}")
+        self.chat_log_file = None
+        self.chat_jsonl_file = None
+        if log_format in ("text", "both"):
+            self.chat_log_file = BufferedLogWriter(
+                "logs/chatlog.log", durability=durability, rotation=rotation
+            )
+        if log_format in ("jsonl", "both"):
+            self.chat_jsonl_file = BufferedLogWriter(
+                "logs/chatlog.jsonl", durability=durability, rotation=rotation
+            )
+        self.sys_log_file = BufferedLogWriter(
+            "logs/syslog.log", durability=durability, rotation=rotation
+        )
         self.current_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
 
     def log_boilerplate(self, message, event: str):
@@ -80,14 +147,60 @@ class Logger:
         """
         return f"[{event.upper()}][{message.created_at}] [{message.author.name}#{message.author.discriminator} -> {message.channel.name}]:"  # pylint:disable=line-too-long
 
+    def log_record(self, message, event: str) -> Dict[str, Any]:
+        """
+        Generates the structured record of a chat event, written to the JSONL chat log.
+
+        Args:
+        ---
+            - message (discord.Message): The message being logged.
+            - event (str): The type of event being logged, such as "chat" or "delete".
+
+        Returns:
+        ---
+            - Dict[str, Any]: The record, with the time of the event ("ts", epoch seconds),
+                    the ids and names of the author and channel, and the message's content.
+        """
+        created_at = message.created_at
+        return {
+            "event": event.lower(),
+            "ts": time.time(),
+            "created_at": created_at.timestamp() if hasattr(created_at, "timestamp") else None,
+            "message_id": getattr(message, "id", None),
+            "author_id": getattr(message.author, "id", None),
+            "author": f"{message.author.name}#{message.author.discriminator}",
+            "channel_id": getattr(message.channel, "id", None),
+            "channel": getattr(message.channel, "name", None),
+            "content": message.content,
+        }
+
+    def write_chat(self, msg: str, record: Dict[str, Any]) -> None:
+        """
+        Writes a chat event to the chat log files enabled by the log format.
+
+        Args:
+        ---
+            - msg (str): The text form of the event.
+            - record (Dict[str, Any]): The structured form of the event.
+        """
+        if self.chat_log_file is not None:
+            self.chat_log_file.write(f"{msg}\n")
+        if self.chat_jsonl_file is not None:
+            # compact separators keep the output byte-for-byte predictable for logquery's prefilter
+            self.chat_jsonl_file.write(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+            )
+
     def close_chat_file(self):
         """
         Closes the chat log file.
 
-        This method closes the chat log file,
-        ensuring that all data is saved and the file is properly closed.
+        This method writes every buffered line to the chat log files,
+        ensuring that all data is saved and the files are properly closed.
         """
-        self.chat_log_file.close()
+        for log_file in (self.chat_log_file, self.chat_jsonl_file):
+            if log_file is not None:
+                log_file.close()
 
     def close_sys_file(self):
         """
@@ -102,7 +215,7 @@ class Logger:
         """
         Close the chat log and system log files.
 
-        This method closes the file objects for the chat log and system log, and should
+        This method drains the buffers of the chat log and system log and closes them, and should
         be called before the program exits to ensure that all data is written to the log files.
         """
         self.close_chat_file()
@@ -121,8 +234,7 @@ class Logger:
             - str: The formatted message to be logged.
         """
         msg = f"{self.log_boilerplate(message, 'CHAT')} {message.content}"
-        self.chat_log_file.write(f"{msg}\n")
-        self.chat_log_file.flush()
+        self.write_chat(msg, self.log_record(message, "chat"))
         return msg
 
     def chat_edit_log(self, message_before, message_after) -> str:
@@ -138,8 +250,9 @@ class Logger:
             - str: The logged message.
         """
         msg = f"[EDIT][{message_before.created_at}] [{message_before.author.name}#{message_before.author.discriminator} -> {message_before.channel.name}]: {message_before.content} => {message_after.content}"  # pylint:disable=line-too-long
-        self.chat_log_file.write(f"{msg}\n")
-        self.chat_log_file.flush()
+        record = self.log_record(message_before, "edit")
+        record["after"] = message_after.content
+        self.write_chat(msg, record)
         return msg
 
     def chat_reaction_log(self, reaction,user):
@@ -158,10 +271,78 @@ class Logger:
             - str: The log message.
         """
         msg = f"{self.log_boilerplate(message, 'delete')} {message.content}"
-        self.chat_log_file.write(f"{msg}\n")
-        self.chat_log_file.flush()
+        self.write_chat(msg, self.log_record(message, "delete"))
+        return msg
+
+    def chat_raw_edit_log(self, payload, channel=None) -> Optional[str]:
+        """
+        Logs an edit from an on_raw_message_edit event. If the message was in discord.py's
+        message cache it is logged like chat_edit_log, otherwise only its new content is known.
+
+        Args:
+        ---
+            - payload (discord.RawMessageUpdateEvent): The event.
+            - channel (Optional[discord.abc.Messageable]): The channel, if it is cached.
+
+        Returns:
+        ---
+            - Optional[str]: The logged message, or None if the edit did not change the
+                    content (e.g. Discord adding a link preview).
+        """
+        content = payload.data.get("content")
+        if content is None:
+            return None
+        if payload.cached_message is not None:
+            return self.chat_edit_log(payload.cached_message, _Edited(content))
+        author = _raw_author(payload.data.get("author"))
+        channel_name = _channel_name(channel, payload.channel_id)
+        edited_at = payload.data.get("edited_timestamp") or datetime.now().isoformat()
+        msg = f"[EDIT][{edited_at}] [{author} -> {channel_name}]: (not cached) => {content}"
+        record = self._raw_record("edit", payload.message_id, payload.data.get("author"),
+                                  payload.channel_id, channel_name, None)
+        record["after"] = content
+        self.write_chat(msg, record)
+        return msg
+
+    def chat_raw_delete_log(self, payload, channel=None) -> str:
+        """
+        Logs a deletion from an on_raw_message_delete event. If the message was in
+        discord.py's message cache it is logged like chat_delete_log, otherwise only its
+        id is known.
+
+        Args:
+        ---
+            - payload (discord.RawMessageDeleteEvent): The event.
+            - channel (Optional[discord.abc.Messageable]): The channel, if it is cached.
+
+        Returns:
+        ---
+            - str: The logged message.
+        """
+        if payload.cached_message is not None:
+            return self.chat_delete_log(payload.cached_message)
+        channel_name = _channel_name(channel, payload.channel_id)
+        msg = f"[DELETE][{datetime.now().isoformat()}] [unknown -> {channel_name}]: (message {payload.message_id}, not cached)"  # pylint:disable=line-too-long
+        self.write_chat(
+            msg,
+            self._raw_record("delete", payload.message_id, None, payload.channel_id, channel_name, None),
+        )
         return msg
 
+    @staticmethod
+    def _raw_record(event, message_id, author, channel_id, channel_name, content) -> Dict[str, Any]:
+        return {
+            "event": event,
+            "ts": time.time(),
+            "created_at": None,
+            "message_id": message_id,
+            "author_id": int(author["id"]) if author and "id" in author else None,
+            "author": _raw_author(author) if author else None,
+            "channel_id": channel_id,
+            "channel": channel_name,
+            "content": content,
+        }
+
     def sys_log(self, message):
         """
         Logs system messages to a file and returns the logged message.
@@ -176,5 +357,23 @@ class Logger:
         """
         msg = f"[SYS][{self.current_time}]: {message}"
         self.sys_log_file.write(f"{msg}\n")
-        self.sys_log_file.flush()
         return msg
+
+
+class _Edited:
+    # the "after" side of an edit, when only the new content is known
+    __slots__ = ("content",)
+
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+
+def _raw_author(author: Optional[Dict[str, Any]]) -> str:
+    if not author:
+        return "unknown"
+    return f"{author.get('username', 'unknown')}#{author.get('discriminator', '0000')}"
+
+
+def _channel_name(channel, channel_id: int) -> str:
+    name = getattr(channel, "name", None)
+    return name if name is not None else f"#{channel_id}"
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+A command line tool that searches the structured (JSONL) chat log written by Logger
+when LOG_FORMAT is "jsonl" or "both".
+
+Only the segments whose time range overlaps the query are read, using the segment index
+written by RotatingLogFile. Uncompressed segments are memory-mapped and scanned for a
+byte pattern taken from the filters, so only candidate lines are decoded as JSON;
+compressed segments are streamed through the same prefilter.
+
+Usage:
+---
+    python logquery.py --event delete --author-id 1234 --channel general --since 7d
+    python logquery.py --contains "pizza" --since 2022-12-01 --until 2022-12-24 --count
+
+Methods:
+---
+    parse_time: Parses an absolute date or a relative age into epoch seconds.
+    select_segments: Returns the files of a log that may hold events in a time range.
+    query: Yields the records of a log matching the filters.
+"""
+import argparse
+import gzip
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from log_rotation import read_index
+
+try:
+    import zstandard
+except ImportError:  # only needed to read zstd-compressed segments
+    zstandard = None
+
+_AGE = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_time(value: str) -> float:
+    """
+    Parses an ISO date/time ("2022-12-24", "2022-12-24T18:00") or an age
+    relative to now ("90m", "12h", "7d", "2w") into epoch seconds.
+
+    Args:
+    ---
+        value (str): The time to parse.
+
+    Returns:
+    ---
+        float: The time in epoch seconds.
+    """
+    match = _AGE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _UNITS[match.group(2)]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def select_segments(path: str, since: Optional[float], until: Optional[float]) -> List[str]:
+    """
+    Returns the files of a log that may hold events between `since` and `until`, oldest first.
+
+    Args:
+    ---
+        path (str): The path of the active log file, e.g. "logs/chatlog.jsonl".
+        since (Optional[float]): The earliest time of interest, or None.
+        until (Optional[float]): The latest time of interest, or None.
+
+    Returns:
+    ---
+        List[str]: The paths of the rotated segments overlapping the range,
+        followed by the active file if it exists and may overlap it.
+    """
+    index = read_index(path)
+    directory = os.path.dirname(path) or "."
+    files = []
+    for segment in index["segments"]:
+        if since is not None and segment["end"] < since:
+            continue
+        if until is not None and segment["start"] > until:
+            continue
+        files.append(os.path.join(directory, segment["file"]))
+    active_start = index.get("active_start")
+    if os.path.exists(path) and (until is None or active_start is None or active_start <= until):
+        files.append(path)
+    return files
+
+
+def _prefilter(filters: Dict[str, Any]) -> Optional["re.Pattern[bytes]"]:
+    # Logger writes records with separators=(",", ":"), so an exact field
+    # value always appears as this byte pattern in a matching line
+    for field in ("author_id", "channel_id", "event"):
+        value = filters.get(field)
+        if value is not None:
+            return re.compile(re.escape(f'"{field}":{json.dumps(value)}'.encode("utf-8")))
+    if filters.get("contains"):
+        # json escapes non-ascii and quotes, so only plain text makes a safe pattern;
+        # _matches compares case-insensitively, so the pattern ignores case too
+        needle = filters["contains"]
+        if needle.isascii() and json.dumps(needle)[1:-1] == needle:
+            return re.compile(re.escape(needle.encode("utf-8")), re.IGNORECASE)
+    return None
+
+
+def _mapped_lines(path: str, needle: Optional["re.Pattern[bytes]"]) -> Iterator[bytes]:
+    with open(path, "rb") as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if needle is None:
+                yield from iter(mapped.readline, b"")
+                return
+            match = needle.search(mapped)
+            while match is not None:
+                position = match.start()
+                start = mapped.rfind(b"\n", 0, position) + 1
+                end = mapped.find(b"\n", position)
+                end = len(mapped) if end == -1 else end
+                yield mapped[start:end]
+                match = needle.search(mapped, end)
+
+
+def _stream_lines(path: str, needle: Optional["re.Pattern[bytes]"]) -> Iterator[bytes]:
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise SystemExit(f'{path} is zstd-compressed; install "zstandard" to read it')
+        opener = lambda: zstandard.open(path, "rb")  # pylint:disable=unnecessary-lambda-assignment
+    else:
+        opener = lambda: gzip.open(path, "rb")  # pylint:disable=unnecessary-lambda-assignment
+    with opener() as log_file:
+        for line in log_file:
+            if needle is None or needle.search(line):
+                yield line
+
+
+def _matches(record: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    if filters.get("since") is not None and record["ts"] < filters["since"]:
+        return False
+    if filters.get("until") is not None and record["ts"] > filters["until"]:
+        return False
+    for field in ("event", "author_id", "channel_id"):
+        if filters.get(field) is not None and record.get(field) != filters[field]:
+            return False
+    if filters.get("author") and not (record.get("author") or "").lower().startswith(
+        filters["author"].lower()
+    ):
+        return False
+    if filters.get("channel") and (record.get("channel") or "").lower() != filters["channel"].lower():
+        return False
+    if filters.get("contains"):
+        text = f"{record.get('content') or ''}\n{record.get('after') or ''}".lower()
+        if filters["contains"].lower() not in text:
+            return False
+    return True
+
+
+def query(path: str, **filters: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the records of a JSONL log matching every given filter, oldest first.
+
+    Args:
+    ---
+        path (str): The path of the active log file, e.g. "logs/chatlog.jsonl".
+        **filters: Any of
+            - event (str): The event type, e.g. "chat", "edit" or "delete".
+            - author_id (int) / channel_id (int): Exact ids.
+            - author (str): The start of the author's "name#discriminator", case-insensitive.
+            - channel (str): The channel name, case-insensitive.
+            - contains (str): Text the content must contain, case-insensitive.
+            - since (float) / until (float): The time range, in epoch seconds.
+
+    Yields:
+    ---
+        Dict[str, Any]: The matching records.
+    """
+    needle = _prefilter(filters)
+    for segment in select_segments(path, filters.get("since"), filters.get("until")):
+        if segment.endswith((".gz", ".zst")):
+            lines = _stream_lines(segment, needle)
+        else:
+            lines = _mapped_lines(segment, needle)
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if _matches(record, filters):
+                yield record
+
+
+def format_record(record: Dict[str, Any]) -> str:
+    """
+    Formats a record like the text chat log does.
+
+    Args:
+    ---
+        record (Dict[str, Any]): The record to format.
+
+    Returns:
+    ---
+        str: The formatted record.
+    """
+    when = datetime.fromtimestamp(record["ts"]).strftime("%Y/%m/%d %H:%M:%S")
+    line = f"[{record['event'].upper()}][{when}] [{record['author']} -> {record['channel']}]: {record['content']}"  # pylint:disable=line-too-long
+    if "after" in record:
+        line += f" => {record['after']}"
+    return line
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Parses the command line and prints the matching records.
+    """
+    parser = argparse.ArgumentParser(description="Search the structured chat log.")
+    parser.add_argument("--log", default="logs/chatlog.jsonl", help="the active JSONL log file")
+    parser.add_argument("--event", help="chat, edit or delete")
+    parser.add_argument("--author-id", type=int)
+    parser.add_argument("--author", help="start of the author's name#discriminator")
+    parser.add_argument("--channel-id", type=int)
+    parser.add_argument("--channel", help="channel name")
+    parser.add_argument("--contains", help="text the message contains")
+    parser.add_argument("--since", type=parse_time, help="date/time or age such as 7d")
+    parser.add_argument("--until", type=parse_time, help="date/time or age such as 1h")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON records")
+    parser.add_argument("--count", action="store_true", help="only print the number of matches")
+    args = parser.parse_args(argv)
+
+    records = query(
+        args.log,
+        event=args.event.lower() if args.event else None,
+        author_id=args.author_id,
+        author=args.author,
+        channel_id=args.channel_id,
+        channel=args.channel,
+        contains=args.contains,
+        since=args.since,
+        until=args.until,
+    )
+    if args.count:
+        print(sum(1 for _ in records))
+        return
+    for record in records:
+        if args.json:
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            sys.stdout.write(format_record(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
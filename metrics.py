@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains a small, dependency-free metrics layer: counters, gauges and
+histograms that are cheap enough to update on every event, and an HTTP server
+exposing them at /metrics in the Prometheus text format.
+
+Attributes:
+---
+    REGISTRY: The registry every metric of the bot is registered in.
+    DEFAULT_BUCKETS: The default histogram buckets, in seconds.
+    COMMAND_LATENCY / COMMAND_ERRORS / COMMAND_IN_FLIGHT: Per-command metrics.
+    UPSTREAM_LATENCY / UPSTREAM_ERRORS / UPSTREAM_IN_FLIGHT: Per-upstream metrics.
+
+Methods:
+---
+    Counter.inc: Adds to a counter.
+    Gauge.set / Gauge.inc / Gauge.dec: Sets or moves a gauge.
+    Histogram.observe: Records a value in a histogram.
+    CallbackGauge: A gauge whose values are read from a function at scrape time.
+    MetricsRegistry.render: Renders every metric in the Prometheus text format.
+    MetricsServer.start / MetricsServer.stop: Serves /metrics (and /health) over HTTP.
+    track_command / track_upstream: Times a command or an upstream call in a `with` block.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    The base of every metric: a name, a help text and the names of its labels.
+
+    Label values are passed positionally, in the order of `labelnames`, to every update
+    method, and each distinct combination of values is its own series. Updates take a
+    lock, so metrics can also be updated from the blocking thread pool.
+
+    Attributes:
+    ---
+        - name (str): The name of the metric.
+        - documentation (str): The help text of the metric.
+        - labelnames (Tuple[str, ...]): The names of the metric's labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[str]:
+        """
+        Yields the metric's samples in the Prometheus text format.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        Renders the metric with its HELP and TYPE lines.
+
+        Returns:
+        ---
+            str: The metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, such as the number of errors.
+
+    Methods:
+    ---
+        - inc(self, *labels, amount) -> None: Adds to the counter.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+        Adds to the counter.
+
+        Args:
+        ---
+            - *labels (str): The label values.
+            - amount (float): The amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        """
+        Returns the counter's current value for the given label values.
+        """
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, such as the number of requests in flight.
+
+    Methods:
+    ---
+        - set(self, value, *labels) -> None: Sets the gauge.
+        - inc(self, *labels, amount) -> None: Raises the gauge.
+        - dec(self, *labels, amount) -> None: Lowers the gauge.
+        - track_inprogress(self, *labels) -> ContextManager: Raises the gauge while
+                the block runs.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        """
+        Sets the gauge.
+
+        Args:
+        ---
+            - value (float): The new value.
+            - *labels (str): The label values.
+        """
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        """
+        Lowers the gauge.
+
+        Args:
+        ---
+            - *labels (str): The label values.
+            - amount (float): The amount to subtract. Defaults to 1.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    @contextmanager
+    def track_inprogress(self, *labels: str) -> Iterator[None]:
+        """
+        Raises the gauge by one while the block runs.
+        """
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    """
+    A distribution of values, such as latencies, counted in fixed buckets.
+
+    Methods:
+    ---
+        - observe(self, value, *labels) -> None: Records a value.
+        - time(self, *labels) -> ContextManager: Records how long the block took, in seconds.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per series: a count per bucket (plus +Inf), then the sum
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        Records a value.
+
+        Args:
+        ---
+            - value (float): The value, e.g. a latency in seconds.
+            - *labels (str): The label values.
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """
+        Records how long the block took, in seconds, even if it raised.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}"
+
+
+class CallbackGauge(Metric):
+    """
+    A gauge whose values are read from a function when the metrics are scraped, used to
+    expose counters that other classes already keep (cache hits, queue depths, ...).
+
+    The function returns a mapping from a tuple of label values to a value.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[Labels, float]],
+        kind: str = "gauge",
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.callback().items():
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {value}"
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics that can be rendered together.
+
+    Methods:
+    ---
+        - counter / gauge / histogram / callback(...) -> Metric: Creates and registers a metric.
+        - stats(self, name, documentation, label, sources, key, kind) -> CallbackGauge:
+                Exposes one value of several stats() methods as a metric.
+        - register(self, metric) -> Metric: Registers a metric.
+        - render(self) -> str: Renders every metric in the Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registers a metric, replacing any metric of the same name.
+
+        Args:
+        ---
+            - metric (Metric): The metric.
+
+        Returns:
+        ---
+            Metric: The metric.
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Creates and registers a Counter.
+        """
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Creates and registers a Gauge.
+        """
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Creates and registers a Histogram.
+        """
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[Labels, float]],
+        kind: str = "gauge",
+    ) -> CallbackGauge:
+        """
+        Creates and registers a CallbackGauge.
+        """
+        return self.register(CallbackGauge(name, documentation, labelnames, callback, kind))
+
+    def stats(
+        self,
+        name: str,
+        documentation: str,
+        label: str,
+        sources: Union[
+            Dict[str, Callable[[], Dict[str, float]]],
+            Callable[[], Dict[str, Callable[[], Dict[str, float]]]],
+        ],
+        key: str,
+        kind: str = "gauge",
+    ) -> CallbackGauge:
+        """
+        Creates and registers a CallbackGauge reading one value out of several `stats()`
+        methods, e.g. the "hits" of every cache, labelled by the source's name.
+
+        Args:
+        ---
+            - name (str): The name of the metric.
+            - documentation (str): The help text of the metric.
+            - label (str): The name of the label holding the source's name.
+            - sources (Dict[str, Callable[[], Dict[str, float]]]): The stats() method of
+                    every source, by name, or a function returning them when the sources
+                    change at runtime.
+            - key (str): The value to read from each stats() result.
+            - kind (str): "gauge", or "counter" if the value only goes up.
+
+        Returns:
+        ---
+            CallbackGauge: The metric.
+        """
+
+        def read() -> Dict[Labels, float]:
+            current = sources() if callable(sources) else sources
+            values = {}
+            for source, stats in current.items():
+                result = stats()
+                if key in result:  # sources without the value are left out
+                    values[(source,)] = result[key]
+            return values
+
+        return self.callback(name, documentation, (label,), read, kind)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text format.
+
+        Returns:
+        ---
+            str: The metrics, ready to serve at /metrics.
+        """
+        return "\n".join(metric.render() for metric in list(self._metrics.values())) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+COMMAND_LATENCY = REGISTRY.histogram(
+    "tr4shbot_command_duration_seconds", "Time taken to handle a command.", ("command",)
+)
+COMMAND_ERRORS = REGISTRY.counter(
+    "tr4shbot_command_errors_total", "Commands whose handler raised.", ("command", "error")
+)
+COMMAND_IN_FLIGHT = REGISTRY.gauge(
+    "tr4shbot_command_in_flight", "Commands currently being handled.", ("command",)
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "tr4shbot_upstream_duration_seconds", "Time taken by calls to upstream APIs.", ("upstream",)
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "tr4shbot_upstream_errors_total", "Failed calls to upstream APIs.", ("upstream", "error")
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "tr4shbot_upstream_in_flight", "Calls to upstream APIs currently in flight.", ("upstream",)
+)
+
+
+class _Tracker:
+    # a plain class rather than @contextmanager: entering and leaving it is a few
+    # dict updates, cheap enough to wrap every command and upstream call
+    __slots__ = ("latency", "errors", "in_flight", "label", "start")
+
+    def __init__(self, latency: Histogram, errors: Counter, in_flight: Gauge, label: str) -> None:
+        self.latency = latency
+        self.errors = errors
+        self.in_flight = in_flight
+        self.label = label
+        self.start = 0.0
+
+    def __enter__(self) -> "_Tracker":
+        self.in_flight.inc(self.label)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self.latency.observe(time.perf_counter() - self.start, self.label)
+        self.in_flight.dec(self.label)
+        if exc_type is not None:
+            self.errors.inc(self.label, exc_type.__name__)
+        return False
+
+
+def track_command(name: str) -> _Tracker:
+    """
+    Records the latency, errors and in-flight count of a command handled in a `with` block.
+
+    Args:
+    ---
+        - name (str): The name of the command.
+
+    Returns:
+    ---
+        ContextManager: The context manager to wrap the handler in.
+    """
+    return _Tracker(COMMAND_LATENCY, COMMAND_ERRORS, COMMAND_IN_FLIGHT, name)
+
+
+def track_upstream(name: str) -> _Tracker:
+    """
+    Records the latency, errors and in-flight count of an upstream call made in a `with` block.
+
+    Args:
+    ---
+        - name (str): The name of the upstream, e.g. "openweathermap".
+
+    Returns:
+    ---
+        ContextManager: The context manager to wrap the call in.
+    """
+    return _Tracker(UPSTREAM_LATENCY, UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, name)
+
+
+class MetricsServer:
+    """
+    A small HTTP server exposing a registry at /metrics and, if `health` is given, a health
+    check at /health answering 200 when healthy and 503 otherwise, with a JSON report.
+
+    Attributes:
+    ---
+        - registry (MetricsRegistry): The registry to expose.
+        - host (str): The address to listen on.
+        - port (int): The port to listen on.
+        - health (Optional[Callable[[], Tuple[bool, Dict]]]): Returns whether the bot is
+                healthy, and the report to serve.
+
+    Methods:
+    ---
+        - start(self) -> None: Starts serving.
+        - stop(self) -> None: Stops serving.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        health: Optional[Callable[[], Tuple[bool, Dict]]] = None,
+    ) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.health = health
+        self._runner = None
+
+    async def start(self) -> None:
+        """
+        Starts serving /metrics and /health. Must be called from the event loop.
+        """
+        from aiohttp import web  # pylint:disable=import-outside-toplevel
+
+        async def handle_metrics(request):  # pylint:disable=unused-argument
+            return web.Response(
+                text=self.registry.render(), content_type="text/plain", charset="utf-8"
+            )
+
+        async def handle_health(request):  # pylint:disable=unused-argument
+            healthy, report = self.health()
+            return web.json_response(report, status=200 if healthy else 503)
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        if self.health is not None:
+            app.router.add_get("/health", handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        """
+        Stops serving.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
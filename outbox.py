@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the Outbox class, which every reply goes through on its way to Discord.
+
+Replies are queued per channel and sent by one worker per channel, so replies to the same
+channel no longer race each other into Discord's per-channel rate limit. Short replies that
+pile up in a channel are merged into one message (unless the sender opts out), and channels
+share the sending slots fairly.
+
+Attributes:
+---
+    MAX_MESSAGE_LENGTH: The longest message Discord accepts.
+    MERGE_MAX_LENGTH: The longest reply that is merged with others by default.
+
+Methods:
+---
+    Outbox.send: Queues a reply and waits until it has been delivered.
+    Outbox.close: Delivers every queued reply and stops the workers.
+    Outbox.stats: Returns queue depth, delivery counters and queue latency percentiles.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+MAX_MESSAGE_LENGTH = 2000
+MERGE_MAX_LENGTH = 300
+
+Transport = Callable[[Any, str], Awaitable[Any]]
+
+
+async def discord_transport(channel, content: str) -> Any:
+    """
+    Sends a message with discord.py.
+
+    Args:
+    ---
+        - channel (discord.abc.Messageable): The channel to send to.
+        - content (str): The message.
+
+    Returns:
+    ---
+        discord.Message: The sent message.
+    """
+    return await channel.send(content)
+
+
+class _Reply:
+    __slots__ = ("content", "future", "enqueued_at", "merge")
+
+    def __init__(self, content: str, future: asyncio.Future, merge: bool) -> None:
+        self.content = content
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.merge = merge
+
+
+class _Channel:
+    __slots__ = ("channel", "queue", "worker", "sent_at", "blocked_until")
+
+    def __init__(self, channel) -> None:
+        self.channel = channel
+        self.queue: Deque[_Reply] = deque()
+        self.worker: Optional[asyncio.Task] = None
+        self.sent_at: Deque[float] = deque()
+        self.blocked_until = 0.0
+
+    def idle(self, now: float, period: float) -> bool:
+        # nothing queued, and neither the pacing window nor a 429 pause still applies
+        return (
+            not self.queue
+            and (self.worker is None or self.worker.done())
+            and self.blocked_until <= now
+            and (not self.sent_at or self.sent_at[-1] <= now - period)
+        )
+
+
+class Outbox:
+    """
+    A scheduler for outgoing messages with per-channel queues.
+
+    Each channel with queued replies has a worker task that sends them in order. Before each
+    send the worker takes the queued replies that can be merged, and joins them with newlines
+    into one message of at most MAX_MESSAGE_LENGTH characters. Only short replies (at most
+    `merge_max_length` characters) sent with `merge=True` are merged; longer replies, and
+    replies that must stand alone such as busy replies or announcements, are sent on their own. Sends are paced to
+    `channel_rate` messages per `channel_period` seconds per channel, and when Discord answers
+    with a 429 the channel is paused for the `retry_after` it gave. At most `max_concurrent`
+    sends run at once; the slots are handed out in the order channels asked for them, and a
+    channel only ever holds one, so a busy channel can't starve a quiet one. A channel's
+    pacing and 429 pause outlive its queue: its state is only evicted, lazily from `send`,
+    once its pacing window and any pause have passed.
+
+    The transport is the coroutine that actually sends a message, so a fake can be
+    passed in to test or benchmark the outbox without Discord.
+
+    Attributes:
+    ---
+        - transport (Transport): The coroutine sending a message to a channel.
+        - channel_rate (int): The number of messages sent per channel per period.
+        - channel_period (float): The pacing period, in seconds.
+        - max_concurrent (int): The number of sends in flight across all channels.
+        - merge_max_length (int): The longest reply that may be merged with others.
+        - sent (int): The number of messages sent.
+        - merged (int): The number of replies that were merged into another message.
+        - rate_limited (int): The number of 429 answers received.
+        - failed (int): The number of messages that could not be sent.
+
+    Methods:
+    ---
+        - send(self, channel, content, merge) -> None: Queues a reply and waits until
+                it has been delivered.
+        - close(self) -> None: Waits for every queued reply to be delivered.
+        - stats(self) -> Dict[str, float]: Returns the outbox's counters.
+    """
+
+    def __init__(
+        self,
+        transport: Transport = discord_transport,
+        channel_rate: int = 5,
+        channel_period: float = 5.0,
+        max_concurrent: int = 10,
+        latency_samples: int = 1024,
+        merge_max_length: int = MERGE_MAX_LENGTH,
+    ) -> None:
+        self.transport = transport
+        self.channel_rate = channel_rate
+        self.channel_period = channel_period
+        self.max_concurrent = max_concurrent
+        self.merge_max_length = merge_max_length
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self._latencies: Deque[float] = deque(maxlen=latency_samples)
+        self._channels: Dict[int, _Channel] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._swept_at = 0.0
+
+    async def send(self, channel, content: str, merge: bool = True) -> None:
+        """
+        Queues a reply to a channel and waits until it has been delivered.
+
+        Args:
+        ---
+            - channel (discord.abc.Messageable): The channel to send to.
+            - content (str): The reply.
+            - merge (bool): Whether the reply may be merged with other queued replies, if
+                    it is no longer than `merge_max_length`. Defaults to True.
+
+        Raises:
+        ---
+            Exception: What the transport raised if the reply could not be sent.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._sweep()
+        state = self._channels.get(channel.id)
+        if state is None:
+            state = self._channels[channel.id] = _Channel(channel)
+        merge = merge and len(content) <= self.merge_max_length
+        reply = _Reply(content, asyncio.get_running_loop().create_future(), merge)
+        state.queue.append(reply)
+        if state.worker is None or state.worker.done():
+            state.worker = asyncio.create_task(self._drain(state))
+        await asyncio.shield(reply.future)
+
+    def _take(self, state: _Channel) -> List[_Reply]:
+        batch = [state.queue.popleft()]
+        if not batch[0].merge:
+            return batch
+        length = len(batch[0].content)
+        while state.queue and state.queue[0].merge:
+            extra = len(state.queue[0].content) + 1
+            if length + extra > MAX_MESSAGE_LENGTH:
+                break
+            length += extra
+            batch.append(state.queue.popleft())
+        return batch
+
+    async def _wait_for_pacing(self, state: _Channel) -> None:
+        while True:
+            now = time.monotonic()
+            while state.sent_at and state.sent_at[0] <= now - self.channel_period:
+                state.sent_at.popleft()
+            wait = state.blocked_until - now
+            if len(state.sent_at) >= self.channel_rate:
+                wait = max(wait, state.sent_at[0] + self.channel_period - now)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _drain(self, state: _Channel) -> None:
+        while state.queue:
+            await self._wait_for_pacing(state)
+            async with self._slots:
+                batch = self._take(state)
+                content = "\n".join(reply.content for reply in batch)
+                try:
+                    await self.transport(state.channel, content)
+                except Exception as error:  # pylint:disable=broad-except
+                    retry_after = self._retry_after(error)
+                    if retry_after is not None:
+                        # put the batch back and pause the channel as long as Discord asked
+                        self.rate_limited += 1
+                        state.blocked_until = time.monotonic() + retry_after
+                        state.queue.extendleft(reversed(batch))
+                        continue
+                    self.failed += 1
+                    for reply in batch:
+                        if not reply.future.done():
+                            reply.future.set_exception(error)
+                    continue
+            now = time.monotonic()
+            state.sent_at.append(now)
+            self.sent += 1
+            self.merged += len(batch) - 1
+            for reply in batch:
+                self._latencies.append(now - reply.enqueued_at)
+                if not reply.future.done():
+                    reply.future.set_result(None)
+
+    def _sweep(self) -> None:
+        # at most once per pacing period, so sending stays O(1) on average
+        now = time.monotonic()
+        if now - self._swept_at < self.channel_period:
+            return
+        self._swept_at = now
+        for channel_id in [
+            channel_id for channel_id, state in self._channels.items()
+            if state.idle(now, self.channel_period)
+        ]:
+            del self._channels[channel_id]
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        # discord.RateLimited carries retry_after; a plain HTTPException with status 429
+        # carries the decoded response body, which has it too
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is None and getattr(error, "status", None) == 429:
+            body = getattr(error, "text", None)
+            retry_after = body.get("retry_after", 1.0) if isinstance(body, dict) else 1.0
+        return retry_after
+
+    async def close(self) -> None:
+        """
+        Waits for every queued reply to be delivered.
+        """
+        workers = [state.worker for state in self._channels.values() if state.worker is not None]
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the outbox's counters and queue latency percentiles.
+
+        Returns:
+        ---
+            Dict[str, float]: The number of queued replies and of channels with a queue, the
+            sent, merged, rate-limited and failed counters, and the 50th and 99th percentile
+            of the time replies spent between `send` and delivery, in seconds.
+        """
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            "queued": sum(len(state.queue) for state in self._channels.values()),
+            "channels": sum(1 for state in self._channels.values() if state.queue),
+            "sent": self.sent,
+            "merged": self.merged,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "latency_p50": percentile(0.50),
+            "latency_p99": percentile(0.99),
+        }
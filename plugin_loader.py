@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the plugin system: the Plugin class a command module declares its
+commands with, and the PluginManager class, which loads the plugins, registers their commands
+and hot-reloads a plugin when its file changes, without the bot reconnecting to Discord.
+
+A plugin is a module defining a module-level `plugin`:
+
+    plugin = Plugin("weather_file")
+
+    @plugin.command(["!w", "!weather"], usage="[city]", help="Get weather information for a city")
+    async def weather(message, tokens):
+        return "It's sunny"
+
+A command handler returns its reply, which the command executor sends. Objects that should
+survive a reload (pools, caches, background tasks) are kept with `plugin.state`, and cleaned
+up by the coroutines registered with `plugin.on_close`.
+
+Attributes:
+---
+    BUILTIN_PLUGINS: The top-level modules loaded as plugins.
+    PLUGINS_PACKAGE: The package every other plugin is discovered in.
+
+Methods:
+---
+    Plugin.command: Decorator declaring a command.
+    Plugin.state: Returns an object kept across reloads, built on first use.
+    Plugin.cache: Exports the stats() of a cache in the metrics.
+    Plugin.on_close: Decorator registering a cleanup coroutine.
+    PluginManager.load_all: Loads every plugin.
+    PluginManager.reload: Reloads a plugin from its file.
+    PluginManager.watch: Reloads plugins whose files change, until cancelled.
+"""
+import asyncio
+import importlib
+import importlib.util
+import os
+import pkgutil
+import sys
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from command_registry import Command, CommandRegistry, Handler, make_command
+from lazy_loader import Lazy
+
+BUILTIN_PLUGINS = ("animal_fact", "weather_file", "giphy")
+PLUGINS_PACKAGE = "plugins"
+
+Stats = Callable[[], Dict[str, float]]
+
+# the state of plugins being reloaded, by plugin name, picked up by the new Plugin
+_carried: Dict[str, "_PluginState"] = {}
+
+
+class _PluginState:
+    __slots__ = ("version", "values", "caches")
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.values: Dict[str, Lazy] = {}
+        self.caches: Dict[str, Stats] = {}
+
+
+class Plugin:
+    """
+    The commands and state of one plugin module.
+
+    When the module is reloaded a new Plugin is created by the new code. If both the old and
+    the new Plugin have `keep_state` set and the same `state_version`, the new one takes over
+    the old one's state, so pools and caches survive the reload; bump `state_version` when
+    the objects kept in the state change shape.
+
+    Attributes:
+    ---
+        - name (str): The name of the plugin.
+        - description (str): What the plugin does.
+        - keep_state (bool): Whether the state is kept across reloads.
+        - state_version (int): The version of the state's layout.
+        - commands (List[Command]): The commands the plugin declares.
+
+    Methods:
+    ---
+        - command(self, aliases, ...) -> Callable: Decorator declaring a command.
+        - state(self, key, factory) -> Lazy: Returns an object kept across reloads.
+        - cache(self, name, stats) -> None: Exports a cache's stats() in the metrics.
+        - caches(self) -> Dict[str, Stats]: Returns the exported caches.
+        - on_close(self, hook) -> Callable: Decorator registering a cleanup coroutine.
+        - close(self) -> None: Runs the cleanup coroutines.
+    """
+
+    def __init__(
+        self, name: str, description: str = "", keep_state: bool = True, state_version: int = 1
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.keep_state = keep_state
+        self.state_version = state_version
+        self.commands: List[Command] = []
+        self._close_hooks: List[Callable[[], Awaitable[Any]]] = []
+        carried = _carried.pop(name, None)
+        if carried is not None and keep_state and carried.version == state_version:
+            self._state = carried
+        else:
+            self._state = _PluginState(state_version)
+
+    def command(  # pylint:disable=too-many-arguments
+        self,
+        aliases: Iterable[str],
+        exact: bool = False,
+        blocking: bool = False,
+        concurrency: Optional[int] = None,
+        queue: int = 0,
+        help: Optional[str] = None,  # pylint:disable=redefined-builtin
+        usage: str = "",
+        help_aliases: Optional[int] = None,
+    ) -> Callable[[Handler], Handler]:
+        """
+        Declares the decorated function as a command of the plugin. It is registered when
+        the plugin is loaded. Takes the same arguments as CommandRegistry.command.
+
+        Returns:
+        ---
+            Callable: A decorator that returns the handler unchanged.
+        """
+        aliases = list(aliases)
+
+        def decorator(handler: Handler) -> Handler:
+            self.commands.append(
+                make_command(
+                    handler, aliases, exact, blocking, concurrency, queue, help, usage, help_aliases
+                )
+            )
+            return handler
+
+        return decorator
+
+    def state(self, key: str, factory: Callable[[], Any]) -> Lazy:
+        """
+        Returns an object of the plugin's state, built by `factory` on first use and kept
+        across reloads.
+
+        Args:
+        ---
+            - key (str): The name of the object in the state.
+            - factory (Callable[[], Any]): Builds the object.
+
+        Returns:
+        ---
+            Lazy: The object, built by its `get` method.
+        """
+        value = self._state.values.get(key)
+        if value is None:
+            value = self._state.values[key] = Lazy(factory)
+        return value
+
+    def cache(self, name: str, stats: Stats) -> None:
+        """
+        Exports a cache's hits, misses and entries in the metrics.
+
+        Args:
+        ---
+            - name (str): The name of the cache in the metrics.
+            - stats (Stats): The cache's stats() method.
+        """
+        self._state.caches[name] = stats
+
+    def caches(self) -> Dict[str, Stats]:
+        """
+        Returns the caches exported by the plugin.
+
+        Returns:
+        ---
+            Dict[str, Stats]: The stats() method of every cache, by name.
+        """
+        return dict(self._state.caches)
+
+    def on_close(self, hook: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        """
+        Registers a coroutine function run when the plugin is unloaded, when the bot shuts
+        down, or when a reload discards the plugin's state.
+
+        Args:
+        ---
+            hook (Callable[[], Awaitable[Any]]): The cleanup coroutine function.
+
+        Returns:
+        ---
+            Callable: The hook, unchanged.
+        """
+        self._close_hooks.append(hook)
+        return hook
+
+    async def close(self) -> None:
+        """
+        Runs the cleanup coroutines, in the order they were registered.
+        """
+        for hook in self._close_hooks:
+            await hook()
+
+    def shares_state(self, other: "Plugin") -> bool:
+        """
+        Whether the plugin took over the state of another.
+        """
+        return self._state is other._state  # pylint:disable=protected-access
+
+
+class _Loaded:
+    __slots__ = ("module_name", "module", "plugin", "mtime")
+
+    def __init__(self, module_name: str, module: ModuleType, plugin: Plugin) -> None:
+        self.module_name = module_name
+        self.module = module
+        self.plugin = plugin
+        self.mtime = _mtime(module)
+
+
+def _mtime(module: ModuleType) -> Optional[float]:
+    try:
+        return os.path.getmtime(module.__file__)
+    except (OSError, TypeError):
+        return None
+
+
+class PluginManager:
+    """
+    Loads plugins, registers their commands and reloads them when their files change.
+
+    The built-in plugins are loaded first, in order, then every module of the plugins
+    package. A reload executes the changed file as a fresh module: if that fails, the old
+    module and its commands stay in place. Otherwise the old commands are replaced by the
+    new ones, in the same place in the help text.
+
+    Attributes:
+    ---
+        - registry (CommandRegistry): The registry the commands are registered in.
+        - builtins (Iterable[str]): The top-level modules loaded as plugins.
+        - package (Optional[str]): The package plugins are discovered in.
+        - log (Callable[[str], Any]): Called with a line about every load, reload and failure.
+
+    Methods:
+    ---
+        - load_all(self) -> None: Loads every plugin not loaded yet.
+        - load(self, module_name) -> Plugin: Loads a plugin.
+        - reload(self, name) -> bool: Reloads a plugin from its file.
+        - unload(self, name) -> None: Removes a plugin and its commands.
+        - check(self) -> List[str]: Reloads the plugins whose files changed.
+        - watch(self, interval) -> None: Runs check every `interval` seconds.
+        - caches(self) -> Dict[str, Stats]: Returns the caches of every plugin.
+        - plugins(self) -> List[Plugin]: Returns the loaded plugins.
+        - close(self) -> None: Runs the cleanup coroutines of every plugin.
+    """
+
+    def __init__(
+        self,
+        registry: CommandRegistry,
+        builtins: Iterable[str] = BUILTIN_PLUGINS,
+        package: Optional[str] = PLUGINS_PACKAGE,
+        log: Callable[[str], Any] = print,
+    ) -> None:
+        self.registry = registry
+        self.builtins = tuple(builtins)
+        self.package = package
+        self.log = log
+        self._loaded: Dict[str, _Loaded] = {}
+
+    def discover(self) -> List[str]:
+        """
+        Returns the module names of every plugin: the built-in ones, then the modules of the
+        plugins package whose names don't start with "_".
+
+        Returns:
+        ---
+            List[str]: The module names.
+        """
+        names = list(self.builtins)
+        if self.package is not None:
+            try:
+                package = importlib.import_module(self.package)
+            except ImportError:
+                return names
+            names.extend(
+                f"{self.package}.{info.name}"
+                for info in sorted(pkgutil.iter_modules(package.__path__), key=lambda i: i.name)
+                if not info.name.startswith("_")
+            )
+        return names
+
+    def load_all(self) -> None:
+        """
+        Loads every discovered plugin that is not loaded yet. A plugin that fails to load is
+        logged and skipped.
+        """
+        loaded = {entry.module_name for entry in self._loaded.values()}
+        for module_name in self.discover():
+            if module_name in loaded:
+                continue
+            try:
+                self.load(module_name)
+            except Exception as error:  # pylint:disable=broad-except
+                self.log(f"Plugin {module_name} failed to load: {error!r}")
+
+    def load(self, module_name: str) -> Plugin:
+        """
+        Imports a plugin module and registers its commands.
+
+        Args:
+        ---
+            module_name (str): The name of the module, e.g. "weather_file".
+
+        Returns:
+        ---
+            Plugin: The plugin.
+
+        Raises:
+        ---
+            TypeError: If the module does not define a plugin.
+            ValueError: If one of its aliases is already registered.
+        """
+        module = importlib.import_module(module_name)
+        plugin = self._plugin_of(module)
+        self._register(plugin.commands)
+        self._loaded[plugin.name] = _Loaded(module_name, module, plugin)
+        self.log(f"Loaded plugin {plugin.name} ({len(plugin.commands)} commands)")
+        return plugin
+
+    async def reload(self, name: str) -> bool:
+        """
+        Reloads a plugin from its file, keeping its state if the plugin allows it.
+
+        Args:
+        ---
+            name (str): The name of the plugin.
+
+        Returns:
+        ---
+            bool: True if the plugin was reloaded, False if the new code failed to load and
+            the old code was kept.
+        """
+        old = self._loaded[name]
+        if old.plugin.keep_state:
+            _carried[name] = old.plugin._state  # pylint:disable=protected-access
+        try:
+            module = self._exec_fresh(old.module_name)
+            plugin = self._plugin_of(module)
+            if plugin.name != name:
+                raise TypeError(f"{old.module_name} renamed its plugin to {plugin.name}")
+        except Exception as error:  # pylint:disable=broad-except
+            old.mtime = _mtime(old.module)  # don't retry until the file changes again
+            self.log(f"Plugin {name} failed to reload, keeping the old version: {error!r}")
+            return False
+        finally:
+            _carried.pop(name, None)
+        positions = [self.registry.unregister(cmd.name) for cmd in old.plugin.commands]
+        position = min((p for p in positions if p is not None), default=None)
+        try:
+            self._register(plugin.commands, position)
+        except ValueError as error:
+            self._register(old.plugin.commands, position)
+            old.mtime = _mtime(old.module)
+            self.log(f"Plugin {name} failed to reload, keeping the old version: {error!r}")
+            return False
+        sys.modules[old.module_name] = module
+        parent, _, child = old.module_name.rpartition(".")
+        if parent and parent in sys.modules:
+            setattr(sys.modules[parent], child, module)
+        self._loaded[name] = _Loaded(old.module_name, module, plugin)
+        kept = plugin.shares_state(old.plugin)
+        if not kept:
+            await old.plugin.close()
+        self.log(f"Reloaded plugin {name} ({'state kept' if kept else 'state reset'})")
+        return True
+
+    async def unload(self, name: str) -> None:
+        """
+        Removes a plugin's commands and runs its cleanup coroutines.
+
+        Args:
+        ---
+            name (str): The name of the plugin.
+        """
+        entry = self._loaded.pop(name)
+        for cmd in entry.plugin.commands:
+            self.registry.unregister(cmd.name)
+        await entry.plugin.close()
+        self.log(f"Unloaded plugin {name}")
+
+    async def check(self) -> List[str]:
+        """
+        Reloads the plugins whose files changed, unloads those whose files are gone and
+        loads new modules of the plugins package.
+
+        Returns:
+        ---
+            List[str]: The names of the plugins reloaded.
+        """
+        reloaded = []
+        for name, entry in list(self._loaded.items()):
+            mtime = _mtime(entry.module)
+            if mtime is None:
+                await self.unload(name)
+            elif mtime != entry.mtime and await self.reload(name):
+                reloaded.append(name)
+        self.load_all()
+        return reloaded
+
+    async def watch(self, interval: float) -> None:
+        """
+        Checks the plugin files for changes every `interval` seconds, until cancelled.
+
+        Args:
+        ---
+            interval (float): The number of seconds between checks.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as error:  # pylint:disable=broad-except
+                self.log(f"Plugin check failed: {error!r}")
+
+    def caches(self) -> Dict[str, Stats]:
+        """
+        Returns the caches exported by every plugin.
+
+        Returns:
+        ---
+            Dict[str, Stats]: The stats() method of every cache, by name.
+        """
+        caches: Dict[str, Stats] = {}
+        for entry in self._loaded.values():
+            caches.update(entry.plugin.caches())
+        return caches
+
+    def plugins(self) -> List[Plugin]:
+        """
+        Returns the loaded plugins, in the order they were loaded.
+
+        Returns:
+        ---
+            List[Plugin]: The plugins.
+        """
+        return [entry.plugin for entry in self._loaded.values()]
+
+    async def close(self) -> None:
+        """
+        Runs the cleanup coroutines of every plugin.
+        """
+        for entry in self._loaded.values():
+            await entry.plugin.close()
+
+    def _register(self, commands: List[Command], position: Optional[int] = None) -> None:
+        registered: List[Command] = []
+        try:
+            for offset, cmd in enumerate(commands):
+                self.registry.register(cmd, None if position is None else position + offset)
+                registered.append(cmd)
+        except ValueError:
+            for cmd in registered:
+                self.registry.unregister(cmd.name)
+            raise
+
+    @staticmethod
+    def _plugin_of(module: ModuleType) -> Plugin:
+        plugin = getattr(module, "plugin", None)
+        if not isinstance(plugin, Plugin):
+            raise TypeError(f"{module.__name__} does not define a plugin")
+        return plugin
+
+    @staticmethod
+    def _exec_fresh(module_name: str) -> ModuleType:
+        # the new code runs in a new module object, so a failure leaves the old one untouched
+        importlib.invalidate_caches()
+        spec = importlib.util.find_spec(module_name)
+        if spec is None or spec.loader is None:
+            raise ImportError(f"{module_name} can not be found")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
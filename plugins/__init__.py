@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Plugins dropped into this package are discovered and loaded by the PluginManager in
+plugin_loader, after the built-in plugins. Modules whose names start with "_" are skipped.
+
+A plugin module defines a module-level `plugin = Plugin("<name>")` and declares its
+commands with `@plugin.command(...)`. Saving a change to the file reloads the plugin
+while the bot keeps running.
+"""
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the rate limiters checked before a command runs, so one user or one
+channel can't make the bot hammer the paid upstream APIs.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    TokenBucket.check: Returns when a key may next be let through, without charging it.
+    CommandRateLimiter.allow: Charges a command to its user and channel, if both have tokens left.
+    CommandRateLimiter.stats: Returns the number of keys tracked and calls denied.
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Token buckets for any number of keys, each holding `capacity` tokens refilled at
+    `capacity` per `period` seconds.
+
+    Rather than a token count and a timestamp, each key stores one float: the time at which
+    its bucket will be full again (the "generic cell rate algorithm" form of a token bucket).
+    A call is let through if taking a token would not push that time more than `period`
+    into the future. A key whose time has passed has a full bucket, which is the same as
+    having no entry, so expired keys are simply dropped by `sweep`, and a dict of
+    int ids to floats stays small even with hundreds of thousands of users.
+
+    Attributes:
+    ---
+        - capacity (int): The number of calls allowed in a burst.
+        - period (float): The number of seconds it takes to refill an empty bucket.
+
+    Methods:
+    ---
+        - check(self, key, now) -> Optional[float]: Returns the key's new full-time if a
+                token can be taken, or None.
+        - commit(self, key, full_at) -> None: Takes the token checked for.
+        - sweep(self, now) -> int: Drops every key whose bucket is full.
+    """
+
+    __slots__ = ("capacity", "period", "_interval", "_full_at")
+
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self.period = period
+        self._interval = period / capacity
+        self._full_at: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+    def check(self, key: int, now: float) -> Optional[float]:
+        """
+        Checks whether a token can be taken for a key, without taking it.
+
+        Args:
+        ---
+            - key (int): The key, e.g. a user id.
+            - now (float): The current monotonic time.
+
+        Returns:
+        ---
+            Optional[float]: The time the key's bucket will be full once the token is taken,
+            to pass to `commit`, or None if the bucket is empty.
+        """
+        full_at = max(self._full_at.get(key, now), now) + self._interval
+        if full_at - now > self.period:
+            return None
+        return full_at
+
+    def commit(self, key: int, full_at: float) -> None:
+        """
+        Takes the token `check` said was available.
+
+        Args:
+        ---
+            - key (int): The key passed to `check`.
+            - full_at (float): The time returned by `check`.
+        """
+        self._full_at[key] = full_at
+
+    def sweep(self, now: float) -> int:
+        """
+        Drops every key whose bucket has refilled completely.
+
+        Args:
+        ---
+            - now (float): The current monotonic time.
+
+        Returns:
+        ---
+            int: The number of keys dropped.
+        """
+        expired = [key for key, full_at in self._full_at.items() if full_at <= now]
+        for key in expired:
+            del self._full_at[key]
+        return len(expired)
+
+
+Limit = Tuple[int, float]
+
+
+class CommandRateLimiter:
+    """
+    Rate limits commands per (user, command) and per (channel, command).
+
+    Each command can have a user limit and a channel limit, both given as
+    (calls, period in seconds). A call is only let through, and only charged, if both
+    the user's and the channel's bucket for that command have a token left. Commands
+    without limits are always let through.
+
+    Attributes:
+    ---
+        - sweep_interval (float): How often, in seconds, full buckets are dropped.
+        - denied (Dict[Tuple[str, str], int]): Calls denied, by (command, "user" or "channel").
+
+    Methods:
+    ---
+        - allow(self, command, user_id, channel_id) -> bool: Charges a call, if allowed.
+        - stats(self) -> Dict[str, int]: Returns the keys tracked and calls denied.
+    """
+
+    def __init__(
+        self, limits: Dict[str, Dict[str, Limit]], sweep_interval: float = 60.0
+    ) -> None:
+        """
+        Args:
+        ---
+            - limits (Dict[str, Dict[str, Limit]]): For every limited command, its "user"
+                    and/or "channel" limit as (calls, period in seconds),
+                    e.g. {"weather": {"user": (3, 60), "channel": (10, 60)}}.
+            - sweep_interval (float): How often, in seconds, full buckets are dropped.
+        """
+        self.sweep_interval = sweep_interval
+        self.denied: Dict[Tuple[str, str], int] = {}
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {
+            command: (
+                TokenBucket(*scopes["user"]) if "user" in scopes else None,
+                TokenBucket(*scopes["channel"]) if "channel" in scopes else None,
+            )
+            for command, scopes in limits.items()
+        }
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def allow(self, command: str, user_id: int, channel_id: int) -> bool:
+        """
+        Charges a call of a command to its user and channel, if both have a token left.
+
+        Args:
+        ---
+            - command (str): The name of the command.
+            - user_id (int): The id of the user calling it.
+            - channel_id (int): The id of the channel it was called in.
+
+        Returns:
+        ---
+            bool: True if the call is allowed, False if it should be dropped.
+        """
+        buckets = self._buckets.get(command)
+        if buckets is None:
+            return True
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        user_bucket, channel_bucket = buckets
+        user_full_at = channel_full_at = None
+        if user_bucket is not None:
+            user_full_at = user_bucket.check(user_id, now)
+            if user_full_at is None:
+                self._deny(command, "user")
+                return False
+        if channel_bucket is not None:
+            channel_full_at = channel_bucket.check(channel_id, now)
+            if channel_full_at is None:
+                self._deny(command, "channel")
+                return False
+        if user_full_at is not None:
+            user_bucket.commit(user_id, user_full_at)
+        if channel_full_at is not None:
+            channel_bucket.commit(channel_id, channel_full_at)
+        return True
+
+    def _deny(self, command: str, scope: str) -> None:
+        key = (command, scope)
+        self.denied[key] = self.denied.get(key, 0) + 1
+
+    def _sweep(self, now: float) -> None:
+        for buckets in self._buckets.values():
+            for bucket in buckets:
+                if bucket is not None:
+                    bucket.sweep(now)
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the limiter's counters.
+
+        Returns:
+        ---
+            Dict[str, int]: The number of keys tracked and the total number of denied calls.
+        """
+        return {
+            "keys": sum(
+                len(bucket)
+                for buckets in self._buckets.values()
+                for bucket in buckets
+                if bucket is not None
+            ),
+            "denied": sum(self.denied.values()),
+        }
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the ShardHealth class, which follows the gateway events of every
+shard (connect, ready, disconnect, resume) so the health of each shard can be exported
+as metrics and served at /health.
+
+Attributes:
+---
+    None
+
+Methods:
+---
+    ShardHealth.connected / ready / disconnected / resumed: Record a shard's events.
+    ShardHealth.snapshot: Returns the state of every shard.
+    ShardHealth.healthy: Whether every shard is up.
+"""
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Shard:
+    __slots__ = ("up", "since", "connects", "disconnects", "resumes")
+
+    def __init__(self) -> None:
+        self.up = False
+        self.since = time.monotonic()
+        self.connects = 0
+        self.disconnects = 0
+        self.resumes = 0
+
+
+class ShardHealth:
+    """
+    The state of every shard of the gateway connection.
+
+    A shard is up from its ready (or resumed) event until it disconnects. Latencies are read
+    from the client when a snapshot is taken, and a shard counts as unhealthy when it has
+    been down longer than `grace` seconds or its heartbeat latency is over `max_latency`.
+
+    Attributes:
+    ---
+        - latencies (Callable[[], Dict[int, float]]): Returns the heartbeat latency of every
+                shard, in seconds.
+        - guild_counts (Callable[[], Dict[int, int]]): Returns the number of guilds of every shard.
+        - grace (float): How long, in seconds, a shard may be down (e.g. reconnecting)
+                before it is reported unhealthy.
+        - max_latency (float): The heartbeat latency, in seconds, above which a shard
+                is reported unhealthy.
+
+    Methods:
+    ---
+        - connected(self, shard_id) -> None: Records a shard connecting.
+        - ready(self, shard_id) -> None: Records a shard being ready.
+        - disconnected(self, shard_id) -> None: Records a shard disconnecting.
+        - resumed(self, shard_id) -> None: Records a shard resuming its session.
+        - snapshot(self) -> Dict[int, Dict[str, Any]]: Returns the state of every shard.
+        - healthy(self) -> Tuple[bool, Dict[str, Any]]: Whether every shard is healthy,
+                and the report /health serves.
+    """
+
+    def __init__(
+        self,
+        latencies: Optional[Callable[[], Dict[int, float]]] = None,
+        guild_counts: Optional[Callable[[], Dict[int, int]]] = None,
+        grace: float = 60.0,
+        max_latency: float = 10.0,
+    ) -> None:
+        self.latencies = latencies or dict
+        self.guild_counts = guild_counts or dict
+        self.grace = grace
+        self.max_latency = max_latency
+        self._shards: Dict[int, _Shard] = {}
+
+    def _shard(self, shard_id: Optional[int]) -> _Shard:
+        shard_id = shard_id or 0
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            shard = self._shards[shard_id] = _Shard()
+        return shard
+
+    def connected(self, shard_id: Optional[int]) -> None:
+        """
+        Records a shard connecting to the gateway. It is up once it is ready.
+        """
+        self._shard(shard_id).connects += 1
+
+    def ready(self, shard_id: Optional[int]) -> None:
+        """
+        Records a shard being ready.
+        """
+        self._set_up(self._shard(shard_id), True)
+
+    def disconnected(self, shard_id: Optional[int]) -> None:
+        """
+        Records a shard disconnecting from the gateway.
+        """
+        shard = self._shard(shard_id)
+        shard.disconnects += 1
+        self._set_up(shard, False)
+
+    def resumed(self, shard_id: Optional[int]) -> None:
+        """
+        Records a shard resuming its session after a disconnect.
+        """
+        shard = self._shard(shard_id)
+        shard.resumes += 1
+        self._set_up(shard, True)
+
+    @staticmethod
+    def _set_up(shard: _Shard, up: bool) -> None:
+        if shard.up != up:
+            shard.up = up
+            shard.since = time.monotonic()
+
+    def snapshot(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Returns the state of every shard.
+
+        Returns:
+        ---
+            Dict[int, Dict[str, Any]]: For every shard id: whether it is up, for how many
+            seconds it has been in that state, its connects, disconnects and resumes,
+            its heartbeat latency in seconds (None before the first heartbeat) and its
+            number of guilds.
+        """
+        now = time.monotonic()
+        latencies = self.latencies()
+        guilds = self.guild_counts()
+        report = {}
+        for shard_id, shard in sorted(self._shards.items()):
+            latency = latencies.get(shard_id)
+            report[shard_id] = {
+                "up": shard.up,
+                "for_seconds": round(now - shard.since, 3),
+                "connects": shard.connects,
+                "disconnects": shard.disconnects,
+                "resumes": shard.resumes,
+                # discord.py reports inf until the first heartbeat is acknowledged
+                "latency": latency if latency is not None and latency != float("inf") else None,
+                "guilds": guilds.get(shard_id, 0),
+            }
+        return report
+
+    def healthy(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Whether every shard is healthy: up, or down for less than `grace` seconds, and with
+        a heartbeat latency under `max_latency`. Before any shard has connected the bot is
+        reported unhealthy.
+
+        Returns:
+        ---
+            Tuple[bool, Dict[str, Any]]: Whether every shard is healthy, and a report with
+            the state of every shard.
+        """
+        shards = self.snapshot()
+        ok = bool(shards)
+        for state in shards.values():
+            state["healthy"] = (state["up"] or state["for_seconds"] < self.grace) and (
+                state["latency"] is None or state["latency"] <= self.max_latency
+            )
+            ok = ok and state["healthy"]
+        return ok, {"healthy": ok, "shards": {str(k): v for k, v in shards.items()}}
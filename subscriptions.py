@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+This module contains the weather subscriptions: users ask for the weather of a city to be
+posted every day at a given time (`!weather subscribe esbjerg 07:30`), instead of typing
+`!weather esbjerg` every morning.
+
+The subscriptions are kept in SQLite by the SubscriptionStore. The SubscriptionScheduler
+keeps a heap with one entry per time of day that has subscribers, sleeps until the
+earliest one, and then handles every subscription due within `window` seconds at once:
+they are grouped by location, the weather of each location is fetched once, and each
+channel gets one message mentioning all of its subscribers to that location.
+
+Attributes:
+---
+    SUBSCRIPTION_TIMEZONE: The time zone subscription times are in, read from the
+        environment variable of the same name. Defaults to "Europe/Copenhagen".
+    MAX_SUBSCRIPTIONS: The number of subscriptions a user can have.
+    weather_subscriptions: The SubscriptionStore shared by the whole bot.
+    subscription_scheduler: The SubscriptionScheduler posting the subscriptions.
+
+Methods:
+---
+    parse_time: Parses a time of day such as "7:30" into minutes after midnight.
+    SubscriptionStore.add / remove / for_user / due: Manage the subscriptions.
+    SubscriptionScheduler.run: Posts the subscriptions as they come due, until cancelled.
+"""
+import asyncio
+import heapq
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from command_executor import run_blocking
+from geocache import normalize_city
+from helper import get_lat_long
+from metrics import REGISTRY
+from outbox import MAX_MESSAGE_LENGTH
+
+SUBSCRIPTION_TIMEZONE = os.getenv("SUBSCRIPTION_TIMEZONE", "Europe/Copenhagen")
+MAX_SUBSCRIPTIONS = 5
+
+_TIME = re.compile(r"(\d{1,2})(?:[:.](\d{2}))?")
+
+
+def parse_time(text: str) -> Optional[int]:
+    """
+    Parses a time of day written as "7", "07:30" or "7.30".
+
+    Args:
+    ---
+        text (str): The time of day, on a 24-hour clock.
+
+    Returns:
+    ---
+        Optional[int]: The number of minutes after midnight, or None if it is not a time.
+    """
+    match = _TIME.fullmatch(text.strip())
+    if match is None:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2) or 0)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def format_time(minute: int) -> str:
+    """
+    Formats minutes after midnight as "HH:MM".
+    """
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class Subscription(NamedTuple):
+    """
+    A daily weather subscription.
+
+    Attributes:
+    ---
+        - user_id (int): The Discord ID of the subscriber.
+        - channel_id (int): The channel the weather is posted in.
+        - city (str): The city, as the user wrote it.
+        - minute (int): The time of day it is posted, in minutes after midnight.
+    """
+
+    user_id: int
+    channel_id: int
+    city: str
+    minute: int
+
+
+class SubscriptionStore:
+    """
+    The weather subscriptions, persisted to SQLite.
+
+    A user has at most one subscription per city and channel: subscribing again changes
+    its time. The SQLite file is opened on first use; the store is safe to use from
+    several threads.
+
+    Attributes:
+    ---
+        - path (Optional[str]): The path of the SQLite file, or None to keep it in memory.
+        - max_per_user (int): The number of subscriptions a user can have.
+
+    Methods:
+    ---
+        - add(self, user_id, channel_id, city, minute) -> bool: Adds or moves a subscription.
+        - remove(self, user_id, city) -> int: Removes a user's subscriptions.
+        - for_user(self, user_id) -> List[Subscription]: Returns a user's subscriptions.
+        - due(self, minutes) -> List[Subscription]: Returns the subscriptions due at some times.
+        - minutes(self) -> Set[int]: Returns every time of day with subscriptions.
+        - stats(self) -> Dict[str, int]: Returns the number of subscriptions.
+        - close(self) -> None: Closes the SQLite file.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_per_user: int = MAX_SUBSCRIPTIONS) -> None:
+        self.path = path
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path) if self.path else ""
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions (user_id INTEGER NOT NULL, "
+                "channel_id INTEGER NOT NULL, city TEXT NOT NULL, minute INTEGER NOT NULL, "
+                "PRIMARY KEY (user_id, channel_id, city))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS subscriptions_minute ON subscriptions (minute)")
+            self._db.commit()
+        return self._db
+
+    def add(self, user_id: int, channel_id: int, city: str, minute: int) -> bool:
+        """
+        Subscribes a user to the weather of a city, or changes the time of that subscription.
+
+        Args:
+        ---
+            - user_id (int): The Discord ID of the user.
+            - channel_id (int): The channel to post the weather in.
+            - city (str): The city.
+            - minute (int): The time of day, in minutes after midnight.
+
+        Returns:
+        ---
+            bool: False if the user already has `max_per_user` other subscriptions.
+        """
+        city = normalize_city(city)
+        with self._lock:
+            db = self._connection()
+            (count,) = db.execute(
+                "SELECT COUNT(*) FROM subscriptions WHERE user_id = ? AND NOT (channel_id = ? AND city = ?)",
+                (user_id, channel_id, city),
+            ).fetchone()
+            if count >= self.max_per_user:
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO subscriptions (user_id, channel_id, city, minute) VALUES (?, ?, ?, ?)",
+                (user_id, channel_id, city, minute),
+            )
+            db.commit()
+        return True
+
+    def remove(self, user_id: int, city: Optional[str] = None) -> int:
+        """
+        Removes a user's subscriptions to a city, or all of them.
+
+        Args:
+        ---
+            - user_id (int): The Discord ID of the user.
+            - city (Optional[str]): The city. Defaults to every city.
+
+        Returns:
+        ---
+            int: The number of subscriptions removed.
+        """
+        with self._lock:
+            db = self._connection()
+            if city is None:
+                cursor = db.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+            else:
+                cursor = db.execute(
+                    "DELETE FROM subscriptions WHERE user_id = ? AND city = ?",
+                    (user_id, normalize_city(city)),
+                )
+            db.commit()
+            return cursor.rowcount
+
+    def for_user(self, user_id: int) -> List[Subscription]:
+        """
+        Returns a user's subscriptions, earliest first.
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT user_id, channel_id, city, minute FROM subscriptions WHERE user_id = ? "
+                "ORDER BY minute, city",
+                (user_id,),
+            ).fetchall()
+        return [Subscription(*row) for row in rows]
+
+    def due(self, minutes: Iterable[int]) -> List[Subscription]:
+        """
+        Returns the subscriptions posted at any of the given times of day.
+
+        Args:
+        ---
+            minutes (Iterable[int]): The times of day, in minutes after midnight.
+
+        Returns:
+        ---
+            List[Subscription]: The subscriptions.
+        """
+        minutes = sorted(set(minutes))
+        if not minutes:
+            return []
+        marks = ",".join("?" * len(minutes))
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT user_id, channel_id, city, minute FROM subscriptions WHERE minute IN ({marks})",
+                minutes,
+            ).fetchall()
+        return [Subscription(*row) for row in rows]
+
+    def minutes(self) -> Set[int]:
+        """
+        Returns every time of day that has subscriptions.
+        """
+        with self._lock:
+            rows = self._connection().execute("SELECT DISTINCT minute FROM subscriptions").fetchall()
+        return {minute for (minute,) in rows}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of subscriptions, of subscribers and of cities.
+        """
+        with self._lock:
+            subscriptions, users, cities = self._connection().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id), COUNT(DISTINCT city) FROM subscriptions"
+            ).fetchone()
+        return {"subscriptions": subscriptions, "users": users, "cities": cities}
+
+    def close(self) -> None:
+        """
+        Closes the SQLite file.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+async def _locate(city: str) -> Hashable:
+    # the key subscriptions are grouped by: the coordinates rounded as in the weather cache,
+    # or the name itself if it can't be geocoded (so its error is rendered once too)
+    try:
+        lat, lon = await run_blocking(get_lat_long, city)
+    except Exception:  # pylint:disable=broad-except
+        return normalize_city(city)
+    return round(lat, 2), round(lon, 2)
+
+
+class SubscriptionScheduler:
+    """
+    Posts the weather subscriptions as they come due.
+
+    The heap holds one (due time, time of day) entry per time of day with subscribers,
+    so it stays small however many users subscribe. When the earliest entry is due, every
+    entry due within `window` seconds is taken too, and their subscriptions are handled
+    together: grouped by location, each location's weather is fetched once (at most
+    `concurrency` at a time) and posted once per channel, mentioning every subscriber of
+    that channel. Each time of day is then scheduled again for the next day; a time of
+    day subscribed to while it is being posted is scheduled for the next day too, so its
+    subscribers are not posted to twice.
+
+    Attributes:
+    ---
+        - store (SubscriptionStore): The subscriptions.
+        - window (float): Subscriptions due this many seconds after the earliest one are
+                posted with it.
+        - concurrency (int): The number of locations fetched at once.
+        - timezone (datetime.tzinfo): The time zone of the subscription times.
+        - runs (int): The number of times subscriptions were posted.
+        - fetches (int): The number of locations fetched.
+        - delivered (int): The number of subscriptions posted.
+        - messages (int): The number of messages sent.
+        - failed (int): The number of runs that failed.
+
+    Methods:
+    ---
+        - schedule(self, minute) -> None: Adds a time of day to the heap, if it is not in it.
+        - run(self, report, send) -> None: Posts the subscriptions as they come due.
+        - fire(self, minutes, report, send) -> None: Posts the subscriptions due at some times.
+        - stats(self) -> Dict[str, int]: Returns the scheduler's counters.
+    """
+
+    def __init__(
+        self,
+        store: SubscriptionStore,
+        window: float = 60.0,
+        concurrency: int = 4,
+        timezone: str = SUBSCRIPTION_TIMEZONE,
+        locate: Callable[[str], Awaitable[Hashable]] = _locate,
+    ) -> None:
+        self.store = store
+        self.window = window
+        self.concurrency = concurrency
+        try:
+            self.timezone = ZoneInfo(timezone)
+        except ZoneInfoNotFoundError:
+            self.timezone = ZoneInfo("UTC")
+        self.runs = 0
+        self.fetches = 0
+        self.delivered = 0
+        self.messages = 0
+        self.failed = 0
+        self._locate = locate
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Set[int] = set()
+        # time of day being posted -> the end of its run's window
+        self._firing: Dict[int, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+
+    def _next_due(self, minute: int, after: float) -> float:
+        day = datetime.fromtimestamp(after, self.timezone).date()
+        while True:
+            local = datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=self.timezone)
+            if local.timestamp() > after:
+                return local.timestamp()
+            day += timedelta(days=1)
+
+    def schedule(self, minute: int, after: Optional[float] = None) -> None:
+        """
+        Adds a time of day to the heap, unless it is already in it. A time of day that is
+        being posted is scheduled after its run, i.e. for the next day.
+
+        Args:
+        ---
+            - minute (int): The time of day, in minutes after midnight.
+            - after (Optional[float]): Schedule the first time after this timestamp.
+                    Defaults to now.
+        """
+        if minute in self._scheduled:
+            return
+        after = time.time() if after is None else after
+        # the run posting it already covers its due time today, even if that is still ahead
+        after = max(after, self._firing.get(minute, after))
+        self._scheduled.add(minute)
+        heapq.heappush(self._heap, (self._next_due(minute, after), minute))
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(
+        self,
+        report: Callable[[str], Awaitable[str]],
+        send: Callable[[int, str], Awaitable[None]],
+        log: Callable[[str], Any] = print,
+    ) -> None:
+        """
+        Posts the subscriptions as they come due, until cancelled.
+
+        A run that fails (e.g. the database can't be read) is logged and counted in
+        `failed`, and its times of day are scheduled for the next day as usual.
+
+        Args:
+        ---
+            - report (Callable[[str], Awaitable[str]]): Returns the weather report of a city.
+            - send (Callable[[int, str], Awaitable[None]]): Sends a message to a channel.
+            - log (Callable[[str], Any]): Called with a line about every failed run.
+        """
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                initial = await run_blocking(self.store.minutes)
+                break
+            except Exception as error:  # pylint:disable=broad-except
+                log(f"Weather subscriptions could not be read, retrying in a minute: {error!r}")
+                await asyncio.sleep(60)
+        for minute in initial:
+            self.schedule(minute)
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    # woken early when a new time of day is scheduled
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.time()
+            minutes = []
+            while self._heap and self._heap[0][0] <= now + self.window:
+                minutes.append(heapq.heappop(self._heap)[1])
+            self._scheduled.difference_update(minutes)
+            self._firing.update(dict.fromkeys(minutes, now + self.window))
+            times = ", ".join(format_time(minute) for minute in sorted(minutes))
+            try:
+                await self.fire(minutes, report, send)
+            except Exception as error:  # pylint:disable=broad-except
+                # a failed run must not stop the scheduler: the next days still get posted
+                self.failed += 1
+                log(f"Weather subscriptions at {times} failed: {error!r}")
+            try:
+                # the next day's run; times whose subscribers all left are dropped
+                remaining = await run_blocking(self.store.minutes)
+            except Exception as error:  # pylint:disable=broad-except
+                log(f"Weather subscriptions could not be read, keeping {times}: {error!r}")
+                remaining = set(minutes)
+            for minute in minutes:
+                self._firing.pop(minute, None)
+                if minute in remaining:
+                    self.schedule(minute, after=now + self.window)
+
+    async def fire(
+        self,
+        minutes: Iterable[int],
+        report: Callable[[str], Awaitable[str]],
+        send: Callable[[int, str], Awaitable[None]],
+    ) -> None:
+        """
+        Posts the subscriptions due at the given times of day: one fetch per location, and
+        one message per location and channel.
+
+        Args:
+        ---
+            - minutes (Iterable[int]): The times of day, in minutes after midnight.
+            - report (Callable[[str], Awaitable[str]]): Returns the weather report of a city.
+            - send (Callable[[int, str], Awaitable[None]]): Sends a message to a channel.
+        """
+        subscriptions = await run_blocking(self.store.due, minutes)
+        if not subscriptions:
+            return
+        self.runs += 1
+        cities = sorted({subscription.city for subscription in subscriptions})
+        keys = dict(zip(cities, await asyncio.gather(*(self._locate(city) for city in cities))))
+        # location -> channel -> subscribers, and the name the location is reported under
+        groups: Dict[Hashable, Dict[int, List[int]]] = defaultdict(lambda: defaultdict(list))
+        names: Dict[Hashable, str] = {}
+        for subscription in subscriptions:
+            key = keys[subscription.city]
+            names.setdefault(key, subscription.city)
+            groups[key][subscription.channel_id].append(subscription.user_id)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(key: Hashable) -> None:
+            async with semaphore:
+                self.fetches += 1
+                try:
+                    text = await report(names[key])
+                except Exception:  # pylint:disable=broad-except
+                    text = f"\nCould not get the weather for {names[key].title()} right now :(\n"
+            for channel_id, user_ids in groups[key].items():
+                mentions = " ".join(f"<@{user_id}>" for user_id in sorted(set(user_ids)))
+                try:
+                    await send(channel_id, f"{mentions} your daily weather:{text}"[:MAX_MESSAGE_LENGTH])
+                except Exception:  # pylint:disable=broad-except
+                    continue
+                self.messages += 1
+                self.delivered += len(user_ids)
+
+        await asyncio.gather(*(deliver(key) for key in groups))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the scheduler's counters and the number of times of day in the heap.
+        """
+        return {
+            "runs": self.runs,
+            "fetches": self.fetches,
+            "delivered": self.delivered,
+            "messages": self.messages,
+            "failed": self.failed,
+            "scheduled": len(self._heap),
+        }
+
+
+weather_subscriptions = SubscriptionStore(os.getenv("WEATHER_SUBSCRIPTIONS", "data/subscriptions.sqlite3"))
+subscription_scheduler = SubscriptionScheduler(
+    weather_subscriptions, window=float(os.getenv("SUBSCRIPTION_WINDOW", "60"))
+)
+
+REGISTRY.callback(
+    "tr4shbot_weather_subscriptions",
+    "Weather subscriptions, subscribers and subscribed cities.",
+    ("kind",),
+    lambda: {(key,): value for key, value in weather_subscriptions.stats().items()},
+)
+REGISTRY.callback(
+    "tr4shbot_subscription_events_total",
+    "Subscription runs, locations fetched, subscriptions delivered, messages sent and failed runs.",
+    ("event",),
+    lambda: {(key,): value for key, value in subscription_scheduler.stats().items() if key != "scheduled"},
+    "counter",
+)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Tests that the LatencyTracker's timeouts follow the latencies of answered requests, and
+don't grow while an upstream keeps timing out.
+"""
+import asyncio
+from adaptive_timeout import HedgeBudget, LatencyTracker
+from circuit_breaker import BreakerRegistry
+from http_pool import HttpClient
+
+
+def healthy_tracker() -> LatencyTracker:
+    tracker = LatencyTracker(window=50, min_samples=10, multiplier=3, min_timeout=0.01, max_timeout=10)
+    for _ in range(50):
+        tracker.record("upstream", 0.1)
+    return tracker
+
+
+def test_timeout_follows_the_p99_of_answered_requests():
+    tracker = LatencyTracker(window=50, min_samples=10, multiplier=3, min_timeout=0.01, max_timeout=10)
+    assert tracker.timeout("upstream", 1.0) == 1.0
+    for _ in range(50):
+        tracker.record("upstream", 0.1)
+    assert abs(tracker.timeout("upstream", 1.0) - 0.3) < 1e-9
+
+
+def test_timeout_does_not_grow_under_sustained_timeouts():
+    tracker = healthy_tracker()
+    # the breaker is kept closed so every request reaches the upstream and times out
+    client = HttpClient(breakers=BreakerRegistry(overrides={}, min_calls=10 ** 6),
+                        latencies=tracker, hedge_budget=HedgeBudget(ratio=0))
+    given = []
+
+    async def request(client_timeout):
+        given.append(client_timeout.total)
+        raise asyncio.TimeoutError
+
+    async def outage():
+        for _ in range(200):
+            try:
+                await client._send("http://upstream.test/", "upstream", request, None, False)  # pylint:disable=protected-access
+            except asyncio.TimeoutError:
+                pass
+
+    asyncio.run(outage())
+    assert max(given) - 0.3 < 1e-9
+    assert tracker.timeouts() == {"upstream": 200}
+    assert abs(tracker.timeout("upstream", 1.0) - 0.3) < 1e-9
+
+
+def test_timeout_grows_with_slower_answers():
+    tracker = healthy_tracker()
+    for _ in range(50):
+        tracker.record("upstream", 0.25)
+    # an upstream that got slower but still answers gets a longer timeout
+    assert abs(tracker.timeout("upstream", 1.0) - 0.75) < 1e-9
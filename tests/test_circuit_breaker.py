@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Tests the CircuitBreaker's closed, open and half-open transitions on a fake clock.
+"""
+import pytest
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def failing_breaker(clock: FakeClock) -> CircuitBreaker:
+    breaker = CircuitBreaker("upstream", failure_rate=0.5, min_calls=4, window=10.0, open_for=5.0, clock=clock)
+    for success in (True, False, False, False):
+        breaker.check()
+        breaker.record(success)
+    return breaker
+
+
+def test_opens_once_the_failure_rate_is_reached():
+    clock = FakeClock()
+    breaker = CircuitBreaker("upstream", failure_rate=0.5, min_calls=4, window=10.0, clock=clock)
+    for _ in range(3):
+        breaker.check()
+        breaker.record(False)
+    # fewer than min_calls calls: a quiet period's failures do not trip it
+    assert breaker.state() == CLOSED
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state() == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_old_failures_leave_the_window():
+    clock = FakeClock()
+    breaker = CircuitBreaker("upstream", failure_rate=0.5, min_calls=4, window=10.0, clock=clock)
+    for _ in range(3):
+        breaker.check()
+        breaker.record(False)
+    clock.now += 11
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state() == CLOSED
+
+
+def test_half_open_trial_success_closes():
+    clock = FakeClock()
+    breaker = failing_breaker(clock)
+    assert breaker.state() == OPEN
+    clock.now += 5
+    assert breaker.state() == HALF_OPEN
+    breaker.check()
+    # one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record(True)
+    assert breaker.state() == CLOSED
+    breaker.check()
+
+
+def test_half_open_trial_failure_reopens():
+    clock = FakeClock()
+    breaker = failing_breaker(clock)
+    clock.now += 5
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state() == OPEN
+    assert breaker.stats()["opened"] == 2
+    clock.now += 4.9
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert error.value.retry_in == pytest.approx(0.1)
+
+
+def test_cancelled_trial_gives_its_slot_back():
+    clock = FakeClock()
+    breaker = failing_breaker(clock)
+    clock.now += 5
+    with pytest.raises(KeyboardInterrupt):
+        with breaker.guard():
+            raise KeyboardInterrupt
+    assert breaker.state() == HALF_OPEN
+    breaker.check()
+
+
+def test_registry_applies_per_upstream_overrides():
+    registry = BreakerRegistry(
+        overrides={"quiet": {"min_calls": 2, "window": 5.0}},
+        failure_rate=0.5, min_calls=10, window=30.0, open_for=15.0,
+    )
+    assert registry.get("quiet").min_calls == 2
+    assert registry.get("quiet").window == 5.0
+    assert registry.get("busy").min_calls == 10
+    assert registry.get("quiet") is registry.get("quiet")
+
+
+def test_failures_in_a_row_open_a_breaker_diluted_by_old_successes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "upstream", failure_rate=0.5, min_calls=3, window=10.0, consecutive_failures=3, clock=clock
+    )
+    for _ in range(10):
+        breaker.check()
+        breaker.record(True)
+    for _ in range(2):
+        breaker.check()
+        breaker.record(False)
+    assert breaker.state() == CLOSED
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state() == OPEN
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Tests the Outbox's per-channel pacing and 429 pauses against a fake transport.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from outbox import Outbox
+
+
+class RateLimited(Exception):
+    """
+    Looks like discord.RateLimited to the outbox.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__("rate limited")
+        self.retry_after = retry_after
+
+
+class FakeTransport:
+    """
+    Records when each message was sent, raising the queued errors first.
+    """
+
+    def __init__(self) -> None:
+        self.sent = []
+        self.errors = []
+
+    async def __call__(self, channel, content: str) -> None:
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((time.monotonic(), channel.id, content))
+
+
+CHANNEL = SimpleNamespace(id=1)
+
+
+def test_pacing_holds_across_drains():
+    async def scenario():
+        transport = FakeTransport()
+        outbox = Outbox(transport, channel_rate=2, channel_period=0.3)
+        await outbox.send(CHANNEL, "one", merge=False)
+        await outbox.send(CHANNEL, "two", merge=False)
+        # the queue drained: the third message still has to wait for the window
+        await outbox.send(CHANNEL, "three", merge=False)
+        return transport.sent
+
+    sent = asyncio.run(scenario())
+    assert [content for _, _, content in sent] == ["one", "two", "three"]
+    assert sent[2][0] - sent[0][0] >= 0.29
+
+
+def test_rate_limit_pauses_the_channel():
+    async def scenario():
+        transport = FakeTransport()
+        outbox = Outbox(transport, channel_rate=100, channel_period=0.05)
+        transport.errors.append(RateLimited(0.3))
+        start = time.monotonic()
+        await outbox.send(CHANNEL, "first")
+        await outbox.send(CHANNEL, "second")
+        return start, transport.sent, outbox.rate_limited
+
+    start, sent, rate_limited = asyncio.run(scenario())
+    assert rate_limited == 1
+    assert sent[0][0] - start >= 0.29
+    assert [content for _, _, content in sent] == ["first", "second"]
+
+
+def test_idle_channels_are_evicted_once_their_window_passed():
+    async def scenario():
+        outbox = Outbox(FakeTransport(), channel_rate=5, channel_period=0.05)
+        await outbox.send(CHANNEL, "hello")
+        kept = CHANNEL.id in outbox._channels  # pylint:disable=protected-access
+        await asyncio.sleep(0.1)
+        await outbox.send(SimpleNamespace(id=2), "other channel")
+        return kept, CHANNEL.id in outbox._channels  # pylint:disable=protected-access
+
+    kept, still_there = asyncio.run(scenario())
+    assert kept
+    assert not still_there
+
+
+def test_short_replies_are_merged_and_long_ones_are_not():
+    async def scenario():
+        transport = FakeTransport()
+        outbox = Outbox(transport, merge_max_length=10)
+        await asyncio.gather(
+            outbox.send(CHANNEL, "a"), outbox.send(CHANNEL, "b"), outbox.send(CHANNEL, "x" * 20)
+        )
+        return [content for _, _, content in transport.sent]
+
+    assert asyncio.run(scenario()) == ["a\nb", "x" * 20]
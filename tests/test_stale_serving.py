@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Tests that the weather and gif commands answer with their expired cached results, instead
+of waiting out the request timeout, while the upstream hangs or its breaker is open.
+"""
+import asyncio
+import time
+from async_cache import AsyncTTLCache
+import weather_file
+from giphy import Giphy
+from weather_file import Weather
+
+WEATHER = {
+    "weather": [{"main": "Clouds"}],
+    "main": {"temp": 4.2, "feels_like": 1.3, "humidity": 87},
+    "wind": {"speed": 6.1},
+}
+GIFS = {"data": [{"url": "https://giphy.example/cat", "analytics": {"onsent": {"url": "https://giphy.example/onsent"}},
+                  "analytics_response_payload": "payload"}]}
+
+
+class StubTransport:
+    """
+    Stands in for HttpClient: answers at once while healthy, and hangs for `hang` seconds
+    (a request that will time out) once `down` is set.
+    """
+
+    def __init__(self, hang: float = 10.0) -> None:
+        self.down = False
+        self.breaker_open = False
+        self.hang = hang
+        self.calls = 0
+
+    def is_open(self, upstream: str) -> bool:  # pylint:disable=unused-argument
+        return self.breaker_open
+
+    async def get_json(self, url, params=None, timeout=None, upstream=None, hedge=False):  # pylint:disable=unused-argument,too-many-arguments
+        self.calls += 1
+        if self.down and "randomid" not in url:
+            await asyncio.sleep(self.hang)
+            raise asyncio.TimeoutError
+        if "randomid" in url:
+            return {"data": {"random_id": "test"}}
+        return GIFS if "/search" in url else WEATHER
+
+    async def get(self, url, params=None, timeout=None, upstream=None, hedge=False):  # pylint:disable=unused-argument,too-many-arguments
+        return 200
+
+
+def test_expired_value_served_after_the_deadline():
+    async def scenario():
+        cache = AsyncTTLCache(ttl=0.01, stale_ttl=60)
+
+        async def fetch_fresh():
+            return "fresh"
+
+        async def fetch_hung():
+            await asyncio.sleep(10)
+
+        await cache.get_or_stale("key", fetch_fresh)
+        await asyncio.sleep(0.02)
+        start = time.monotonic()
+        value, stale_for = await cache.get_or_stale("key", fetch_hung, stale_after=0.05)
+        return value, stale_for, time.monotonic() - start
+
+    value, stale_for, elapsed = asyncio.run(scenario())
+    assert value == "fresh"
+    assert stale_for is not None
+    assert elapsed < 0.5
+
+
+def test_weather_serves_stale_data_without_waiting_out_the_timeout(monkeypatch):
+    monkeypatch.setattr(weather_file, "get_lat_long", lambda city: (55.47, 8.45))
+    monkeypatch.setattr(weather_file, "WEATHER_STALE_AFTER", 0.05)
+
+    async def scenario():
+        transport = StubTransport()
+        place = Weather("esbjerg", client=transport, cache=AsyncTTLCache(ttl=0.01, stale_ttl=60))
+        await place.weather()
+        await asyncio.sleep(0.02)
+        transport.down = True
+        start = time.monotonic()
+        slow = await place.weather()
+        slow_elapsed = time.monotonic() - start
+        transport.breaker_open = True
+        start = time.monotonic()
+        open_reply = await place.weather()
+        return slow, slow_elapsed, open_reply, time.monotonic() - start
+
+    slow, slow_elapsed, open_reply, open_elapsed = asyncio.run(scenario())
+    assert "4°C" in slow and "OpenWeatherMap is unavailable" in slow
+    assert slow_elapsed < 0.5
+    assert "OpenWeatherMap is unavailable" in open_reply
+    assert open_elapsed < 0.05
+
+
+def test_gif_serves_stale_results_and_says_so():
+    async def scenario():
+        transport = StubTransport()
+        giphy = Giphy(client=transport, random_id_path=None, cache_ttl=0.01, stale_after=0.05)
+        fresh = await giphy.get_gif("cat")
+        await asyncio.sleep(0.02)
+        transport.down = True
+        start = time.monotonic()
+        stale = await giphy.get_gif("cat")
+        return fresh, stale, time.monotonic() - start
+
+    fresh, stale, elapsed = asyncio.run(scenario())
+    assert fresh == "https://giphy.example/cat"
+    assert stale.startswith("https://giphy.example/cat\n")
+    assert "unavailable" in stale
+    assert elapsed < 0.5
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Tests how the SubscriptionScheduler groups and posts the subscriptions, and that a time of
+day subscribed to while it is being posted is posted once.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+import subscriptions
+from subscriptions import SubscriptionScheduler, SubscriptionStore
+
+UTC = "UTC"
+# 07:30 UTC, the time of day most tests subscribe to
+MORNING = datetime(2026, 1, 5, 7, 30, tzinfo=timezone.utc).timestamp()
+DAY = 24 * 60 * 60
+
+
+class FakeClock:
+    """
+    A clock that starts just before a given time and runs at the pace of the real one.
+    """
+
+    def __init__(self, start: float) -> None:
+        self.offset = start - time.monotonic()
+
+    def time(self) -> float:
+        return time.monotonic() + self.offset
+
+
+async def locate(city):
+    # every spelling of a city is one location, as with the geocoded coordinates
+    return city.strip().lower()
+
+
+async def report(city):
+    return f"\nIn {city.title()}\n"
+
+
+def run_briefly(scheduler, report_, send):
+    async def main():
+        task = asyncio.ensure_future(scheduler.run(report_, send, log=lambda line: None))
+        await asyncio.sleep(0.5)
+        task.cancel()
+
+    asyncio.run(main())
+
+
+def test_fire_fetches_each_location_once_and_messages_each_channel_once():
+    store = SubscriptionStore(None)
+    store.add(1, 100, "esbjerg", 450)
+    store.add(2, 100, "Esbjerg", 450)
+    store.add(3, 200, "esbjerg", 451)
+    store.add(4, 100, "odense", 450)
+    store.add(5, 100, "aarhus", 600)
+    scheduler = SubscriptionScheduler(store, timezone=UTC, locate=locate)
+    fetched, sent = [], []
+
+    async def counting_report(city):
+        fetched.append(city)
+        return await report(city)
+
+    async def send(channel_id, content):
+        sent.append((channel_id, content))
+
+    asyncio.run(scheduler.fire([450, 451], counting_report, send))
+    assert sorted(fetched) == ["esbjerg", "odense"]
+    assert len(sent) == 3
+    assert (100, "<@1> <@2> your daily weather:\nIn Esbjerg\n") in sent
+    assert (200, "<@3> your daily weather:\nIn Esbjerg\n") in sent
+    assert scheduler.stats()["delivered"] == 4
+
+
+def test_run_posts_once_and_schedules_the_next_day(monkeypatch):
+    monkeypatch.setattr(subscriptions, "time", FakeClock(MORNING - 0.1))
+    store = SubscriptionStore(None)
+    store.add(1, 100, "esbjerg", 450)
+    store.add(2, 200, "odense", 451)
+    scheduler = SubscriptionScheduler(store, window=120, timezone=UTC, locate=locate)
+    sent = []
+
+    async def send(channel_id, content):
+        sent.append((channel_id, content))
+
+    run_briefly(scheduler, report, send)
+    # 07:31 is within the window of 07:30, so both are posted in one run
+    assert sorted(sent) == [(100, "<@1> your daily weather:\nIn Esbjerg\n"),
+                            (200, "<@2> your daily weather:\nIn Odense\n")]
+    assert scheduler.stats()["runs"] == 1
+    assert sorted(scheduler._heap) == [(MORNING + DAY, 450), (MORNING + DAY + 60, 451)]  # pylint:disable=protected-access
+
+
+def test_subscribing_while_the_time_is_posted_does_not_post_twice(monkeypatch):
+    monkeypatch.setattr(subscriptions, "time", FakeClock(MORNING - 0.1))
+    store = SubscriptionStore(None)
+    store.add(1, 100, "esbjerg", 450)
+    store.add(2, 200, "odense", 451)
+    scheduler = SubscriptionScheduler(store, window=120, timezone=UTC, locate=locate)
+    sent = []
+
+    async def subscribing_report(city):
+        # a third user subscribes to 07:31 while it is being posted, before it is due
+        if store.add(3, 300, "aarhus", 451):
+            scheduler.schedule(451)
+        return await report(city)
+
+    async def send(channel_id, content):
+        sent.append((channel_id, content))
+
+    run_briefly(scheduler, subscribing_report, send)
+    assert len(sent) == 2
+    # 07:31 is posted tomorrow, new subscriber included, and not again today
+    assert sorted(scheduler._heap) == [(MORNING + DAY, 450), (MORNING + DAY + 60, 451)]  # pylint:disable=protected-access
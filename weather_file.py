@@ -7,19 +7,69 @@ Attributes:
 ---
     city (str): The name of the city for which to retrieve weather data. Defaults to "esbjerg".
     api_key (str): The API key used to access the OpenWeatherMap API.
+    WEATHER_CACHE_TTL (float): The number of seconds current weather is cached for,
+        read from the environment variable of the same name. Defaults to 10 minutes.
+    WEATHER_STALE_TTL (float): How long, in seconds, expired weather is kept to be served
+        while OpenWeatherMap is unavailable. Defaults to 3 hours.
+    WEATHER_STALE_AFTER (float): How long, in seconds, a lookup waits for OpenWeatherMap
+        before serving the expired weather instead, if there is one. Defaults to half a second.
+    WEATHER_MAX_CITIES (int): The number of cities one command can ask about.
+    WEATHER_BATCH_CONCURRENCY (int): The number of cities of one command looked up at once,
+        read from the environment variable of the same name. Defaults to 4.
+    FORECAST_MAX_DAYS (int): The longest forecast, in days.
+    weather_cache (AsyncTTLCache): The cache of OpenWeatherMap responses,
+        keyed by coordinates rounded to two decimals. Kept across plugin reloads.
+    plugin (Plugin): The plugin declaring the weather command.
 
 Methods:
 ---
     weather: Retrieves and returns current weather data for the
     specified city as a formatted string.
+    parse_weather_args: Returns the cities and forecast range asked for in a command.
+    weather_report: Looks up the weather of several cities concurrently, in one reply.
+    subscription_command: Handles `!weather subscribe`, `unsubscribe` and `subscriptions`.
 """
+import asyncio
 import os
-import requests
+import re
+import shlex
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from helper import get_lat_long
+from http_pool import HttpClient, shared_client
+from async_cache import AsyncTTLCache
+from command_executor import run_blocking
+from command_aliases import Commands
+from plugin_loader import Plugin
+from guild_config import guild_configs
+from circuit_breaker import CircuitOpenError
+from outbox import MAX_MESSAGE_LENGTH
+from subscriptions import format_time, parse_time, subscription_scheduler, weather_subscriptions
 
 load_dotenv()
 
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "10800"))
+WEATHER_STALE_AFTER = float(os.getenv("WEATHER_STALE_AFTER", "0.5"))
+WEATHER_MAX_CITIES = 5
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "4"))
+# OpenWeatherMap's free forecast covers 5 days
+FORECAST_MAX_DAYS = 5
+FORECAST_RANGE = re.compile(r"(\d+)d(?:ays?)?")
+SUBSCRIPTION_COMMANDS = ("subscribe", "unsubscribe", "subscriptions")
+plugin = Plugin("weather_file", description="Current weather by city.")
+
+
+def _load_weather_cache() -> AsyncTTLCache:
+    cache = AsyncTTLCache(ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_STALE_TTL)
+    plugin.cache("weather", cache.stats)
+    return cache
+
+
+weather_cache = plugin.state("weather_cache", _load_weather_cache).get()
+
 
 class Weather:
     """
@@ -29,17 +79,68 @@ class Weather:
     ---
         city (str): The city for which to retrieve weather information.
         api_key (str): The API key for accessing OpenWeatherMap's API.
+        url (str): The URL of OpenWeatherMap's current weather API.
+        forecast_url (str): The URL of OpenWeatherMap's 5 day / 3 hour forecast API.
+        client (HttpClient): The HTTP client used to reach the API.
+        cache (AsyncTTLCache): The cache of OpenWeatherMap responses.
 
     Methods:
     ---
         weather: Returns a string containing weather information for the specified city.
+        forecast: Returns a string containing the forecast of the next days for the city.
     """
 
-    def __init__(self, city: str = "esbjerg") -> None:
+    def __init__(
+        self,
+        city: str = "esbjerg",
+        url: str = "https://api.openweathermap.org/data/2.5/weather",
+        client: HttpClient = shared_client,
+        cache: AsyncTTLCache = weather_cache,
+        forecast_url: str = "https://api.openweathermap.org/data/2.5/forecast",
+    ) -> None:
         self.city = city
         self.api_key = os.getenv("openWeather_API_KEY")
+        self.url = url
+        self.forecast_url = forecast_url
+        self.client = client
+        self.cache = cache
+
+    async def _fetch(self, url: str, kind: str) -> Tuple[Dict[str, Any], Optional[float]]:
+        # the gazetteer loads its dump on first use and geopy is blocking,
+        # so the geocoding runs on the shared thread pool
+        lat, lon = await run_blocking(get_lat_long, self.city)
+        # rounding to ~1 km lets nearby lookups share one cached response, and
+        # concurrent lookups of the same place share one request
+        lat, lon = round(lat, 2), round(lon, 2)
+        # expired weather is served at once while the breaker is open, and after a short
+        # deadline while OpenWeatherMap is slow, instead of waiting out its timeout
+        stale_after = 0.0 if self.client.is_open("openweathermap") else WEATHER_STALE_AFTER
+        return await self.cache.get_or_stale(
+            (lat, lon) if kind == "weather" else (kind, lat, lon),
+            lambda: self.client.get_json(
+                url,
+                params={"lat": lat, "lon": lon, "appid": self.api_key, "units": "metric"},
+                upstream="openweathermap",
+                hedge=True,
+            ),
+            stale_after=stale_after,
+        )
+
+    def _error(self, error: Exception) -> str:
+        if isinstance(error, CircuitOpenError):
+            return f"The weather service ({error.upstream}) is unavailable right now, please try again in {max(1, round(error.retry_in))} seconds :("  # pylint:disable=line-too-long
+        suggestions = getattr(error, "suggestions", None)
+        if suggestions:
+            return f'Im sorry. I could not find the city "{self.city}". Did you mean {" or ".join(suggestions)}?\nAdd the country to look further, e.g. "Ribe, Denmark"'  # pylint:disable=line-too-long
+        return f'Im sorry. I could not find the city "{self.city}"\nIf this is an bug, please contact **Tr4shL0rd#8279** or create a new issue on https://github.com/Tr4shL0rd/Tr4shBot/issues'  # pylint:disable=line-too-long
 
-    def weather(self):
+    def _stale_note(self, stale_for: Optional[float]) -> str:
+        if stale_for is None:
+            return ""
+        minutes = round((self.cache.ttl + stale_for) / 60)
+        return f"(OpenWeatherMap is unavailable, this is the weather from {minutes} minutes ago)\n"
+
+    async def weather(self):
         """
         Retrieves weather information for a given city.
 
@@ -52,24 +153,210 @@ class Weather:
                 - current temperature
                 - humidity
                 - wind speed.
-            If the city could not be found, returns an error message.
+            If the city could not be found, returns an error message, suggesting the
+            cities the user may have meant if the name looks misspelled.
+            If OpenWeatherMap is unavailable, the last weather fetched for the place is
+            returned with a note saying how old it is, or a short error if there is none.
         """
         celsius = "°"
         try:
-            lat, lon = get_lat_long(self.city)
-        except AttributeError:
-            return f'Im sorry. I could not find the city "{self.city}"\nIf this is an bug, please contact **Tr4shL0rd#8279** or create a new issue on https://github.com/Tr4shL0rd/Tr4shBot/issues'  # pylint:disable=line-too-long
-        resp = requests.get(
-            f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={self.api_key}&units=metric",  # pylint:disable=line-too-long
-            timeout=1,
-        ).json()  # pylint:disable=line-too-long
+            resp, stale_for = await self._fetch(self.url, "weather")
+        except (AttributeError, CircuitOpenError) as error:
+            return self._error(error)
         sky_desc = resp["weather"][0]["main"]
         actual_temp = int(resp["main"]["temp"])
         feels_like_temp = int(resp["main"]["feels_like"])
         humidity = resp["main"]["humidity"]
         wind_speeds = resp["wind"]["speed"]
+        stale_note = self._stale_note(stale_for)
         return f"""
 In {self.city.title()}
 it's currently {actual_temp}{celsius}C and feels like {feels_like_temp}{celsius}C.
 It's currently {sky_desc.lower()} outside right now, with a humidity of {humidity}% and the wind is blowing at speeds of {wind_speeds} m/s.
-"""
+{stale_note}"""
+
+    async def forecast(self, days: int):
+        """
+        Retrieves the forecast for a given city, one line per day.
+
+        Args:
+        ---
+            days (int): The number of days, today included, from 1 to FORECAST_MAX_DAYS.
+
+        Returns:
+        ---
+            str: The lowest and highest temperature and the most common sky of each day,
+            in the city's local time. Errors are reported as by `weather`.
+        """
+        try:
+            resp, stale_for = await self._fetch(self.forecast_url, "forecast")
+        except (AttributeError, CircuitOpenError) as error:
+            return self._error(error)
+        # the forecast comes in 3-hour steps, grouped here by the city's local date
+        offset = resp.get("city", {}).get("timezone", 0)
+        steps: Dict[date, List[Dict[str, Any]]] = {}
+        for step in resp["list"]:
+            day = datetime.fromtimestamp(step["dt"] + offset, tz=timezone.utc).date()
+            if day not in steps and len(steps) == days:
+                break
+            steps.setdefault(day, []).append(step)
+        lines = [f"\nForecast for {self.city.title()}:"]
+        for day, day_steps in steps.items():
+            low = min(step["main"]["temp_min"] for step in day_steps)
+            high = max(step["main"]["temp_max"] for step in day_steps)
+            sky = Counter(step["weather"][0]["main"] for step in day_steps).most_common(1)[0][0]
+            lines.append(f"{day:%a %d %b}: {int(low)}°C to {int(high)}°C, {sky.lower()}")
+        return "\n".join(lines) + "\n" + self._stale_note(stale_for)
+
+
+def _split_words(tokens: List[str]) -> List[str]:
+    lexer = shlex.shlex(" ".join(tokens), posix=True)
+    # only double quotes group words: "'s-hertogenbosch" keeps its apostrophe
+    lexer.quotes = '"'
+    lexer.whitespace_split = True
+    lexer.commenters = ""
+    try:
+        return list(lexer)
+    except ValueError:  # an unclosed quote
+        return " ".join(tokens).replace('"', " ").split()
+
+
+def parse_weather_args(tokens: List[str]) -> Tuple[List[str], Optional[int]]:
+    """
+    Parses the arguments of the weather command: cities separated by spaces, with names of
+    several words in double quotes, optionally followed by a forecast range such as "3d".
+
+    `!weather esbjerg "new york" 3d` asks for a 3-day forecast of Esbjerg and New York.
+
+    Args:
+    ---
+        tokens (List[str]): The words of the message, the command included.
+
+    Returns:
+    ---
+        Tuple[List[str], Optional[int]]: The cities, without duplicates and at most
+        WEATHER_MAX_CITIES of them, and the number of forecast days (None for the current
+        weather).
+    """
+    words = _split_words(tokens[1:])
+    days = None
+    match = FORECAST_RANGE.fullmatch(words[-1]) if words else None
+    if match:
+        words.pop()
+        days = min(max(int(match.group(1)), 1), FORECAST_MAX_DAYS)
+    cities = list(dict.fromkeys(word.strip() for word in words if word.strip()))
+    return cities[:WEATHER_MAX_CITIES], days
+
+
+async def weather_report(
+    cities: List[str],
+    days: Optional[int] = None,
+    concurrency: int = WEATHER_BATCH_CONCURRENCY,
+    **weather_options: Any,
+) -> str:
+    """
+    Looks up the weather (or forecast) of several cities at once and renders one reply.
+
+    The cities are geocoded and fetched concurrently, at most `concurrency` at a time, so
+    the reply takes about as long as the slowest city rather than the sum of all of them.
+    A city that fails is reported in its place without failing the others.
+
+    Args:
+    ---
+        - cities (List[str]): The cities.
+        - days (Optional[int]): The number of forecast days, or None for the current weather.
+        - concurrency (int): The number of cities looked up at once.
+        - **weather_options: Passed on to Weather, e.g. the client or the cache.
+
+    Returns:
+    ---
+        str: The reports of the cities, in the order they were asked for.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def report(city: str) -> str:
+        async with semaphore:
+            place = Weather(city=city, **weather_options)
+            return await (place.forecast(days) if days else place.weather())
+
+    results = await asyncio.gather(*(report(city) for city in cities), return_exceptions=True)
+    replies = [
+        f"\nCould not get the weather for {city.title()} right now :(\n"
+        if isinstance(result, Exception) else result
+        for city, result in zip(cities, results)
+    ]
+    if len(replies) == 1 and isinstance(results[0], Exception):
+        raise results[0]
+    return "".join(replies)[:MAX_MESSAGE_LENGTH]
+
+
+async def subscription_command(message, tokens: List[str]) -> str:
+    """
+    Handles the subscription subcommands of the weather command:
+
+    - `!weather subscribe <city> <HH:MM>` posts the weather of the city in this channel
+      every day at that time, or moves the time of an existing subscription.
+    - `!weather unsubscribe [city]` stops the subscriptions to the city, or all of them.
+    - `!weather subscriptions` lists the user's subscriptions.
+
+    Args:
+    ---
+        - message (discord.Message): The message with the command.
+        - tokens (List[str]): The words of the message, the command included.
+
+    Returns:
+    ---
+        str: The reply.
+    """
+    action = tokens[1].lower()
+    words = _split_words(tokens[2:])
+    user_id = message.author.id
+    zone = subscription_scheduler.timezone.key
+    if action == "subscribe":
+        minute = parse_time(words[-1]) if len(words) > 1 else None
+        if minute is None:
+            return f"Usage: {tokens[0]} subscribe <city> <HH:MM>, e.g. {tokens[0]} subscribe esbjerg 07:30 ({zone} time)"  # pylint:disable=line-too-long
+        city = " ".join(words[:-1])
+        try:
+            await run_blocking(get_lat_long, city)
+        except AttributeError as error:
+            return Weather(city=city)._error(error)  # pylint:disable=protected-access
+        added = await run_blocking(weather_subscriptions.add, user_id, message.channel.id, city, minute)
+        if not added:
+            return f"You already have {weather_subscriptions.max_per_user} weather subscriptions, unsubscribe from one first"  # pylint:disable=line-too-long
+        subscription_scheduler.schedule(minute)
+        return f"I will post the weather for {city.title()} here every day at {format_time(minute)} ({zone} time)"  # pylint:disable=line-too-long
+    if action == "unsubscribe":
+        city = " ".join(words) or None
+        removed = await run_blocking(weather_subscriptions.remove, user_id, city)
+        if not removed:
+            return "You have no weather subscriptions" if city is None else f"You are not subscribed to the weather for {city.title()}"  # pylint:disable=line-too-long
+        return f"Removed {removed} weather subscription{'s' if removed != 1 else ''}"
+    subscriptions = await run_blocking(weather_subscriptions.for_user, user_id)
+    if not subscriptions:
+        return f"You have no weather subscriptions, add one with {tokens[0]} subscribe <city> <HH:MM>"
+    lines = [f"Your weather subscriptions ({zone} time):"]
+    lines += [
+        f"{format_time(subscription.minute)} {subscription.city.title()} in <#{subscription.channel_id}>"
+        for subscription in subscriptions
+    ]
+    return "\n".join(lines)
+
+
+@plugin.command(
+    Commands().weather_commands(), concurrency=4, queue=8,
+    usage='[city ...] ["city name"] [1-5d] | subscribe <city> <HH:MM> | unsubscribe [city] | subscriptions',  # pylint:disable=line-too-long
+    help="Get the weather, or a forecast of up to 5 days, for one or more cities, or have it posted every day",  # pylint:disable=line-too-long
+)
+async def weather(message, tokens):
+    """
+    Replies with the weather (or forecast) of the cities given in the message, or of the
+    guild's default city (Esbjerg unless configured) if no city was given. Subscriptions
+    are handled by subscription_command.
+    """
+    if len(tokens) > 1 and tokens[1].lower() in SUBSCRIPTION_COMMANDS:
+        return await subscription_command(message, tokens)
+    cities, days = parse_weather_args(tokens)
+    if not cities:
+        cities = [guild_configs.get(message.guild.id if message.guild is not None else None).city]
+    return await weather_report(cities, days)